@@ -139,10 +139,41 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     except Exception as e:
         log.warning("⚠ Init Supabase Career Coaching: %s", e)
 
+    # 6) Worker d'ingestion des saisies salariales (rejoue le spool non traité)
+    try:
+        from services.salary_ingestion import salary_ingestion
+        salary_ingestion.start()
+        log.info("✓ Worker d'ingestion salaires démarré")
+    except Exception as e:
+        salary_ingestion = None
+        log.warning("⚠ Worker d'ingestion salaires: %s", e)
+
     log.info("✅ Application démarrée")
     yield
     log.info("🛑 Arrêt de l'application...")
 
+    if salary_ingestion:
+        salary_ingestion.stop()
+
+    # Arrêt du pool de processus OCR et de la file d'uploads
+    try:
+        from services.ocr_service import ocr_engine
+        ocr_engine.shutdown()
+    except Exception as e:
+        log.warning("⚠ Arrêt pool OCR: %s", e)
+    try:
+        from services.work_queue import upload_queue
+        upload_queue.shutdown()
+    except Exception as e:
+        log.warning("⚠ Arrêt file d'uploads: %s", e)
+
+    # Fermeture du pool HTTP Gemini
+    try:
+        from services.gemini_client import gemini_client
+        await gemini_client.aclose()
+    except Exception as e:
+        log.warning("⚠ Fermeture client Gemini: %s", e)
+
 # ── App ──────────────────────────────────────────────────────────────────
 app = FastAPI(
     title=settings.APP_NAME,
@@ -34,6 +34,10 @@ async def build_index():
 async def status():
     return {
         "index_ready": supabase_doc_rag.index is not None,
+        "index": supabase_doc_rag.indexes.stats(),
+        "metaCache": supabase_doc_rag.meta_cache_info(),
+        "corpora": supabase_doc_rag.corpora_stats(),
+        "corpusEvictions": supabase_doc_rag.corpora_evictions,
     }
 
 
@@ -80,6 +84,14 @@ async def chunk_specific_doc(doc_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/doc-rag/index-document")
+async def index_specific_doc(doc_id: str):
+    """Chunke, encode et ajoute un document à l'index sans reconstruction"""
+    try:
+        return supabase_doc_rag.index_document(doc_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/doc-rag/documents-count")
 async def get_documents_count():
     """Retourne le nombre de documents dans Supabase"""
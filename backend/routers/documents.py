@@ -1,12 +1,24 @@
 # routers/documents.py
+import hashlib
+import os
+
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from services.ocr_service import extract_text_from_pdf, extract_text_from_image
+from fastapi.concurrency import run_in_threadpool
+from services.ocr_service import aextract_pages, join_pages, pages_report
 from services.supabase_doc_rag_service import supabase_doc_rag
-from services.gemini_doc import analyze_with_gemini_with_context
+from services.gemini_doc import aanalyze_with_gemini_with_context, anarrate_payslip_with_gemini
+from services.payslip_extractor import payslip_extractor
+from services.payroll_rules import payroll_rules, declared_from_analysis
+from services.work_queue import upload_queue, Overloaded
+from pydantic import BaseModel
+from services.document_cache import document_cache
 from typing import Any, Dict, List, Optional
 
 router = APIRouter()
 
+# Sur le chemin rapide, demander quand même à Gemini la partie narrative (prompt court)
+FAST_PATH_NARRATIVE = os.getenv("DOC_FAST_PATH_NARRATIVE", "1") != "0"
+
 
 # ───────────────────────── Helpers ─────────────────────────
 
@@ -22,7 +34,7 @@ def _num(x, default: float = 0.0) -> float:
     except Exception:
         return float(default)
 
-def build_global_analysis(analysis: Dict[str, Any]) -> Dict[str, Any]:
+def build_global_analysis(analysis: Dict[str, Any], payroll_check: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Construit une synthèse dynamique pour l'UI à partir de l'analyse LLM.
     Renvoie:
@@ -91,6 +103,12 @@ def build_global_analysis(analysis: Dict[str, Any]) -> Dict[str, Any]:
     highlights.append(f"Taux de prélèvement: {deduction_rate:.1f}%")
     if flags:
         highlights.extend(flags)
+    # Recalcul local CNSS/AMO/IR (barème de l'année)
+    if payroll_check and payroll_check.get("consistent") is not None:
+        if payroll_check["consistent"]:
+            highlights.append(f"Retenues conformes au barème {payroll_check['year']}")
+        elif status == "ok":
+            status = "warning"
 
     # Si le LLM a déjà fourni une synthèse (meta.summary), on la privilégie
     meta_summary = (analysis.get("meta") or {}).get("summary")
@@ -121,78 +139,172 @@ def build_global_analysis(analysis: Dict[str, Any]) -> Dict[str, Any]:
 async def upload_document(file: UploadFile = File(...)):
     file_bytes = await file.read()
     try:
-        # 1) OCR selon le type MIME
-        if file.content_type == "application/pdf":
-            text = extract_text_from_pdf(file_bytes)
-        elif file.content_type in {"image/jpeg", "image/jpg", "image/png"}:
-            text = extract_text_from_image(file_bytes)
-        else:
+        if file.content_type not in {"application/pdf", "image/jpeg", "image/jpg", "image/png"}:
             raise HTTPException(
                 status_code=415,
                 detail=f"Format non pris en charge: {file.content_type}",
             )
 
-        # 2) Stockage + indexation RAG (best-effort)
+        # 0) Cache adressé par contenu: un fichier déjà analysé est servi tel quel
+        #    (sans passer par la file d'admission)
+        sha256 = await run_in_threadpool(lambda: hashlib.sha256(file_bytes).hexdigest())
+        cached = await run_in_threadpool(document_cache.get, sha256) or {}
+        if cached.get("response"):
+            return {**cached["response"], "fileName": file.filename,
+                    "cache": {"hit": True, "sha256": sha256, "doc_id": cached.get("doc_id")}}
+
+        # Admission: au-delà de la capacité de la file, 429 immédiat plutôt qu'un timeout
         try:
-            doc_id = supabase_doc_rag.store_user_document(
+            async with upload_queue.admit():
+                return await _analyze_upload(file, file_bytes, sha256, cached)
+        except Overloaded as e:
+            raise HTTPException(
+                status_code=429,
+                detail="Trop d'analyses en cours, réessayez plus tard",
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+    finally:
+        await file.close()
+
+
+async def _analyze_upload(file: UploadFile, file_bytes: bytes, sha256: str, cached: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pipeline d'un upload admis: les étapes CPU (encodage, FAISS, extraction) tournent
+    dans le pool borné de `upload_queue`, les E/S (Supabase, Gemini) en async ou dans
+    le threadpool: la boucle d'événements reste disponible pendant l'analyse.
+    """
+    # 1) OCR selon le type MIME (sauf si le texte est déjà en cache)
+    # (couche texte du PDF quand elle existe, Tesseract pour les pages scannées)
+    text, extraction = cached.get("text"), cached.get("extraction")
+    complete = True
+    if text is None:
+        pages = await aextract_pages(file_bytes, file.content_type)
+        text, extraction = join_pages(pages), pages_report(pages)
+        # Page en erreur ou en timeout: texte partiel, le prochain upload refera l'OCR
+        complete = not any(p.error for p in pages)
+        if complete:
+            await run_in_threadpool(document_cache.put, sha256, text=text, extraction=extraction,
+                                    mime=file.content_type)
+
+    # 2) Stockage + indexation RAG (best-effort, une seule ligne `documents` par contenu)
+    doc_id = cached.get("doc_id")
+    if doc_id is None:
+        try:
+            doc_id = await run_in_threadpool(
+                supabase_doc_rag.store_user_document,
                 title=file.filename or "Document utilisateur",
                 text=text,
                 user_id=1,  # TODO: remplacer par l'ID utilisateur réel
                 mime_type=file.content_type,
                 source="user_upload"
             )
-            supabase_doc_rag.chunk_and_store_documents(doc_id=doc_id)
-            supabase_doc_rag.embed_new_chunks()
-            supabase_doc_rag.build_or_load_faiss()
+            if complete:
+                await run_in_threadpool(document_cache.put, sha256, doc_id=doc_id)
+            # Indexation du seul document (chunks + vecteurs ajoutés à l'index courant)
+            await upload_queue.run(supabase_doc_rag.index_document, doc_id)
         except Exception as e:
             print(f"⚠️ Erreur stockage/indexation: {e}")
 
-        # 3) RAG: recherche de contexte
-        hits = supabase_doc_rag.search(text, top_k=6)
-        contexts = [_get(h, "text") for h in hits if _get(h, "text")]
+    # 3) RAG: recherche de contexte
+    hits = await upload_queue.run(supabase_doc_rag.search, text, top_k=6)
+    contexts = [_get(h, "text") for h in hits if _get(h, "text")]
 
-        # 4) Analyse LLM enrichie par le contexte
-        analysis = analyze_with_gemini_with_context(text, contexts)
+    # 4) Chemin rapide: extraction déterministe des montants; Gemini seulement
+    #    si la confiance est insuffisante (ou pour la seule partie narrative)
+    extracted = await upload_queue.run(payslip_extractor.extract, text)
+    if extracted.confident:
+        analysis = extracted.analysis()
+        if FAST_PATH_NARRATIVE:
+            narrative = await anarrate_payslip_with_gemini(analysis)
+            analysis["anomalies"] = narrative.get("anomalies") or []
+            analysis["recommandations"] = narrative.get("recommandations") or []
+            analysis["meta"]["summary"] = (narrative.get("meta") or {}).get("summary")
+    else:
+        # Analyse LLM enrichie par le contexte
+        analysis = await aanalyze_with_gemini_with_context(text, contexts)
         if isinstance(analysis, dict) and "error" in analysis:
             raise HTTPException(status_code=500, detail="Erreur d'analyse Gemini")
         if not isinstance(analysis, dict):
             analysis = {}
+        analysis.setdefault("meta", {}).update(source="gemini", confidence=extracted.confidence)
 
-        # 5) Mapping UI
-        analysis_ui = {
-            "resume": {
-                "salaireBrut": analysis.get("resume", {}).get("salaireBrut", 0),
-                "salaireNet": analysis.get("resume", {}).get("salaireNet", 0),
-                "cotisations": analysis.get("resume", {}).get("cotisations", 0),
-                "impots": analysis.get("resume", {}).get("impots", 0),
-            },
-            "details": analysis.get("details", {}),
-            "anomalies": analysis.get("anomalies", []),
-            "recommandations": analysis.get("recommandations", []),
-        }
-
-        # 6) Analyse globale dynamique
-        analysis_global = build_global_analysis(analysis)
-
-        # 7) Réponse
-        return {
-            "fileName": file.filename,
-            "mime": file.content_type,
-            "contexts": contexts,
-            "context_used": [
-                {
-                    "title": _get(h, "title"),
-                    "source": _get(h, "source"),
-                    "url": _get(h, "url"),
-                    "ord": _get(h, "ord"),
-                    "score": _get(h, "score"),
-                }
-                for h in hits
-            ],
-            "analysis": analysis_ui,
-            "analysis_global": analysis_global,   # ← bloc prêt pour l’UI
-            "analysis_raw": analysis,             # debug
-        }
+    # 4b) Vérification locale des retenues (CNSS, AMO, IR) selon le barème de l'année
+    payroll_check = payroll_rules.verify(declared_from_analysis(analysis),
+                                         year=payroll_rules.guess_year(text))
+    known = {a.get("titre") for a in analysis.get("anomalies", []) if isinstance(a, dict)}
+    analysis["anomalies"] = [a for a in payroll_check["anomalies"] if a["titre"] not in known] \
+        + list(analysis.get("anomalies") or [])
 
-    finally:
-        await file.close()
+    # 5) Mapping UI
+    analysis_ui = {
+        "resume": {
+            "salaireBrut": analysis.get("resume", {}).get("salaireBrut", 0),
+            "salaireNet": analysis.get("resume", {}).get("salaireNet", 0),
+            "cotisations": analysis.get("resume", {}).get("cotisations", 0),
+            "impots": analysis.get("resume", {}).get("impots", 0),
+        },
+        "details": analysis.get("details", {}),
+        "anomalies": analysis.get("anomalies", []),
+        "recommandations": analysis.get("recommandations", []),
+    }
+
+    # 6) Analyse globale dynamique
+    analysis_global = build_global_analysis(analysis, payroll_check)
+
+    # 7) Réponse (mise en cache pour les uploads identiques suivants)
+    response = {
+        "fileName": file.filename,
+        "mime": file.content_type,
+        "contexts": contexts,
+        "context_used": [
+            {
+                "title": _get(h, "title"),
+                "source": _get(h, "source"),
+                "url": _get(h, "url"),
+                "ord": _get(h, "ord"),
+                "score": _get(h, "score"),
+            }
+            for h in hits
+        ],
+        "analysis": analysis_ui,
+        "analysis_global": analysis_global,   # ← bloc prêt pour l’UI
+        "analysis_raw": analysis,             # debug
+        "extraction": extraction,             # moteur + durée par page
+        "payroll_check": payroll_check,       # montants attendus vs déclarés
+    }
+    if complete:
+        await run_in_threadpool(document_cache.put, sha256, response=response)
+    return {**response, "cache": {"hit": False, "sha256": sha256, "doc_id": doc_id}}
+
+
+@router.get("/cache")
+async def document_cache_stats():
+    return document_cache.stats()
+
+
+class PayrollVerifyRequest(BaseModel):
+    payslips: List[Dict[str, Any]]
+    year: Optional[int] = None
+
+
+@router.post("/payroll/verify")
+async def verify_payroll(req: PayrollVerifyRequest):
+    """
+    Recalcul vectorisé d'un lot de bulletins:
+    [{"salaireBrut", "cnss", "amo", "ir", "salaireNet", "dependents"?, "year"?}, ...]
+    """
+    results = payroll_rules.verify_batch(req.payslips, year=req.year)
+    return {"count": len(results), "inconsistent": sum(r["consistent"] is False for r in results),
+            "results": results}
+
+
+@router.get("/queue")
+async def upload_queue_stats():
+    return upload_queue.stats()
+
+
+@router.get("/extractor")
+async def payslip_extractor_stats():
+    """Taux de passage par l'extraction déterministe (sans appel Gemini complet)."""
+    return payslip_extractor.stats()
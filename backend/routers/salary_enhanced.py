@@ -1,9 +1,16 @@
 # routers/salary_enhanced.py
-from fastapi import APIRouter, HTTPException
+import asyncio
+import json
+
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, validator
 from typing import List, Optional, Any, Dict
 
 from services.supabase_salary_rag_service import supabase_salary_rag
+from services.analysis_jobs import salary_analysis_jobs
+from services.salary_ingestion import salary_ingestion
 
 router = APIRouter()
 
@@ -67,6 +74,59 @@ class SalaryResponse(BaseModel):
     dataQuality: Optional[dict] = None
     marketUsed: Optional[str] = None
 
+class SalaryFastResponse(BaseModel):
+    analysisId: str
+    narrativeStatus: str
+    moyenne: int
+    ecart: int
+    ecart_pourcent: float
+    minimum: int
+    maximum: int
+    percentile: int
+    salaireActuel: int
+    jobTitle: str
+    location: str
+    experienceYears: int
+    dataQuality: Optional[dict] = None
+    marketUsed: Optional[str] = None
+
+def _submit_entry(data: SalaryRequest) -> str:
+    """Met la saisie en file d'ingestion (spool local) et retourne le ticket."""
+    return salary_ingestion.submit({
+        "jobTitle": data.jobTitle,
+        "location": data.location,
+        "experienceYears": data.experienceYears,
+        "currentSalary": data.currentSalary,
+        "userId": 1,  # À remplacer par l'ID utilisateur authentifié
+    })
+
+def _enrich_result(result: Dict[str, Any], data: SalaryRequest, status: str, row_id: Optional[int],
+                   chunks_created: int, ingestion_id: Optional[str] = None) -> Dict[str, Any]:
+    """Ajoute les champs de la requête et les métadonnées d'ingestion au résultat d'analyse."""
+    result.update({
+        "salaireActuel": data.currentSalary,
+        "jobTitle": data.jobTitle,
+        "location": data.location,
+        "experienceYears": data.experienceYears,
+    })
+    
+    # Ajout métadonnées techniques si pas présentes
+    if "dataQuality" not in result:
+        result["dataQuality"] = {
+            "source": "supabase",
+            "unit": "MAD/mois",
+            "entryStatus": status,
+            "rowId": row_id,
+            "chunksCreated": chunks_created,
+            "ingestionId": ingestion_id,
+        }
+    else:
+        result["dataQuality"]["entryStatus"] = status
+        result["dataQuality"]["rowId"] = row_id
+        result["dataQuality"]["chunksCreated"] = chunks_created
+        result["dataQuality"]["ingestionId"] = ingestion_id
+    return result
+
 @router.get("/")
 async def salary_enhanced_documentation():
     """Documentation de l'API d'analyse salariale"""
@@ -89,9 +149,14 @@ async def salary_enhanced_documentation():
         ],
         "endpoints": {
             "POST /api/salary-enhanced/analyze": "Analyse salariale complète",
+            "POST /api/salary-enhanced/analyze/fast": "Chiffres immédiats + analysisId (narratif Gemini différé)",
+            "GET  /api/salary-enhanced/analyze/{analysisId}": "Polling du narratif différé",
+            "GET  /api/salary-enhanced/analyze/{analysisId}/events": "Narratif différé en Server-Sent Events",
             "POST /api/salary-enhanced/dataset/backfill": "Créer chunks/embeddings depuis salary_dataset",
             "POST /api/salary-enhanced/dataset/reload": "Recharger l'index FAISS",
             "GET  /api/salary-enhanced/dataset/status": "Statut du système RAG",
+            "GET  /api/salary-enhanced/ingestion/status": "File d'ingestion des saisies (profondeur, retard)",
+            "GET  /api/salary-enhanced/ingestion/{ingestionId}": "Résultat d'ingestion d'une saisie",
             "POST /api/salary-enhanced/dataset/validate": "Valider données existantes",
         },
     }
@@ -108,62 +173,118 @@ async def analyze_salary(data: SalaryRequest):
     - Retourne analyse complète avec Gemini AI
     """
     try:
+        # Les étapes bloquantes (Supabase, encodage, FAISS) tournent dans le threadpool
+        # et l'attente Gemini est async: la boucle d'événements reste disponible.
         # 1. Initialisation et seed si nécessaire
-        init_result = supabase_salary_rag.seed_if_needed()
+        init_result = await run_in_threadpool(supabase_salary_rag.seed_if_needed)
         
-        # 2. Stockage de l'entrée utilisateur avec validation intelligente
-        row_id, status = supabase_salary_rag.store_user_entry(
-            job_title=data.jobTitle,
-            location=data.location,
-            experience_years=data.experienceYears,
-            current_salary=float(data.currentSalary),
-            user_id=1,  # À remplacer par l'ID utilisateur authentifié
-        )
-        
-        # 3. Chunking et embedding uniquement si entrée valide
-        chunks_created = 0
-        if status.lower().startswith("valide"):
-            try:
-                supabase_salary_rag.chunk_row(row_id)
-                chunks_created = supabase_salary_rag.embed_new_chunks()
-                supabase_salary_rag.build_or_load_faiss()
-            except Exception as e:
-                print(f"Avertissement chunking/embedding: {str(e)}")
+        # 2-3. Validation, stockage, chunking et indexation: confiés au worker d'ingestion
+        ingestion_id = _submit_entry(data)
 
         # 4. Analyse complète avec Gemini
-        analysis_result: Dict[str, Any] = supabase_salary_rag.analyze_with_gemini(
+        analysis = await run_in_threadpool(
+            supabase_salary_rag.compute_market_stats,
             data.jobTitle, data.location, data.experienceYears, data.currentSalary
         )
+        analysis_result: Dict[str, Any] = await supabase_salary_rag.acomplete_analysis(
+            data.jobTitle, data.location, data.experienceYears, data.currentSalary, analysis
+        )
         
         # 5. Enrichissement de la réponse
-        analysis_result.update({
+        return _enrich_result(analysis_result, data, "en_attente", None, 0, ingestion_id)
+        
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Données invalides: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur analyse salariale: {str(e)}")
+
+async def _complete_analysis_job(analysis_id: str, data: SalaryRequest, analysis: Dict[str, Any],
+                                 ingestion_id: str) -> None:
+    """Phase 2 (tâche de fond): narratif Gemini; la saisie suit la file d'ingestion."""
+    try:
+        result = await supabase_salary_rag.acomplete_analysis(
+            data.jobTitle, data.location, data.experienceYears, data.currentSalary, analysis
+        )
+        ingestion = salary_ingestion.get(ingestion_id) or {}
+        salary_analysis_jobs.complete(analysis_id, _enrich_result(
+            result, data, ingestion.get("entryStatus") or "en_attente", ingestion.get("rowId"),
+            1 if ingestion.get("indexed") else 0, ingestion_id,
+        ))
+    except Exception as e:
+        salary_analysis_jobs.fail(analysis_id, str(e))
+
+@router.post("/analyze/fast", response_model=SalaryFastResponse)
+async def analyze_salary_fast(data: SalaryRequest, background_tasks: BackgroundTasks):
+    """
+    Analyse en deux temps: renvoie immédiatement moyenne, minimum, maximum,
+    percentile et dataQuality calculés sur le dataset, plus un analysisId.
+    Le stockage de la saisie et le narratif Gemini (recommandations, tendances,
+    étapes) sont produits en tâche de fond et consultables via
+    GET /analyze/{analysisId} ou /analyze/{analysisId}/events.
+    """
+    try:
+        fast_result, analysis = await run_in_threadpool(
+            supabase_salary_rag.fast_analysis,
+            data.jobTitle, data.location, data.experienceYears, data.currentSalary
+        )
+        ingestion_id = _submit_entry(data)
+        analysis_id = salary_analysis_jobs.create({"jobTitle": data.jobTitle, "location": data.location})
+        background_tasks.add_task(_complete_analysis_job, analysis_id, data, analysis, ingestion_id)
+
+        fast_result.update({
+            "analysisId": analysis_id,
+            "narrativeStatus": "pending",
             "salaireActuel": data.currentSalary,
             "jobTitle": data.jobTitle,
             "location": data.location,
             "experienceYears": data.experienceYears,
         })
-        
-        # Ajout métadonnées techniques si pas présentes
-        if "dataQuality" not in analysis_result:
-            analysis_result["dataQuality"] = {
-                "source": "supabase",
-                "unit": "MAD/mois",
-                "entryStatus": status,
-                "rowId": row_id,
-                "chunksCreated": chunks_created
-            }
-        else:
-            analysis_result["dataQuality"]["entryStatus"] = status
-            analysis_result["dataQuality"]["rowId"] = row_id
-            analysis_result["dataQuality"]["chunksCreated"] = chunks_created
-        
-        return analysis_result
-        
+        fast_result.setdefault("dataQuality", {})["ingestionId"] = ingestion_id
+        return fast_result
+
     except ValueError as e:
         raise HTTPException(status_code=422, detail=f"Données invalides: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur analyse salariale: {str(e)}")
 
+@router.get("/analyze/{analysis_id}")
+async def get_analysis_result(analysis_id: str):
+    """
+    Polling du narratif différé: status = pending | done | error.
+    Quand status = done, `result` contient la réponse complète (format SalaryResponse).
+    """
+    job = salary_analysis_jobs.get(analysis_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Analyse inconnue ou expirée")
+    return {
+        "analysisId": analysis_id,
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+@router.get("/analyze/{analysis_id}/events")
+async def stream_analysis_result(analysis_id: str, timeout: float = 120.0):
+    """Même information que le polling, poussée en Server-Sent Events à la fin de la génération."""
+    if salary_analysis_jobs.get(analysis_id) is None:
+        raise HTTPException(status_code=404, detail="Analyse inconnue ou expirée")
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            job = salary_analysis_jobs.get(analysis_id)
+            if job is None or job["status"] != "pending" or loop.time() >= deadline:
+                status = job["status"] if job else "expired"
+                payload = {"analysisId": analysis_id, "status": status,
+                           "result": job["result"] if job else None, "error": job["error"] if job else None}
+                yield f"event: narrative\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                return
+            yield ": pending\n\n"
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @router.post("/dataset/backfill")
 async def dataset_backfill():
     """
@@ -184,6 +305,7 @@ async def dataset_backfill():
             "success": True,
             "chunks_created": created_result.get("created", 0),
             "rows_scanned": created_result.get("scanned", 0),
+            "backfill_timings": created_result.get("timings", {}),
             "embeddings_created": embedded_count,
             "faiss_rebuilt": faiss_ok,
             "status": supabase_salary_rag.status()
@@ -215,6 +337,13 @@ async def dataset_reload():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur reload: {str(e)}")
 
+def _count(table, where=None) -> int:
+    """Nombre exact de lignes d'une table (une seule ligne transférée)."""
+    q = table.select("id", count="exact")
+    if where is not None:
+        q = where(q)
+    return q.limit(1).execute().count or 0
+
 @router.get("/dataset/status")
 async def dataset_status():
     """
@@ -225,9 +354,11 @@ async def dataset_status():
         
         # Statistiques additionnelles de la DB
         try:
-            dataset_count = len(supabase_salary_rag.supabase.table("salary_dataset").select("id").execute().data or [])
-            chunks_count = len(supabase_salary_rag.supabase.table("salary_chunks").select("id").execute().data or [])
-            valid_count = len(supabase_salary_rag.supabase.table("salary_dataset").select("id").ilike("status", "valide%").execute().data or [])
+            # Comptes calculés côté base (count="exact"): pas de plafond de lignes PostgREST
+            db = supabase_salary_rag.supabase
+            dataset_count = _count(db.table("salary_dataset"))
+            chunks_count = _count(db.table("salary_chunks"))
+            valid_count = _count(db.table("salary_dataset"), lambda q: q.ilike("status", "valide%"))
         except:
             dataset_count = chunks_count = valid_count = 0
             
@@ -238,7 +369,8 @@ async def dataset_status():
                 "valid_entries": valid_count,
                 "invalid_entries": dataset_count - valid_count
             },
-            "system_ready": status.get("faissLoaded", False) and status.get("rows", 0) > 0
+            "system_ready": status.get("faissLoaded", False) and status.get("rows", 0) > 0,
+            "ingestion": salary_ingestion.stats(),
         })
         
         return status
@@ -246,6 +378,22 @@ async def dataset_status():
     except Exception as e:
         return {"error": str(e), "system_ready": False}
 
+@router.get("/ingestion/status")
+async def ingestion_status():
+    """
+    Statut de la file d'ingestion des saisies: profondeur, retard de la plus
+    ancienne saisie en attente, lots traités et dernier lot.
+    """
+    return salary_ingestion.stats()
+
+@router.get("/ingestion/{ingestion_id}")
+async def ingestion_result(ingestion_id: str):
+    """Résultat d'ingestion d'une saisie (queued, done avec rowId/entryStatus, ou error)."""
+    result = salary_ingestion.get(ingestion_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Saisie inconnue ou expirée")
+    return result
+
 @router.post("/dataset/validate")
 async def validate_dataset():
     """
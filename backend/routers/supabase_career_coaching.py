@@ -1,7 +1,7 @@
 # routers/supabase_career_coaching.py
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from services.supabase_career_coaching_service import career_coaching_service
 from services.careerPromt import generate_career_plan_with_rag as llm_generate_career_plan_with_rag
 import json
@@ -131,6 +131,7 @@ class SystemStatusResponse(BaseModel):
     chunksCount: int
     indexExists: bool
     message: str
+    index: Optional[Dict[str, Any]] = None  # cycle de vie de l'index (vecteurs, mémoire, âge du snapshot)
 
 @router.get("/status", response_model=SystemStatusResponse)
 async def get_system_status():
@@ -161,7 +162,8 @@ async def get_system_status():
 
         return SystemStatusResponse(
             isInitialized=is_initialized, profilesCount=profiles_count,
-            chunksCount=chunks_count, indexExists=index_exists, message=message
+            chunksCount=chunks_count, indexExists=index_exists, message=message,
+            index=career_coaching_service.indexes.stats()
         )
 
     except Exception as e:
@@ -0,0 +1,72 @@
+# services/analysis_jobs.py
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+class AnalysisJobStore:
+    """
+    Registre en mémoire des analyses en deux temps: la réponse rapide renvoie un
+    analysisId, la partie narrative (LLM) est déposée ici plus tard et consultée
+    par polling ou SSE. Les entrées expirent après `ttl_seconds`.
+    """
+
+    def __init__(self, ttl_seconds: int = 900, max_jobs: int = 2000):
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, payload: Optional[Dict[str, Any]] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            self._jobs[job_id] = {
+                "analysisId": job_id,
+                "status": "pending",
+                "createdAt": now,
+                "completedAt": None,
+                "payload": payload or {},
+                "result": None,
+                "error": None,
+            }
+        return job_id
+
+    def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(status="done", result=result, completedAt=time.time())
+
+    def fail(self, job_id: str, error: str) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(status="error", error=error, completedAt=time.time())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._evict(time.time())
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+    def _evict(self, now: float) -> None:
+        expired = [k for k, j in self._jobs.items() if now - j["createdAt"] > self.ttl_seconds]
+        for k in expired:
+            del self._jobs[k]
+        # Borne mémoire: on retire les plus anciennes entrées
+        overflow = len(self._jobs) - self.max_jobs
+        if overflow > 0:
+            for k in sorted(self._jobs, key=lambda k: self._jobs[k]["createdAt"])[:overflow]:
+                del self._jobs[k]
+
+# Instance globale (analyses salariales)
+salary_analysis_jobs = AnalysisJobStore()
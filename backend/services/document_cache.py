@@ -0,0 +1,140 @@
+# services/document_cache.py
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+CACHE_DIR = os.getenv("DOC_CACHE_DIR", os.path.join(os.path.dirname(__file__), "..", "data", "doc_cache"))
+CACHE_MAX_BYTES = int(os.getenv("DOC_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class DocumentCache:
+    """
+    Cache adressé par contenu des documents uploadés (clé = SHA-256 des octets).
+
+    - Une entrée par fichier JSON (<root>/<2 premiers car.>/<sha>.json) contenant
+      le texte extrait, l'id du document en base et la réponse d'analyse finale.
+    - Écriture atomique (fichier temporaire + os.replace); les entrées se
+      complètent au fil du traitement (texte → doc_id → analyse).
+    - Éviction LRU par taille totale: l'ordre d'accès est tenu en mémoire et
+      reconstruit au démarrage à partir des mtime (mis à jour à chaque lecture).
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max(0, max_bytes)
+        self._lock = threading.Lock()
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()   # sha -> taille, du moins au plus récent
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _scan(self) -> None:
+        entries = []
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                path = os.path.join(d, name)
+                if name.endswith(".tmp"):
+                    # écriture interrompue
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name[:-5], st.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+            self._bytes += size
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self._stats["misses"] += 1
+                self._forget(key)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self._stats["hits"] += 1
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return entry
+
+    def put(self, key: str, **fields: Any) -> Dict[str, Any]:
+        """Fusionne `fields` dans l'entrée `key` (créée au besoin) et applique l'éviction."""
+        path = self._path(key)
+        with self._lock:
+            entry: Dict[str, Any] = {}
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                pass
+            entry.update(fields)
+            entry.setdefault("sha256", key)
+            entry.setdefault("createdAt", time.time())
+            entry["updatedAt"] = time.time()
+
+            raw = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(raw)
+            os.replace(tmp, path)
+
+            self._bytes -= self._sizes.pop(key, 0)
+            self._sizes[key] = len(raw)
+            self._bytes += len(raw)
+            self._evict(keep=key)
+        return entry
+
+    def _forget(self, key: str) -> None:
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def _evict(self, keep: str) -> None:
+        while self._bytes > self.max_bytes and self._sizes:
+            key = next(iter(self._sizes))
+            if key == keep:
+                break
+            self._forget(key)
+            self._stats["evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._sizes),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hitRate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+# Instance globale (uploads de documents)
+document_cache = DocumentCache()
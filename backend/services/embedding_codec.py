@@ -0,0 +1,113 @@
+# services/embedding_codec.py
+import json, re, warnings
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_SPLIT_RE = re.compile(r"[,\s]+")
+
+
+def decode_embedding(raw: Any) -> Optional[np.ndarray]:
+    """
+    Décode un embedding unique (list[float], np.ndarray ou texte pgvector '[...]')
+    en vecteur float32. Retourne None si la valeur est vide ou illisible.
+    """
+    if raw is None:
+        return None
+    try:
+        if isinstance(raw, np.ndarray):
+            return raw.astype(np.float32, copy=False).ravel()
+        if isinstance(raw, (list, tuple)):
+            return np.asarray(raw, dtype=np.float32)
+        if isinstance(raw, str):
+            s = raw.strip()
+            if s.startswith("[") and s.endswith("]"):
+                return np.asarray(json.loads(s), dtype=np.float32)
+            vals = [x for x in _SPLIT_RE.split(s.strip("()[]{}")) if x]
+            return np.asarray([float(x) for x in vals], dtype=np.float32)
+    except (ValueError, TypeError):
+        return None
+    return None
+
+
+def _text_body(s: str) -> str:
+    return s.strip().strip("[]")
+
+
+def decode_embeddings(payloads: Sequence[Any], dim: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Décode une page d'embeddings en une seule matrice (n_valides, dim) float32.
+
+    - Textes pgvector (PostgREST renvoie le type vector en texte): corps
+      concaténés puis un seul np.fromstring(sep=","), sans liste Python
+      intermédiaire ni petit tableau par ligne.
+    - Listes JSON: une seule conversion np.asarray sur le bloc.
+    - Dimensions validées en une passe (nombre de séparateurs par texte);
+      si `dim` est None, la dimension majoritaire de la page est retenue.
+
+    Retourne (X, valid) où valid est un masque booléen (n,) aligné sur `payloads`
+    et X contient les lignes valides dans l'ordre.
+    """
+    n = len(payloads)
+    lens = np.zeros(n, dtype=np.int64)
+    kinds = np.zeros(n, dtype=np.int8)  # 0 = vide/illisible, 1 = texte, 2 = séquence/ndarray
+    for i, p in enumerate(payloads):
+        if isinstance(p, str):
+            body = _text_body(p)
+            if body:
+                kinds[i] = 1
+                lens[i] = body.count(",") + 1
+        elif isinstance(p, (list, tuple, np.ndarray)):
+            if len(p):
+                kinds[i] = 2
+                lens[i] = len(p)
+
+    if dim is None:
+        present = lens[kinds > 0]
+        dim = int(np.bincount(present).argmax()) if present.size else 0
+    valid = (kinds > 0) & (lens == dim)
+    X = np.empty((int(valid.sum()), dim), dtype=np.float32)
+    if not X.shape[0]:
+        return X, valid
+
+    out_pos = np.cumsum(valid) - 1
+
+    text_idx = np.flatnonzero(valid & (kinds == 1))
+    if text_idx.size:
+        joined = ",".join(_text_body(payloads[i]) for i in text_idx)
+        # Analyse en float64 (plus rapide que le chemin float32 de numpy) puis cast unique
+        with warnings.catch_warnings():
+            # Jeton illisible: DeprecationWarning (anciens numpy) ou ValueError (numpy ≥ 2.x),
+            # les deux sont traités par le repli ligne à ligne
+            warnings.simplefilter("ignore", DeprecationWarning)
+            try:
+                flat = np.fromstring(joined, dtype=np.float64, sep=",")
+            except ValueError:
+                flat = None
+        if flat is not None and flat.size == text_idx.size * dim:
+            X[out_pos[text_idx]] = flat.reshape(-1, dim)
+        else:
+            # Jeton illisible quelque part: repli ligne à ligne pour isoler les fautifs
+            for i in text_idx:
+                v = decode_embedding(payloads[i])
+                if v is None or v.shape[0] != dim:
+                    valid[i] = False
+                else:
+                    X[out_pos[i]] = v
+
+    seq_idx = np.flatnonzero(valid & (kinds == 2))
+    if seq_idx.size:
+        try:
+            X[out_pos[seq_idx]] = np.asarray([payloads[i] for i in seq_idx], dtype=np.float32).reshape(-1, dim)
+        except (ValueError, TypeError):
+            for i in seq_idx:
+                v = decode_embedding(payloads[i])
+                if v is None or v.shape[0] != dim:
+                    valid[i] = False
+                else:
+                    X[out_pos[i]] = v
+
+    # Lignes invalidées par le repli: on compacte X sur les positions restantes
+    if X.shape[0] != int(valid.sum()):
+        X = X[out_pos[valid]]
+    return X, valid
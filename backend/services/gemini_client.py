@@ -0,0 +1,129 @@
+# services/gemini_client.py
+import asyncio
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL   = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+
+# Pool de connexions keep-alive + limite d'appels simultanés vers Gemini
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "20"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_TIMEOUT         = float(os.getenv("GEMINI_TIMEOUT", "90"))
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "10"))
+
+
+class GeminiRestClient:
+    """
+    Client REST Gemini (generateContent) à connexions persistantes.
+
+    - Un httpx.Client (sync) et un httpx.AsyncClient (async) réutilisés entre
+      les appels: plus de handshake TCP/TLS à chaque requête.
+    - Un sémaphore borne le nombre d'appels simultanés (GEMINI_MAX_CONCURRENCY).
+    - Timeout par appel surchargeable via `timeout=`.
+    """
+
+    def __init__(self, api_key: Optional[str] = GEMINI_API_KEY, model: str = GEMINI_MODEL,
+                 base_url: str = GEMINI_BASE_URL, max_connections: int = GEMINI_MAX_CONNECTIONS,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY, timeout: float = GEMINI_TIMEOUT,
+                 connect_timeout: float = GEMINI_CONNECT_TIMEOUT):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+
+        self._client: Optional[httpx.Client] = None
+        self._aclient: Optional[httpx.AsyncClient] = None
+        self._init_lock = threading.Lock()
+        self._sync_slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots: Optional[asyncio.Semaphore] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ---------- helpers ----------
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/models/{self.model}:generateContent"
+
+    def _headers(self) -> Dict[str, str]:
+        if not self.api_key:
+            raise RuntimeError("❌ GEMINI_API_KEY manquant dans .env")
+        return {"x-goog-api-key": self.api_key}
+
+    @staticmethod
+    def _payload(prompt: str) -> Dict[str, Any]:
+        return {"contents": [{"parts": [{"text": prompt}]}]}
+
+    @staticmethod
+    def _extract_text(data: Dict[str, Any]) -> str:
+        txt = ""
+        for c in (data.get("candidates") or []):
+            for p in (c.get("content") or {}).get("parts") or []:
+                if "text" in p:
+                    txt += p["text"]
+        return txt.strip()
+
+    def _sync_client(self) -> httpx.Client:
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    self._client = httpx.Client(limits=self._limits, timeout=self._timeout)
+        return self._client
+
+    async def _async_state(self):
+        # Client et sémaphore async sont liés à la boucle d'événements courante
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._async_loop is not loop:
+            old = self._aclient
+            self._aclient = httpx.AsyncClient(limits=self._limits, timeout=self._timeout)
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+            self._async_loop = loop
+            if old is not None:
+                # Connexions de l'ancienne boucle: libérées, même si cette boucle est déjà fermée
+                try:
+                    await old.aclose()
+                except Exception as e:
+                    print(f"[Gemini] Fermeture de l'ancien client async: {e}")
+        return self._aclient, self._async_slots
+
+    # ---------- API ----------
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        headers = self._headers()
+        with self._sync_slots:
+            r = self._sync_client().post(self.url, json=self._payload(prompt), headers=headers,
+                                         timeout=timeout if timeout is not None else self._timeout)
+        r.raise_for_status()
+        return self._extract_text(r.json())
+
+    async def agenerate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        headers = self._headers()
+        client, slots = await self._async_state()
+        async with slots:
+            r = await client.post(self.url, json=self._payload(prompt), headers=headers,
+                                  timeout=timeout if timeout is not None else self._timeout)
+        r.raise_for_status()
+        return self._extract_text(r.json())
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+        self.close()
+
+
+# Instance globale partagée par les services
+gemini_client = GeminiRestClient()
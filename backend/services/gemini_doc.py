@@ -16,14 +16,10 @@ genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel("gemini-2.0-flash-exp")
 
 
-def analyze_with_gemini_with_context(user_text: str, contexts: list) -> dict:
-    """
-    Retourne un dict normalisé (resume, details, anomalies, recommandations, meta.summary optionnel)
-    en utilisant le contexte RAG + le texte OCR.
-    """
+def _context_prompt(user_text: str, contexts: list) -> str:
     ctx_joined = "\n\n--- CONTEXTE ---\n\n".join(contexts[:6])
 
-    prompt = f"""
+    return f"""
 Tu es un assistant d'analyse de documents de paie et contrats pour le Maroc.
 Tu t'appuies d'abord sur le CONTEXTE (règles CNSS, IR, SMIG, congés, heures supp…) et ensuite sur le TEXTE UTILISATEUR.
 
@@ -65,36 +61,106 @@ Règles:
 
 Retourne uniquement l'objet JSON.
 """
-    try:
-        response = model.generate_content(prompt)
-        cleaned = response.text.strip()
 
-        # Nettoyage basique des blocs markdown éventuels
-        if cleaned.startswith("```"):
-            cleaned = cleaned.replace("```json", "").replace("```", "").strip()
 
-        # Retirer retours ligne/contrôles (sans casser les espaces)
-        cleaned = cleaned.replace("\r", "").replace("\n", "")
+def analyze_with_gemini_with_context(user_text: str, contexts: list) -> dict:
+    """
+    Retourne un dict normalisé (resume, details, anomalies, recommandations, meta.summary optionnel)
+    en utilisant le contexte RAG + le texte OCR.
+    """
+    try:
+        response = model.generate_content(_context_prompt(user_text, contexts))
+        return _analysis_from(response.text)
+    except Exception as e:
+        return _analysis_error(e)
+
 
-        # Extraire objet JSON
-        start_idx = cleaned.find("{")
-        end_idx = cleaned.rfind("}")
+async def aanalyze_with_gemini_with_context(user_text: str, contexts: list) -> dict:
+    """Variante async: l'attente Gemini ne bloque pas la boucle d'événements."""
+    try:
+        response = await model.generate_content_async(_context_prompt(user_text, contexts))
+        return _analysis_from(response.text)
+    except Exception as e:
+        return _analysis_error(e)
 
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            json_str = cleaned[start_idx:end_idx + 1]
-            # Debug volontaire (à commenter si besoin)
-            print(f"🔍 JSON extrait (début): {json_str[:200]}...")
-            return json.loads(json_str)
-        else:
-            print(f"❌ Pas de JSON valide trouvé (début): {cleaned[:200]}...")
-            return _fallback_response()
 
+def _analysis_from(text: str) -> dict:
+    try:
+        parsed = _parse_json(text)
     except json.JSONDecodeError as e:
         print(f"❌ Erreur JSON parsing: {e}")
         return _fallback_response()
+    return parsed if parsed is not None else _fallback_response()
+
+
+def _analysis_error(e: Exception) -> dict:
+    print("❌ Erreur Gemini (context):", e)
+    return _fallback_response()
+
+
+def _narrative_prompt(analysis: dict) -> str:
+    figures = json.dumps({"resume": analysis.get("resume", {}), "details": analysis.get("details", {})},
+                         ensure_ascii=False)
+    return f"""
+Tu es un assistant d'analyse de bulletins de paie pour le Maroc (CNSS, AMO, IR, SMIG).
+Voici les montants extraits d'un bulletin (en MAD):
+{figures}
+
+Retourne un JSON strictement valide:
+{{
+  "anomalies": [{{"titre":"...", "description":"...", "impact":"Faible|Moyen|Élevé|Positif"}}],
+  "recommandations": ["...","..."],
+  "meta": {{"summary": "2 à 3 phrases de synthèse en français"}}
+}}
+Aucune balise Markdown. Retourne uniquement l'objet JSON.
+"""
+
+
+def narrate_payslip_with_gemini(analysis: dict) -> dict:
+    """
+    Partie narrative seule (anomalies, recommandations, synthèse) pour un bulletin
+    dont les montants ont déjà été extraits localement: le prompt ne contient que
+    les chiffres, pas le texte OCR ni le contexte RAG. Renvoie {} en cas d'échec.
+    """
+    try:
+        response = model.generate_content(_narrative_prompt(analysis))
+        return _parse_json(response.text) or {}
     except Exception as e:
-        print("❌ Erreur Gemini (context):", e)
-        return _fallback_response()
+        print("❌ Erreur Gemini (narratif):", e)
+        return {}
+
+
+async def anarrate_payslip_with_gemini(analysis: dict) -> dict:
+    """Variante async de narrate_payslip_with_gemini."""
+    try:
+        response = await model.generate_content_async(_narrative_prompt(analysis))
+        return _parse_json(response.text) or {}
+    except Exception as e:
+        print("❌ Erreur Gemini (narratif):", e)
+        return {}
+
+
+def _parse_json(text: str):
+    cleaned = (text or "").strip()
+
+    # Nettoyage basique des blocs markdown éventuels
+    if cleaned.startswith("```"):
+        cleaned = cleaned.replace("```json", "").replace("```", "").strip()
+
+    # Retirer retours ligne/contrôles (sans casser les espaces)
+    cleaned = cleaned.replace("\r", "").replace("\n", "")
+
+    # Extraire objet JSON
+    start_idx = cleaned.find("{")
+    end_idx = cleaned.rfind("}")
+
+    if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
+        json_str = cleaned[start_idx:end_idx + 1]
+        # Debug volontaire (à commenter si besoin)
+        print(f"🔍 JSON extrait (début): {json_str[:200]}...")
+        return json.loads(json_str)
+    print(f"❌ Pas de JSON valide trouvé (début): {cleaned[:200]}...")
+    return None
 
 
 def _fallback_response() -> dict:
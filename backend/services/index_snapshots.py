@@ -0,0 +1,337 @@
+# services/index_snapshots.py
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Nombre de snapshots conservés par service (le courant + les précédents)
+SNAPSHOT_KEEP = int(os.getenv("INDEX_SNAPSHOT_KEEP", "2"))
+# Journal append-only (dans le snapshot courant) des vecteurs ajoutés depuis le dernier snapshot
+DELTA_FILE = "delta.bin"
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def delta_dtype(dim: int) -> np.dtype:
+    """Enregistrement binaire du journal delta: id entier + vecteur normalisé."""
+    return np.dtype([("id", "<i8"), ("vec", "<f4", (dim,))])
+
+
+def append_delta(snapshot_dir: str, ids: List[int], X: np.ndarray) -> None:
+    """Ajoute des vecteurs au journal delta du snapshot (un seul write)."""
+    recs = np.zeros(len(ids), dtype=delta_dtype(X.shape[1]))
+    recs["id"] = ids
+    recs["vec"] = X
+    with open(os.path.join(snapshot_dir, DELTA_FILE), "ab") as f:
+        f.write(recs.tobytes())
+
+
+def read_delta(snapshot_dir: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """-> (ids, vecteurs) du journal delta; un enregistrement tronqué (crash) est ignoré."""
+    dt = delta_dtype(dim)
+    path = os.path.join(snapshot_dir, DELTA_FILE)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.float32)
+    with open(path, "rb") as f:
+        raw = f.read()
+    n = len(raw) // dt.itemsize
+    recs = np.frombuffer(raw[:n * dt.itemsize], dtype=dt)
+    return recs["id"], recs["vec"]
+
+
+class IndexSnapshotStore:
+    """
+    Snapshots versionnés d'un index FAISS: un répertoire par version
+    (index.faiss, map.json, meta.json + fichiers propres au service), écrit dans
+    un répertoire temporaire puis renommé; le fichier CURRENT désigne la version
+    active et n'est remplacé (os.replace) qu'une fois le snapshot complet.
+    Un crash en cours d'écriture laisse donc toujours le snapshot précédent intact.
+    """
+    CURRENT = "CURRENT"
+
+    def __init__(self, root: str, keep: int = SNAPSHOT_KEEP):
+        self.root = root
+        self.keep = max(1, keep)
+        os.makedirs(root, exist_ok=True)
+
+    def current_dir(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, self.CURRENT), "r", encoding="utf-8") as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        path = os.path.join(self.root, version)
+        return path if version and os.path.isdir(path) else None
+
+    def write(self, index: faiss.Index, id_map: List[Any], meta: Optional[Dict[str, Any]] = None,
+              extra: Optional[Callable[[str], None]] = None) -> str:
+        """Écrit un nouveau snapshot et le rend courant. `extra(dir)` écrit les fichiers additionnels."""
+        # Horodatage à la microseconde: l'ordre lexicographique des versions est chronologique
+        version = datetime.now().strftime("%Y%m%dT%H%M%S%f") + f"-{uuid.uuid4().hex[:6]}"
+        tmp = os.path.join(self.root, f".tmp-{version}")
+        os.makedirs(tmp)
+        try:
+            faiss.write_index(index, os.path.join(tmp, "index.faiss"))
+            with open(os.path.join(tmp, "map.json"), "w", encoding="utf-8") as f:
+                json.dump(id_map, f)
+            info = {"version": version, "createdAt": time.time(), "vectors": int(index.ntotal),
+                    "dim": int(index.d), **(meta or {})}
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(info, f, ensure_ascii=False)
+            if extra is not None:
+                extra(tmp)
+            _fsync_dir(tmp)
+            final = os.path.join(self.root, version)
+            os.rename(tmp, final)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        pointer = os.path.join(self.root, f".{self.CURRENT}.tmp")
+        with open(pointer, "w", encoding="utf-8") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer, os.path.join(self.root, self.CURRENT))
+        _fsync_dir(self.root)
+        self._prune()
+        return final
+
+    def load(self) -> Optional[Tuple[faiss.Index, List[Any], Dict[str, Any], str]]:
+        """-> (index, id_map, meta, répertoire) du snapshot courant, ou None."""
+        path = self.current_dir()
+        if path is None:
+            return None
+        index = faiss.read_index(os.path.join(path, "index.faiss"))
+        with open(os.path.join(path, "map.json"), "r", encoding="utf-8") as f:
+            id_map = json.load(f)
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if len(id_map) != index.ntotal:
+            raise ValueError(f"snapshot {path}: map ({len(id_map)}) != index ({index.ntotal})")
+        return index, id_map, meta, path
+
+    def _prune(self) -> None:
+        current = self.current_dir()
+        versions = sorted(
+            d for d in os.listdir(self.root)
+            if not d.startswith(".") and d != self.CURRENT and os.path.isdir(os.path.join(self.root, d))
+        )
+        for d in versions[:-self.keep]:
+            path = os.path.join(self.root, d)
+            if path != current:
+                shutil.rmtree(path, ignore_errors=True)
+        # Répertoires temporaires orphelins (crash pendant une écriture)
+        for d in os.listdir(self.root):
+            if d.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(self.root, d), ignore_errors=True)
+
+
+class ReadWriteLock:
+    """Verrou lecteurs/rédacteur (priorité au rédacteur) pour les mises à jour en place."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+@dataclass(frozen=True)
+class IndexBundle:
+    """
+    Ensemble (index, id_map, données du service) publié par une seule affectation.
+    Une requête qui a lu `manager.bundle` garde le même index même si un rebuild
+    publie un nouveau bundle pendant qu'elle s'exécute.
+
+    Les champs ne sont jamais réaffectés, mais le contenu n'est pas immuable: les
+    ajouts incrémentaux (add_vectors) étendent index, id_map et données en place,
+    sans jamais déplacer une position existante, sous `IndexManager.rw.write()`.
+    Un lecteur prend donc `rw.read()` pour interroger l'index ou lire des structures
+    qui grossissent (colonnes numpy); les positions obtenues restent valides ensuite.
+    """
+    index: Optional[faiss.Index] = None
+    id_map: List[Any] = field(default_factory=list)
+    data: Any = None
+    version: Optional[str] = None
+    built_at: float = field(default_factory=time.time)
+    build_seconds: float = 0.0
+
+    def memory_bytes(self) -> int:
+        if self.index is None:
+            return 0
+        code_size = getattr(self.index, "code_size", self.index.d * 4)
+        return int(self.index.ntotal) * int(code_size)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "vectors": int(self.index.ntotal) if self.index is not None else 0,
+            "dim": int(self.index.d) if self.index is not None else None,
+            "memoryBytes": self.memory_bytes(),
+            "buildSeconds": round(self.build_seconds, 3),
+            "ageSeconds": round(time.time() - self.built_at, 1),
+        }
+
+
+class IndexManager:
+    """
+    Cycle de vie d'un index: snapshots atomiques sur disque, bundle courant
+    remplacé par une seule affectation, rebuilds sérialisés (`building()`) et
+    verrou lecteurs/rédacteur pour les ajouts incrémentaux en place.
+    """
+
+    def __init__(self, name: str, root: str, keep: int = SNAPSHOT_KEEP):
+        self.name = name
+        self.store = IndexSnapshotStore(root, keep=keep)
+        self.bundle = IndexBundle()
+        self.snapshot_path: Optional[str] = None
+        self.snapshot_created_at: Optional[float] = None
+        self.rw = ReadWriteLock()
+        self._build_lock = threading.RLock()
+        self._local = threading.local()
+
+    def current(self) -> IndexBundle:
+        """Bundle figé par `pinned()` pour ce thread, sinon le bundle courant."""
+        return getattr(self._local, "bundle", None) or self.bundle
+
+    @contextmanager
+    def pinned(self):
+        """
+        Fige le bundle courant pour le thread: une requête lit un seul bundle de bout en bout
+        (un rebuild concurrent ne la bascule pas). Ne protège pas des ajouts en place:
+        cf. IndexBundle, les accès à l'index se font sous `rw.read()`.
+        """
+        if getattr(self._local, "bundle", None) is not None:
+            yield self._local.bundle
+            return
+        self._local.bundle = self.bundle
+        try:
+            yield self._local.bundle
+        finally:
+            self._local.bundle = None
+
+    @contextmanager
+    def building(self):
+        """Sérialise les rebuilds/compactages: un seul constructeur à la fois."""
+        with self._build_lock:
+            yield
+
+    def publish(self, index: Optional[faiss.Index], id_map: List[Any], data: Any = None,
+                build_seconds: float = 0.0, persist: bool = False, meta: Optional[Dict[str, Any]] = None,
+                extra: Optional[Callable[[str], None]] = None, version: Optional[str] = None) -> IndexBundle:
+        """Construit le bundle, l'écrit en snapshot si `persist`, puis le rend courant (une affectation)."""
+        with self._build_lock:
+            if persist and index is not None:
+                self._mark_snapshot(self.store.write(index, id_map, meta=meta, extra=extra))
+                version = os.path.basename(self.snapshot_path)
+            bundle = IndexBundle(index=index, id_map=id_map, data=data, version=version,
+                                 build_seconds=build_seconds)
+            self.bundle = bundle
+            return bundle
+
+    def snapshot(self, meta: Optional[Dict[str, Any]] = None, extra: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """Écrit le bundle courant en snapshot sans le remplacer (compactage)."""
+        with self._build_lock:
+            bundle = self.bundle
+            if bundle.index is None:
+                return None
+            with self.rw.read():
+                path = self.store.write(bundle.index, bundle.id_map, meta=meta, extra=extra)
+            self._mark_snapshot(path)
+            return path
+
+    def import_legacy(self, index_path: str, map_path: str,
+                      ids_from: Optional[Callable[[Any], List[Any]]] = None) -> Optional[str]:
+        """
+        Migration des anciens fichiers plats (index .faiss + map JSON, variables
+        *_FAISS_INDEX / *_FAISS_MAP): sans snapshot courant, la paire est copiée dans
+        un premier snapshot que load() reprend ensuite. `ids_from(map)` extrait l'id_map
+        du JSON (et lève ValueError s'il est inexploitable). -> répertoire ou None.
+        """
+        with self._build_lock:
+            if self.store.current_dir() is not None:
+                return None
+            if not (os.path.exists(index_path) and os.path.exists(map_path)):
+                return None
+            try:
+                index = faiss.read_index(index_path)
+                with open(map_path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                id_map = list(ids_from(raw) if ids_from is not None else raw)
+                if len(id_map) != index.ntotal:
+                    raise ValueError(f"map ({len(id_map)}) != index ({index.ntotal})")
+                path = self.store.write(index, id_map, meta={"importedFrom": os.path.abspath(index_path)})
+            except Exception as e:
+                print(f"[{self.name}] Ancien index {index_path} ignoré (reconstruction depuis la base): {e}")
+                return None
+            self._mark_snapshot(path)
+            print(f"[{self.name}] Ancien index {index_path} importé dans le snapshot {os.path.basename(path)}")
+            return path
+
+    def load(self) -> Optional[Tuple[faiss.Index, List[Any], Dict[str, Any], str]]:
+        loaded = self.store.load()
+        if loaded is not None:
+            self._mark_snapshot(loaded[3], loaded[2].get("createdAt"))
+        return loaded
+
+    def _mark_snapshot(self, path: str, created_at: Optional[float] = None) -> None:
+        self.snapshot_path = path
+        self.snapshot_created_at = created_at or time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            **self.bundle.stats(),
+            "snapshot": self.snapshot_path,
+            "snapshotAgeSeconds": round(time.time() - self.snapshot_created_at, 1) if self.snapshot_created_at else None,
+        }
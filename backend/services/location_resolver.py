@@ -0,0 +1,186 @@
+# services/location_resolver.py
+import os, re, unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+LOCATION_CACHE_SIZE = int(os.getenv("LOCATION_CACHE_SIZE", "4096"))
+
+# Base de données flexible des villes par pays
+CITIES_DATABASE = {
+    "Maroc": {
+        "casablanca", "rabat", "tanger", "tangier", "fes", "fès", "marrakech", "marrakesh", "agadir",
+        "meknes", "meknès", "kenitra", "kénitra", "tetouan", "tétouan", "safi", "el jadida", "oujda",
+        "nador", "salé", "sale", "temara", "témara", "mohammedia", "khouribga", "laayoune", "al hoceima",
+        "beni mellal", "berrechid", "berkan", "guelmim"
+    },
+    "France": {
+        "paris", "lyon", "marseille", "toulouse", "nice", "nantes", "montpellier", "strasbourg",
+        "bordeaux", "lille", "rennes", "reims", "toulon", "saint-étienne", "le havre", "grenoble",
+        "dijon", "angers", "nîmes", "villeurbanne"
+    },
+    "United States": {
+        "new york", "los angeles", "chicago", "houston", "phoenix", "philadelphia", "san antonio",
+        "san diego", "dallas", "san jose", "austin", "jacksonville", "fort worth", "columbus",
+        "charlotte", "san francisco", "indianapolis", "seattle", "denver", "boston", "el paso",
+        "detroit", "nashville", "portland", "oklahoma city", "las vegas", "baltimore", "louisville",
+        "milwaukee", "albuquerque", "tucson", "fresno", "sacramento", "mesa", "kansas city",
+        "atlanta", "long beach", "colorado springs", "raleigh", "miami", "virginia beach", "omaha",
+        "oakland", "minneapolis", "tulsa", "arlington", "wichita", "new orleans", "cleveland"
+    },
+    "Canada": {
+        "toronto", "montreal", "vancouver", "calgary", "ottawa", "edmonton", "mississauga", "winnipeg",
+        "quebec", "québec", "halifax", "hamilton", "london", "kitchener", "st. catharines", "niagara",
+        "oshawa", "victoria", "windsor", "saskatoon", "regina", "sherbrooke", "kelowna", "barrie"
+    },
+    "Germany": {
+        "berlin", "hamburg", "munich", "münchen", "cologne", "köln", "frankfurt", "stuttgart",
+        "düsseldorf", "dortmund", "essen", "leipzig", "bremen", "dresden", "hanover", "hannover",
+        "nuremberg", "nürnberg", "duisburg", "bochum", "wuppertal", "bielefeld", "bonn", "münster"
+    },
+    "United Kingdom": {
+        "london", "birmingham", "liverpool", "leeds", "glasgow", "sheffield", "bradford", "edinburgh",
+        "leicester", "manchester", "bristol", "wakefield", "cardiff", "coventry", "nottingham",
+        "newcastle", "belfast", "brighton", "hull", "plymouth", "stoke", "wolverhampton", "derby",
+        "swansea", "southampton", "salford", "aberdeen", "westminster", "portsmouth", "york"
+    }
+}
+
+# Mots-clés de pays (les codes courts ne sont reconnus que seuls, cf. SHORT_CODE_MAX_LEN)
+COUNTRY_KEYWORDS = {
+    "Maroc": ["maroc", "morocco", "ma"],
+    "France": ["france", "french", "fr"],
+    "United States": ["usa", "united states", "etats-unis", "états-unis", "us", "u.s.", "america"],
+    "Canada": ["canada", "canadian", "ca"],
+    "Germany": ["germany", "deutschland", "german", "de"],
+    "United Kingdom": ["uk", "united kingdom", "britain", "england", "scotland", "wales", "gb"]
+}
+SHORT_CODE_MAX_LEN = 2
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def _clean(s: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", (s or "").strip())
+
+def _fold(s: str) -> str:
+    """Minuscules sans accents: 'Fès' et 'fes' deviennent la même clé."""
+    s = unicodedata.normalize("NFKD", s.lower())
+    return "".join(ch for ch in s if not unicodedata.combining(ch))
+
+def _tokens(s: str) -> Tuple[str, ...]:
+    return tuple(_TOKEN_RE.findall(_fold(s)))
+
+def _city_display(city: str) -> str:
+    return city.title().replace("Fes","Fès").replace("Meknes","Meknès")
+
+
+class LocationResolver:
+    """
+    Résolution (ville, pays) compilée une seule fois depuis CITIES_DATABASE.
+
+    - Trie de tokens (mots normalisés sans accents) pour les villes et les
+      mots-clés de pays: correspondances sur frontières de mots uniquement,
+      plus de faux positifs du type "ma" dans "Marché".
+    - Les codes pays courts ("ma", "us", "de"...) ne comptent que lorsqu'ils
+      forment à eux seuls un segment de la saisie ("Casablanca, MA").
+    - Mémo LRU sur l'entrée normalisée.
+    """
+
+    _END = "$"
+
+    def __init__(self, cities: Dict[str, set] = CITIES_DATABASE,
+                 country_keywords: Dict[str, List[str]] = COUNTRY_KEYWORDS,
+                 cache_size: int = LOCATION_CACHE_SIZE):
+        self.country_order = {c: i for i, c in enumerate(cities)}
+        self.city_trie: Dict = {}
+        self.keyword_trie: Dict = {}
+        self.short_codes: Dict[str, str] = {}
+
+        # Ville -> pays (ordre de CITIES_DATABASE) et nom affiché (variante accentuée en priorité)
+        for country, names in cities.items():
+            for name in sorted(names, key=lambda n: (n == _fold(n), n)):
+                toks = _tokens(name)
+                if toks:
+                    self._insert(self.city_trie, toks, country, _city_display(name))
+
+        for country, keywords in country_keywords.items():
+            for kw in keywords:
+                toks = _tokens(kw)
+                if len(toks) == 1 and len(toks[0]) <= SHORT_CODE_MAX_LEN:
+                    self.short_codes.setdefault(toks[0], country)
+                elif toks:
+                    self._insert(self.keyword_trie, toks, country, None)
+
+        self._cached = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _insert(self, trie: Dict, toks: Tuple[str, ...], country: str, display: Optional[str]) -> None:
+        node = trie
+        for t in toks:
+            node = node.setdefault(t, {})
+        entry = node.setdefault(self._END, {"countries": [], "display": display})
+        if country not in entry["countries"]:
+            entry["countries"].append(country)
+
+    @classmethod
+    def _scan(cls, trie: Dict, toks: Tuple[str, ...]) -> List[Tuple[int, int, Dict]]:
+        """Correspondances les plus longues, de gauche à droite: (début, fin, entrée)."""
+        hits, i, n = [], 0, len(toks)
+        while i < n:
+            node, best = trie, None
+            for j in range(i, n):
+                node = node.get(toks[j])
+                if node is None:
+                    break
+                if cls._END in node:
+                    best = (i, j + 1, node[cls._END])
+            if best:
+                hits.append(best)
+                i = best[1]
+            else:
+                i += 1
+        return hits
+
+    def _countries_mentioned(self, folded: str, toks: Tuple[str, ...]) -> List[str]:
+        found = [c for hit in self._scan(self.keyword_trie, toks) for c in hit[2]["countries"]]
+        for segment in folded.split(","):
+            seg = _TOKEN_RE.findall(segment)
+            if len(seg) == 1 and seg[0] in self.short_codes:
+                found.append(self.short_codes[seg[0]])
+        return found
+
+    def _resolve(self, loc: str) -> Tuple[Optional[str], str]:
+        folded = _fold(loc)
+        toks = tuple(_TOKEN_RE.findall(folded))
+        countries = self._countries_mentioned(folded, toks)
+
+        city_hits = self._scan(self.city_trie, toks)
+        if city_hits:
+            # Ville ambiguë (ex: london): le pays cité dans la saisie départage
+            for _, _, entry in city_hits:
+                for country in entry["countries"]:
+                    if country in countries:
+                        return entry["display"], country
+            entry = city_hits[0][2]
+            return entry["display"], entry["countries"][0]
+
+        if countries:
+            return None, min(countries, key=lambda c: self.country_order.get(c, len(self.country_order)))
+
+        # Si rien trouvé, retourner la localisation comme ville générique
+        return (loc.split(",")[0].title(), "Global")
+
+    def resolve(self, location: str) -> Tuple[Optional[str], str]:
+        loc = _clean(location).lower()
+        if not loc:
+            return None, "Global"
+        return self._cached(loc)
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+
+# Instance globale compilée au chargement du module
+location_resolver = LocationResolver()
+
+def guess_city_country(location: str) -> tuple[Optional[str], str]:
+    """Devine la ville et le pays à partir d'une localisation flexible"""
+    return location_resolver.resolve(location)
@@ -1,17 +1,407 @@
 #ocr_services.py
+import asyncio
+import io
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
 import pdfplumber
 import pytesseract
-from PIL import Image
-import io
+from PIL import Image, ImageOps
+
+# Nombre de processus OCR (0 = nombre de CPU) et délai maximal par page
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or (os.cpu_count() or 2)
+OCR_PAGE_TIMEOUT = float(os.getenv("OCR_PAGE_TIMEOUT", "60"))
+# Marge au-delà de laquelle une page qui ne rend pas la main fait recycler le pool
+OCR_PAGE_GRACE = float(os.getenv("OCR_PAGE_GRACE", "10"))
+# Démarrage des processus: pas de fork d'un serveur multi-thread (verrous hérités)
+OCR_MP_START = os.getenv("OCR_MP_START", "") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+# Répertoire des PDF temporaires partagés avec les processus ("" = répertoire système)
+OCR_TMP_DIR = os.getenv("OCR_TMP_DIR", "")
+# Couche texte jugée exploitable à partir de ce nombre de caractères alphanumériques
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "40"))
+# Rastérisation des pages scannées et réglages Tesseract
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_BINARIZE_THRESHOLD = int(os.getenv("OCR_BINARIZE_THRESHOLD", "0"))  # 0 = seuil d'Otsu
+OCR_LANG = os.getenv("OCR_LANG", "")                                      # "" = langue par défaut de Tesseract
+OCR_TESSERACT_CONFIG = os.getenv("OCR_TESSERACT_CONFIG", "--oem 1 --psm 6")
+
+_POLL_SECONDS = 0.2
+
+
+@dataclass
+class PageText:
+    page: int                    # index 0-based dans le document
+    text: str
+    seconds: float
+    error: Optional[str] = None
+    engine: str = "text"         # "text" (couche texte du PDF) | "ocr" (Tesseract)
+
+
+# ---------- travail exécuté dans les processus du pool ----------
+class PageTimeout(Exception):
+    pass
+
+
+# PDF ouvert par le processus courant: les pages d'un même document le réutilisent
+_WORKER_PDF: Dict[str, Any] = {}
+
+
+def _open_pdf(path: str):
+    if _WORKER_PDF.get("path") != path:
+        _close_pdf()
+        _WORKER_PDF.update(path=path, pdf=pdfplumber.open(path))
+    return _WORKER_PDF["pdf"]
+
+
+def _close_pdf() -> None:
+    pdf = _WORKER_PDF.pop("pdf", None)
+    _WORKER_PDF.pop("path", None)
+    if pdf is not None:
+        pdf.close()
+
+
+@contextmanager
+def _deadline(seconds: float):
+    """Lève PageTimeout si le bloc dure plus de `seconds` (compté depuis le début réel de la page)."""
+    if seconds <= 0 or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _alarm(signum, frame):
+        raise PageTimeout()
+
+    previous = signal.signal(signal.SIGALRM, _alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _has_text_layer(text: str) -> bool:
+    return sum(ch.isalnum() for ch in text) >= OCR_MIN_TEXT_CHARS
+
+
+def _otsu_threshold(gray: np.ndarray) -> int:
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    if not total:
+        return 128
+    levels = np.arange(256)
+    w0 = np.cumsum(hist)
+    w1 = total - w0
+    m0 = np.cumsum(hist * levels)
+    mean0 = np.divide(m0, w0, out=np.zeros(256), where=w0 > 0)
+    mean1 = np.divide(m0[-1] - m0, w1, out=np.zeros(256), where=w1 > 0)
+    return int(np.argmax(w0 * w1 * (mean0 - mean1) ** 2))
+
+
+def _preprocess(image: Image.Image) -> Image.Image:
+    """Niveaux de gris + contraste + binarisation avant Tesseract."""
+    gray = ImageOps.autocontrast(ImageOps.grayscale(image))
+    arr = np.asarray(gray)
+    threshold = OCR_BINARIZE_THRESHOLD or _otsu_threshold(arr)
+    return Image.fromarray(np.where(arr > threshold, 255, 0).astype(np.uint8))
+
+
+def _tesseract(image: Image.Image, timeout: float = 0) -> str:
+    # timeout: Tesseract tourne dans un sous-processus, tué par pytesseract à l'échéance
+    try:
+        return pytesseract.image_to_string(_preprocess(image), lang=OCR_LANG or None,
+                                           config=OCR_TESSERACT_CONFIG, timeout=max(timeout, 0))
+    except RuntimeError as e:
+        if "timeout" in str(e).lower():
+            raise PageTimeout() from e
+        raise
+
+
+def _pdf_page_text(path: str, page_no: int, timeout: float = 0) -> PageText:
+    """Couche texte si elle est exploitable, sinon rastérisation + OCR de la seule page."""
+    t0 = time.perf_counter()
+    engine = "text"
+    try:
+        with _deadline(timeout):
+            page = _open_pdf(path).pages[page_no]
+            text = page.extract_text() or ""
+            if _has_text_layer(text):
+                return PageText(page_no, text, time.perf_counter() - t0, engine="text")
+            engine = "ocr"
+            image = page.to_image(resolution=OCR_DPI).original
+            remaining = timeout - (time.perf_counter() - t0) if timeout > 0 else 0
+            return PageText(page_no, _tesseract(image, remaining), time.perf_counter() - t0, engine="ocr")
+    except PageTimeout:
+        # Analyse interrompue: le document sera rouvert à la prochaine page
+        _close_pdf()
+        return PageText(page_no, "", time.perf_counter() - t0, error="timeout", engine=engine)
+
+
+def _image_text(file_bytes: bytes, timeout: float = 0) -> PageText:
+    t0 = time.perf_counter()
+    try:
+        with _deadline(timeout):
+            image = Image.open(io.BytesIO(file_bytes))
+            return PageText(0, _tesseract(image, timeout), time.perf_counter() - t0, engine="ocr")
+    except PageTimeout:
+        return PageText(0, "", time.perf_counter() - t0, error="timeout", engine="ocr")
+
+
+def _pdf_page_count(path: str) -> int:
+    return len(_open_pdf(path).pages)
+
+
+# ---------- processus principal ----------
+def _spill(file_bytes: bytes) -> str:
+    """Écrit le PDF une fois sur disque: les tâches ne transportent que son chemin."""
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=OCR_TMP_DIR or None)
+    with os.fdopen(fd, "wb") as f:
+        f.write(file_bytes)
+    return path
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+Task = Tuple[Callable[..., PageText], tuple]
+
+
+class _PageBatch:
+    """
+    Pages d'un document en cours dans le pool. Une page toujours en cours bien après
+    son échéance (processus bloqué hors Python) est rendue en timeout et fait
+    recycler le pool; les pages d'autres lots interrompues par ce recyclage sont
+    resoumises une fois.
+    """
+
+    def __init__(self, engine: "PageParallelOCR", tasks: Dict[int, Task]):
+        self.engine = engine
+        self.tasks = tasks
+        self.futures: Dict[Future, Tuple[int, ProcessPoolExecutor]] = {}
+        self.started: Dict[Future, float] = {}
+        self.retried: set = set()
+        for i in tasks:
+            self._submit(i)
+
+    def _submit(self, i: int) -> None:
+        fn, args = self.tasks[i]
+        pool = self.engine._executor()
+        self.futures[pool.submit(fn, *args)] = (i, pool)
+
+    def collect(self, done) -> List[PageText]:
+        out = []
+        for fut in done:
+            i, _ = self.futures.pop(fut)
+            interrupted = fut.cancelled() or isinstance(fut.exception(), BrokenProcessPool)
+            if interrupted and i not in self.retried:
+                self.retried.add(i)
+                self._submit(i)
+                continue
+            out.append(self.engine._result(fut, i))
+        return out
+
+    def expire(self) -> List[PageText]:
+        # Une tâche marquée "running" peut attendre un processus libre (au plus une page,
+        # elle-même bornée par l'échéance côté processus): d'où 2 × page_timeout
+        limit = 2 * self.engine.page_timeout + OCR_PAGE_GRACE
+        now = time.monotonic()
+        out = []
+        for fut, (i, pool) in list(self.futures.items()):
+            if fut.running():
+                self.started.setdefault(fut, now)
+            if fut in self.started and now - self.started[fut] > limit:
+                del self.futures[fut]
+                self.engine._recycle(pool)
+                out.append(PageText(i, "", now - self.started[fut], error="timeout"))
+        return out
+
+
+class PageParallelOCR:
+    """
+    Extraction page par page répartie sur un pool de processus.
+
+    - Chaque page est une tâche indépendante: un PDF de 30 pages coûte
+      ~30/workers fois une page au lieu de 30 fois.
+    - Le PDF est écrit une fois dans un fichier temporaire; chaque processus
+      l'ouvre une seule fois et traite ses pages à partir du chemin.
+    - iter_pages / astream_pages rendent les pages dans l'ordre de fin de
+      traitement; extract_* les réassemblent dans l'ordre du document.
+    - Une page qui dépasse `page_timeout` (compté dans le processus, depuis le
+      début de la page) est rendue vide avec une erreur "timeout"; un processus
+      qui ne rend pas la main fait recycler le pool.
+    - Les processus sont démarrés en forkserver/spawn (OCR_MP_START), jamais
+      par fork du serveur.
+    - Les variantes async n'occupent pas la boucle d'événements.
+    """
+
+    def __init__(self, workers: int = OCR_WORKERS, page_timeout: float = OCR_PAGE_TIMEOUT,
+                 start_method: str = OCR_MP_START):
+        self.workers = max(1, workers)
+        self.page_timeout = page_timeout
+        self.start_method = start_method
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.recycled = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(self.start_method))
+            return self._pool
+
+    def _recycle(self, pool: ProcessPoolExecutor) -> None:
+        """Remplace le pool dont un processus est bloqué; les tâches suivantes vont au nouveau pool."""
+        with self._lock:
+            if self._pool is not pool:
+                return  # déjà recyclé
+            self._pool = None
+            self.recycled += 1
+        print(f"[OCR] Page bloquée au-delà de l'échéance: recyclage du pool ({self.recycled})")
+        # Pas d'API publique pour tuer un processus occupé: terminate() sur les processus du pool
+        processes = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for proc in processes:
+            proc.terminate()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _page_tasks(self, path: str, n: int) -> Dict[int, Task]:
+        return {i: (_pdf_page_text, (path, i, self.page_timeout)) for i in range(n)}
+
+    # ---------- synchrone ----------
+    def _run(self, tasks: Dict[int, Task]) -> Iterator[PageText]:
+        batch = _PageBatch(self, tasks)
+        while batch.futures:
+            done, _ = wait(list(batch.futures), timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            yield from batch.collect(done)
+            yield from batch.expire()
+
+    def iter_pages(self, file_bytes: bytes) -> Iterator[PageText]:
+        path = _spill(file_bytes)
+        try:
+            n = self._executor().submit(_pdf_page_count, path).result(timeout=self.page_timeout)
+            yield from self._run(self._page_tasks(path, n))
+        finally:
+            _unlink(path)
+
+    def extract_pdf(self, file_bytes: bytes) -> str:
+        return join_pages(self.iter_pages(file_bytes))
+
+    def extract_pdf_pages(self, file_bytes: bytes) -> List[PageText]:
+        return sorted(self.iter_pages(file_bytes), key=lambda p: p.page)
+
+    def extract_image(self, file_bytes: bytes) -> str:
+        return next(self._run({0: (_image_text, (file_bytes, self.page_timeout))})).text
+
+    @staticmethod
+    def _result(fut: Future, page_no: int) -> PageText:
+        try:
+            return fut.result()
+        except Exception as e:
+            return PageText(page_no, "", 0.0, error=str(e) or type(e).__name__)
+
+    # ---------- async ----------
+    async def _arun(self, tasks: Dict[int, Task]) -> AsyncIterator[PageText]:
+        batch = _PageBatch(self, tasks)
+        wrapped: Dict[Future, asyncio.Future] = {}
+        while batch.futures:
+            for f in batch.futures:
+                if f not in wrapped:
+                    wrapped[f] = asyncio.wrap_future(f)
+                    # Résultat lu via `f` (collect) ou abandonné (recyclage): pas d'avertissement asyncio
+                    wrapped[f].add_done_callback(lambda w: w.cancelled() or w.exception())
+            waiting = {wrapped[f]: f for f in batch.futures}
+            done, _ = await asyncio.wait(list(waiting), timeout=_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            for page in batch.collect([waiting[w] for w in done]):
+                yield page
+            for page in batch.expire():
+                yield page
+
+    async def astream_pages(self, file_bytes: bytes) -> AsyncIterator[PageText]:
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(None, _spill, file_bytes)
+        try:
+            n = await asyncio.wait_for(loop.run_in_executor(self._executor(), _pdf_page_count, path),
+                                       timeout=self.page_timeout)
+            async for page in self._arun(self._page_tasks(path, n)):
+                yield page
+        finally:
+            _unlink(path)
+
+    async def aextract_pdf(self, file_bytes: bytes) -> str:
+        return join_pages(await self.aextract_pdf_pages(file_bytes))
+
+    async def aextract_pdf_pages(self, file_bytes: bytes) -> List[PageText]:
+        return sorted([p async for p in self.astream_pages(file_bytes)], key=lambda p: p.page)
+
+    async def aextract_image(self, file_bytes: bytes) -> str:
+        return (await self.aextract_image_page(file_bytes)).text
+
+    async def aextract_image_page(self, file_bytes: bytes) -> PageText:
+        page = [p async for p in self._arun({0: (_image_text, (file_bytes, self.page_timeout))})][0]
+        page.engine = "ocr"
+        return page
+
+
+def join_pages(pages) -> str:
+    pages: List[PageText] = sorted(pages, key=lambda p: p.page)
+    for p in pages:
+        if p.error:
+            print(f"[OCR] Page {p.page + 1}: {p.error}")
+    return "".join(p.text for p in pages)
+
+
+def pages_report(pages: List[PageText]) -> Dict[str, Any]:
+    """Résumé par page (moteur utilisé, durée, volume de texte) pour la réponse API."""
+    return {
+        "pages": [
+            {"page": p.page + 1, "engine": p.engine, "seconds": round(p.seconds, 3),
+             "chars": len(p.text), **({"error": p.error} if p.error else {})}
+            for p in pages
+        ],
+        "ocrPages": sum(p.engine == "ocr" for p in pages),
+        "textPages": sum(p.engine == "text" for p in pages),
+        "seconds": round(sum(p.seconds for p in pages), 3),
+    }
+
+
+# Instance globale (pool créé au premier appel)
+ocr_engine = PageParallelOCR()
+
 
 def extract_text_from_pdf(file_bytes: bytes) -> str:
-    text = ""
-    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() or ""
-    return text
+    return ocr_engine.extract_pdf(file_bytes)
 
 def extract_text_from_image(file_bytes: bytes) -> str:
-    image = Image.open(io.BytesIO(file_bytes))
-    return pytesseract.image_to_string(image)
+    return ocr_engine.extract_image(file_bytes)
+
+async def aextract_text_from_pdf(file_bytes: bytes) -> str:
+    return await ocr_engine.aextract_pdf(file_bytes)
+
+async def aextract_text_from_image(file_bytes: bytes) -> str:
+    return await ocr_engine.aextract_image(file_bytes)
 
+async def aextract_pages(file_bytes: bytes, content_type: str) -> List[PageText]:
+    """Pages extraites (avec moteur et durée) d'un PDF ou d'une image."""
+    if content_type == "application/pdf":
+        return await ocr_engine.aextract_pdf_pages(file_bytes)
+    return [await ocr_engine.aextract_image_page(file_bytes)]
@@ -0,0 +1,255 @@
+# services/payroll_rules.py
+import json
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Fichier JSON optionnel {année: règles} qui complète/remplace les barèmes ci-dessous
+RULES_PATH = os.getenv("PAYROLL_RULES_PATH", "")
+
+# Barèmes mensuels (MAD). Tranches IR: (plafond de tranche, taux, somme à déduire)
+_IR_2024 = [(2500.0, 0.00, 0.0), (4166.67, 0.10, 250.0), (5000.0, 0.20, 666.67),
+            (6666.67, 0.30, 1166.67), (15000.0, 0.34, 1433.33), (None, 0.38, 2033.33)]
+_IR_2025 = [(3333.33, 0.00, 0.0), (5000.0, 0.10, 333.33), (6666.67, 0.20, 833.33),
+            (8333.33, 0.30, 1500.0), (15000.0, 0.34, 1833.33), (None, 0.37, 2283.33)]
+# Frais professionnels (depuis 2023): 35% jusqu'à 6 500 MAD de brut imposable mensuel,
+# 25% au-delà, plafonnés à 35 000 MAD par an
+_FP_BRACKETS = [(6500.0, 0.35), (None, 0.25)]
+_FP_CAP = 35000.0 / 12
+
+DEFAULT_RULES: Dict[int, Dict[str, Any]] = {
+    2024: {
+        "cnss_rate": 0.0448, "cnss_cap": 6000.0,          # prestations sociales (part salariale)
+        "amo_rate": 0.0226,                               # AMO, sans plafond
+        "fp_brackets": _FP_BRACKETS, "fp_cap": _FP_CAP,   # frais professionnels
+        "ir_brackets": _IR_2024,
+        "family_deduction": 30.0, "family_max": 6,        # charges de famille
+    },
+    2025: {
+        "cnss_rate": 0.0448, "cnss_cap": 6000.0,
+        "amo_rate": 0.0226,
+        "fp_brackets": _FP_BRACKETS, "fp_cap": _FP_CAP,
+        "ir_brackets": _IR_2025,
+        "family_deduction": 41.67, "family_max": 6,
+    },
+}
+
+# Tolérances d'écart (MAD): max(taux × montant attendu, plancher)
+TOLERANCE_RATE = float(os.getenv("PAYROLL_TOLERANCE_RATE", "0.02"))
+TOLERANCE_FLOOR = float(os.getenv("PAYROLL_TOLERANCE_FLOOR", "5"))
+
+_YEAR_RE = re.compile(r"\b(20\d{2})\b")
+
+
+def _load_rules() -> Dict[int, Dict[str, Any]]:
+    rules = {y: dict(r) for y, r in DEFAULT_RULES.items()}
+    if RULES_PATH and os.path.exists(RULES_PATH):
+        with open(RULES_PATH, "r", encoding="utf-8") as f:
+            for year, r in json.load(f).items():
+                rules[int(year)] = {**rules.get(int(year), {}), **r}
+    return rules
+
+
+@dataclass
+class PayrollBatch:
+    """Résultat vectorisé: une valeur par bulletin pour chaque grandeur."""
+    brut: np.ndarray
+    cnss: np.ndarray
+    amo: np.ndarray
+    frais_pro: np.ndarray
+    net_imposable: np.ndarray
+    ir: np.ndarray
+    net: np.ndarray
+
+    def row(self, i: int) -> Dict[str, float]:
+        return {k: round(float(getattr(self, k)[i]), 2)
+                for k in ("brut", "cnss", "amo", "frais_pro", "net_imposable", "ir", "net")}
+
+
+class PayrollRulesEngine:
+    """
+    Recalcul local des retenues d'un bulletin marocain (CNSS, AMO, IR) à partir du brut,
+    selon les barèmes de l'année (plafonds, frais professionnels, tranches IR,
+    charges de famille). Tout est vectorisé numpy: `compute` accepte un lot de
+    bulletins et `verify_batch` compare un lot de montants déclarés aux montants attendus.
+    """
+
+    def __init__(self, rules: Optional[Dict[int, Dict[str, Any]]] = None):
+        self.rules = rules or _load_rules()
+
+    def years(self) -> List[int]:
+        return sorted(self.rules)
+
+    def rules_for(self, year: Optional[int] = None) -> Tuple[int, Dict[str, Any]]:
+        """Barème de l'année demandée, sinon le plus récent antérieur (ou le plus ancien)."""
+        year = year or date.today().year
+        known = [y for y in self.years() if y <= year] or self.years()[:1]
+        y = known[-1]
+        return y, self.rules[y]
+
+    def guess_year(self, text: str) -> Optional[int]:
+        """Année la plus citée dans le texte parmi celles qui ont un barème."""
+        years = [int(y) for y in _YEAR_RE.findall(text or "")]
+        lo, hi = self.years()[0] - 1, date.today().year + 1
+        counts = Counter(y for y in years if lo <= y <= hi)
+        return counts.most_common(1)[0][0] if counts else None
+
+    @staticmethod
+    def _brackets(x: np.ndarray, brackets: Sequence[Tuple[Optional[float], float, float]]) -> np.ndarray:
+        """Barème IR: taux × base − somme à déduire, selon la tranche de chaque base."""
+        uppers = np.array([b[0] if b[0] is not None else np.inf for b in brackets])
+        idx = np.minimum(np.searchsorted(uppers, x, side="left"), len(brackets) - 1)
+        rates = np.array([b[1] for b in brackets])[idx]
+        deduct = np.array([b[2] for b in brackets])[idx]
+        return np.maximum(x * rates - deduct, 0.0)
+
+    def compute(self, brut, year: Optional[int] = None, dependents=0) -> PayrollBatch:
+        """Montants attendus pour un ou plusieurs bruts mensuels (scalaires ou tableaux)."""
+        _, r = self.rules_for(year)
+        brut = np.atleast_1d(np.asarray(brut, dtype=np.float64))
+        deps = np.broadcast_to(np.asarray(dependents, dtype=np.float64), brut.shape)
+
+        cnss = np.minimum(brut, r["cnss_cap"]) * r["cnss_rate"]
+        amo = brut * r["amo_rate"]
+
+        fp_uppers = np.array([b[0] if b[0] is not None else np.inf for b in r["fp_brackets"]])
+        fp_rates = np.array([b[1] for b in r["fp_brackets"]])
+        fp_rate = fp_rates[np.minimum(np.searchsorted(fp_uppers, brut, side="left"), len(fp_rates) - 1)]
+        frais_pro = np.minimum(brut * fp_rate, r["fp_cap"])
+
+        net_imposable = np.maximum(brut - cnss - amo - frais_pro, 0.0)
+        ir_brut = self._brackets(net_imposable, r["ir_brackets"])
+        family = np.minimum(deps, r["family_max"]) * r["family_deduction"]
+        ir = np.maximum(ir_brut - family, 0.0)
+
+        net = brut - cnss - amo - ir
+        return PayrollBatch(brut, cnss, amo, frais_pro, net_imposable, ir, net)
+
+    def verify_batch(self, payslips: List[Dict[str, Any]], year: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        payslips: [{"salaireBrut", "cnss", "amo", "ir", "salaireNet", "dependents"?, "year"?}, ...]
+        Les montants absents (None/0) ne sont pas contrôlés. Les bulletins sont
+        regroupés par année pour un calcul vectorisé par barème.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(payslips)
+        by_year: Dict[int, List[int]] = {}
+        for i, p in enumerate(payslips):
+            by_year.setdefault(self.rules_for(p.get("year") or year)[0], []).append(i)
+
+        for y, idx in by_year.items():
+            batch = [payslips[i] for i in idx]
+            col = lambda k: np.array([float(p.get(k) or 0.0) for p in batch])
+            brut = col("salaireBrut")
+            deps = col("dependents")
+            expected = self.compute(brut, y, deps)
+            # Charges de famille inconnues: l'IR déclaré doit tomber entre l'IR au maximum de charges et l'IR sans charge
+            ir_low = self.compute(brut, y, self.rules[y]["family_max"]).ir
+            declared = {"cnss": col("cnss"), "amo": col("amo"), "ir": col("ir"), "net": col("salaireNet")}
+
+            for j, i in enumerate(idx):
+                results[i] = self._report(y, j, expected, ir_low, declared,
+                                          known_deps="dependents" in batch[j])
+        return results
+
+    def verify(self, payslip: Dict[str, Any], year: Optional[int] = None) -> Dict[str, Any]:
+        return self.verify_batch([payslip], year=year)[0]
+
+    @staticmethod
+    def _tolerance(expected: float) -> float:
+        return max(TOLERANCE_RATE * abs(expected), TOLERANCE_FLOOR)
+
+    def _report(self, year: int, j: int, expected: PayrollBatch, ir_low: np.ndarray,
+                declared: Dict[str, np.ndarray], known_deps: bool) -> Dict[str, Any]:
+        exp = expected.row(j)
+        anomalies: List[Dict[str, Any]] = []
+        checks: Dict[str, Any] = {}
+        if exp["brut"] <= 0:
+            return {"year": year, "expected": exp, "checks": checks, "anomalies": anomalies, "consistent": None}
+
+        for key, label in (("cnss", "CNSS"), ("amo", "AMO")):
+            got = float(declared[key][j])
+            if got <= 0:
+                continue
+            gap = round(got - exp[key], 2)
+            ok = abs(gap) <= self._tolerance(exp[key])
+            checks[key] = {"declared": got, "expected": exp[key], "gap": gap, "ok": ok}
+            if not ok:
+                anomalies.append({
+                    "titre": f"Cotisation {label} incohérente",
+                    "description": f"{label} déclarée {got:.2f} MAD, attendue {exp[key]:.2f} MAD "
+                                   f"(barème {year}).",
+                    "impact": "Élevé" if abs(gap) > 0.1 * max(exp[key], 1.0) else "Moyen",
+                })
+
+        # IR minimal admissible (charges de famille inconnues: maximum de charges)
+        lo = exp["ir"] if known_deps else round(float(ir_low[j]), 2)
+        got_ir = float(declared["ir"][j])
+        if got_ir > 0:
+            tol = self._tolerance(exp["ir"])
+            ok = lo - tol <= got_ir <= exp["ir"] + tol
+            checks["ir"] = {"declared": got_ir, "expected": exp["ir"], "expectedMin": lo, "ok": ok}
+            if not ok:
+                anomalies.append({
+                    "titre": "IR incohérent",
+                    "description": f"IR déclaré {got_ir:.2f} MAD, attendu entre {lo:.2f} et "
+                                   f"{exp['ir']:.2f} MAD selon les charges de famille (barème {year}).",
+                    "impact": "Élevé" if got_ir > exp["ir"] + tol else "Moyen",
+                })
+
+        got_net = float(declared["net"][j])
+        if got_net > 0:
+            # Le net réel intègre d'autres retenues (CIMR, mutuelle, avances): seul un net
+            # supérieur au net attendu (retenues légales manquantes) est signalé
+            ok = got_net <= exp["net"] + (exp["ir"] - lo) + self._tolerance(exp["net"])
+            checks["net"] = {"declared": got_net, "expected": exp["net"], "ok": ok}
+            if not ok:
+                anomalies.append({
+                    "titre": "Net à payer trop élevé",
+                    "description": f"Net déclaré {got_net:.2f} MAD au-dessus du net attendu "
+                                   f"{exp['net']:.2f} MAD: des retenues légales semblent manquer.",
+                    "impact": "Moyen",
+                })
+
+        return {"year": year, "expected": exp, "checks": checks, "anomalies": anomalies,
+                "consistent": not anomalies}
+
+
+def declared_from_analysis(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Montants déclarés (brut, CNSS, AMO, IR, net) à partir du schéma resume/details."""
+    r = analysis.get("resume", {}) or {}
+    d = analysis.get("details", {}) or {}
+
+    def _sum(items, *names):
+        total = 0.0
+        for x in items or []:
+            if isinstance(x, dict) and any(n in str(x.get("libelle", "")).lower() for n in names):
+                if str(x.get("type", "salariale")).lower().startswith("patron"):
+                    continue
+                try:
+                    total += float(x.get("montant") or 0)
+                except (TypeError, ValueError):
+                    pass
+        return total
+
+    def _num(x):
+        try:
+            return float(x or 0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    return {
+        "salaireBrut": _num(r.get("salaireBrut")),
+        "cnss": _sum(d.get("cotisations"), "cnss", "prestations sociales"),
+        "amo": _sum(d.get("cotisations"), "amo", "assurance maladie"),
+        "ir": _sum(d.get("impots"), "ir", "impôt", "impot") or _num(r.get("impots")),
+        "salaireNet": _num(r.get("salaireNet")) or _num(d.get("netAPayer")),
+    }
+
+
+# Instance globale
+payroll_rules = PayrollRulesEngine()
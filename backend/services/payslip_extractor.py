@@ -0,0 +1,188 @@
+# services/payslip_extractor.py
+import os
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# En dessous de ce score, l'analyse est confiée à Gemini
+EXTRACT_MIN_CONFIDENCE = float(os.getenv("PAYSLIP_MIN_CONFIDENCE", "0.8"))
+
+# Libellés usuels des bulletins marocains (comparés sans accents, en minuscules)
+LABELS: Dict[str, Tuple[str, ...]] = {
+    "salaireBase": ("salaire de base", "salaire base", "sal base", "traitement de base"),
+    "salaireBrut": ("salaire brut global", "salaire brut", "total brut", "brut global", "montant brut", "total des gains"),
+    "netAPayer": ("net a payer", "net a percevoir", "net paye", "salaire net", "net du mois"),
+    "cnss": ("cnss", "c.n.s.s", "prestations sociales", "securite sociale"),
+    "amo": ("amo", "a.m.o", "assurance maladie obligatoire", "assurance maladie"),
+    "cimr": ("cimr", "c.i.m.r", "retraite complementaire"),
+    "mutuelle": ("mutuelle",),
+    "ir": ("ir", "i.r", "igr", "impot sur le revenu", "impot general sur le revenu"),
+    "heuresSupp": ("heures supplementaires", "heures supp", "h sup", "hs 25", "hs 50", "hs 100"),
+    "prime": ("prime", "indemnite", "gratification", "bonus", "commission"),
+}
+# Lignes à ignorer même si elles contiennent un libellé (bases, cumuls, parts patronales)
+IGNORE = ("cumul", "base imposable", "brut imposable", "net imposable", "patronal", "employeur", "plafond")
+COTISATIONS = ("cnss", "amo", "cimr", "mutuelle")
+
+# Montants: "12 345,67" / "12.345,67" / "12,345.67" / "8000.00" / "8000" (pas les taux en %)
+_AMOUNT = re.compile(r"(?<![\d.,])(\d{1,3}(?:[ .,  ]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)(?![\d.,]*\s*%)")
+_LABEL_RE = {key: re.compile(r"\b(?:" + "|".join(re.escape(l) for l in labels) + r")\b")
+             for key, labels in LABELS.items()}
+_IGNORE_RE = re.compile(r"\b(?:" + "|".join(re.escape(l) for l in IGNORE) + r")\b")
+_NON_WORD = re.compile(r"[^a-z0-9%,.\s]")
+
+
+def _normalize(line: str) -> str:
+    s = unicodedata.normalize("NFKD", line).encode("ascii", "ignore").decode().lower()
+    return re.sub(r"\s+", " ", _NON_WORD.sub(" ", s)).strip()
+
+
+def parse_amount(token: str) -> Optional[float]:
+    s = re.sub(r"[\s  ]", "", token)
+    if "," in s and "." in s:
+        # le dernier séparateur est le séparateur décimal
+        dec = "," if s.rfind(",") > s.rfind(".") else "."
+        s = s.replace("." if dec == "," else ",", "").replace(dec, ".")
+    elif "," in s:
+        head, _, tail = s.rpartition(",")
+        s = f"{head.replace(',', '')}.{tail}" if len(tail) <= 2 else s.replace(",", "")
+    elif s.count(".") > 1 or (s.count(".") == 1 and len(s.rpartition(".")[2]) == 3):
+        s = s.replace(".", "")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _line_amount(norm: str, label_end: int) -> Optional[float]:
+    """Montant de la ligne: le dernier nombre après le libellé (colonne montant)."""
+    amounts = [parse_amount(m.group(1)) for m in _AMOUNT.finditer(norm, label_end)]
+    amounts = [a for a in amounts if a is not None]
+    return amounts[-1] if amounts else None
+
+
+@dataclass
+class PayslipExtraction:
+    resume: Dict[str, float]
+    details: Dict[str, Any]
+    confidence: float
+    confident: bool = False                           # assez fiable pour se passer de Gemini
+    fields: List[str] = field(default_factory=list)   # champs trouvés
+    checks: Dict[str, Any] = field(default_factory=dict)
+
+    def analysis(self) -> Dict[str, Any]:
+        """Même schéma que analyze_with_gemini_with_context (sans la partie narrative)."""
+        return {
+            "resume": self.resume,
+            "details": self.details,
+            "anomalies": [],
+            "recommandations": [],
+            "meta": {"source": "rules", "confidence": round(self.confidence, 3), "fields": self.fields},
+        }
+
+
+class PayslipExtractor:
+    """
+    Extraction déterministe des montants d'un bulletin de paie à partir des lignes OCR:
+    dictionnaires de libellés + regex compilées, puis contrôle de cohérence
+    brut − retenues ≈ net qui fixe le score de confiance.
+    Les compteurs permettent de suivre le taux de passage par le chemin rapide.
+    """
+
+    def __init__(self, min_confidence: float = EXTRACT_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {"documents": 0, "fastPath": 0, "fallback": 0, "fields": {}}
+
+    def extract(self, text: str) -> PayslipExtraction:
+        found: Dict[str, float] = {}
+        primes: List[Dict[str, Any]] = []
+        heures: List[Dict[str, Any]] = []
+        cotisations: List[Dict[str, Any]] = []
+
+        for raw in (text or "").splitlines():
+            norm = _normalize(raw)
+            if not norm or _IGNORE_RE.search(norm):
+                continue
+            for key, rx in _LABEL_RE.items():
+                m = rx.search(norm)
+                if not m:
+                    continue
+                amount = _line_amount(norm, m.end())
+                if amount is None:
+                    continue
+                libelle = raw.strip()[:80]
+                if key == "prime":
+                    primes.append({"libelle": libelle, "montant": amount})
+                elif key == "heuresSupp":
+                    heures.append({"libelle": libelle, "montant": amount})
+                elif key in COTISATIONS:
+                    cotisations.append({"libelle": key.upper(), "montant": amount, "type": "salariale"})
+                    found.setdefault(key, amount)
+                else:
+                    found.setdefault(key, amount)
+                break   # un seul libellé par ligne (le premier du dictionnaire)
+
+        base = found.get("salaireBase", 0.0)
+        brut = found.get("salaireBrut") or (base + sum(p["montant"] for p in primes + heures) if base else 0.0)
+        net = found.get("netAPayer", 0.0)
+        ir = found.get("ir", 0.0)
+        cot = round(sum(c["montant"] for c in cotisations), 2)
+
+        resume = {"salaireBrut": round(brut, 2), "salaireNet": round(net, 2), "cotisations": cot, "impots": round(ir, 2)}
+        details = {
+            "salaireBase": round(base, 2),
+            "primes": primes,
+            "heuresSupp": heures,
+            "cotisations": cotisations,
+            "impots": [{"libelle": "IR", "montant": round(ir, 2)}] if "ir" in found else [],
+            "netAPayer": round(net, 2),
+        }
+        confidence, checks = self._score(found, brut, net, cot, ir)
+        extraction = PayslipExtraction(resume, details, confidence, confidence >= self.min_confidence,
+                                       sorted(found), checks)
+        self._record(extraction)
+        return extraction
+
+    @staticmethod
+    def _score(found: Dict[str, float], brut: float, net: float, cot: float, ir: float) -> Tuple[float, Dict[str, Any]]:
+        # Champs indispensables: brut, net, au moins une cotisation; l'équation de paie valide l'ensemble
+        score = 0.0
+        score += 0.2 if brut > 0 else 0.0
+        score += 0.2 if net > 0 else 0.0
+        score += 0.1 if cot > 0 else 0.0
+        score += 0.05 if "ir" in found else 0.0
+        gap = None
+        if brut > 0 and net > 0:
+            gap = round(brut - cot - ir - net, 2)
+            if abs(gap) <= max(0.01 * brut, 5.0):
+                score += 0.45
+            elif abs(gap) <= max(0.05 * brut, 50.0):
+                # écart expliqué par une retenue non reconnue (avance, prêt…)
+                score += 0.2
+        if net > brut > 0:
+            score = min(score, 0.3)
+        return round(min(score, 1.0), 3), {"netGap": gap}
+
+    def _record(self, e: PayslipExtraction) -> None:
+        with self._lock:
+            self._stats["documents"] += 1
+            self._stats["fastPath" if e.confident else "fallback"] += 1
+            for f in e.fields:
+                self._stats["fields"][f] = self._stats["fields"].get(f, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self._stats["documents"]
+            return {
+                **self._stats,
+                "fields": dict(self._stats["fields"]),
+                "minConfidence": self.min_confidence,
+                "fastPathRate": round(self._stats["fastPath"] / n, 3) if n else 0.0,
+            }
+
+
+# Instance globale
+payslip_extractor = PayslipExtractor()
@@ -0,0 +1,255 @@
+# services/salary_ingestion.py
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from services.supabase_salary_rag_service import supabase_salary_rag
+
+SPOOL_PATH = os.getenv("SALARY_INGEST_SPOOL", os.path.join(os.path.dirname(__file__), "..", "data", "salary_ingest_spool.jsonl"))
+INGEST_BATCH_SIZE = int(os.getenv("SALARY_INGEST_BATCH", "32"))
+INGEST_MAX_WAIT = float(os.getenv("SALARY_INGEST_MAX_WAIT", "0.5"))
+# Backoff exponentiel plafonné entre deux essais d'un lot en échec transitoire
+INGEST_MAX_BACKOFF = float(os.getenv("SALARY_INGEST_MAX_BACKOFF", "60"))
+DEAD_LETTER_PATH = os.getenv("SALARY_INGEST_DEAD_LETTER", os.path.join(os.path.dirname(__file__), "..", "data", "salary_ingest_dead_letter.jsonl"))
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Saisie invalide (champ manquant, valeur illisible, contrainte SQL): rejouer ne changera rien."""
+    if isinstance(error, (ValueError, KeyError, TypeError)):
+        return True
+    # Erreurs PostgREST de données (classes SQLSTATE 22 et 23)
+    return str(getattr(error, "code", "") or "")[:2] in ("22", "23")
+
+
+class SalaryIngestionQueue:
+    """
+    Worker d'ingestion en tâche de fond pour les saisies salariales.
+
+    - submit() écrit la saisie dans un spool local (JSONL) puis la met en file:
+      la route ne fait plus que cet enqueue.
+    - Un thread regroupe les saisies (jusqu'à `batch_size`, ou `max_wait`
+      secondes après la première) et appelle `ingest_fn(entries)` une fois par lot.
+    - Chaque lot traité est acquitté dans le spool; au redémarrage, les saisies
+      non acquittées sont rejouées. Le spool est vidé dès qu'il n'y a plus rien en attente.
+    - Un lot en échec transitoire (Supabase indisponible) n'est pas acquitté: il est
+      réessayé avec un backoff exponentiel plafonné (`max_backoff`) jusqu'au succès.
+    - Un échec dû aux données scinde le lot: chaque saisie est rejouée seule et les
+      saisies invalides partent dans un fichier dead-letter (une ligne par saisie).
+    """
+
+    def __init__(self, ingest_fn: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]],
+                 spool_path: str = SPOOL_PATH, batch_size: int = INGEST_BATCH_SIZE,
+                 max_wait: float = INGEST_MAX_WAIT, max_backoff: float = INGEST_MAX_BACKOFF,
+                 dead_letter_path: str = DEAD_LETTER_PATH, max_results: int = 2000):
+        self.ingest_fn = ingest_fn
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_backoff = max_backoff
+        self.dead_letter_path = dead_letter_path
+        self.max_results = max_results
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._pending: Dict[str, Dict[str, Any]] = {}   # ticket -> enregistrement du spool
+        self._results: Dict[str, Dict[str, Any]] = {}   # ticket -> résultat (borné)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._counters = {"processed": 0, "deadLettered": 0, "retries": 0, "batches": 0}
+        self._last_batch: Dict[str, Any] = {}
+        self._recovered = False
+        os.makedirs(os.path.dirname(os.path.abspath(spool_path)), exist_ok=True)
+
+    # ---------- spool ----------
+    def _spool_write(self, records: List[Dict[str, Any]]) -> None:
+        with open(self.spool_path, "a", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _recover(self) -> int:
+        """Recharge les saisies du spool non acquittées (crash ou arrêt avant traitement)."""
+        if not os.path.exists(self.spool_path):
+            return 0
+        pending: Dict[str, Dict[str, Any]] = {}
+        with open(self.spool_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # ligne tronquée
+                if "ack" in rec:
+                    pending.pop(rec["ack"], None)
+                else:
+                    pending[rec["ticket"]] = rec
+        with self._lock:
+            for ticket, rec in pending.items():
+                if ticket not in self._pending:
+                    self._pending[ticket] = rec
+                    self._queue.put(rec)
+        if not pending:
+            open(self.spool_path, "w").close()
+        return len(pending)
+
+    # ---------- API ----------
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            recover = not self._recovered
+            self._recovered = True
+        if recover:
+            n = self._recover()
+            if n:
+                print(f"[SalaryIngestion] {n} saisies rechargées depuis le spool")
+        thread = threading.Thread(target=self._run, name="salary-ingestion", daemon=True)
+        with self._lock:
+            self._thread = thread
+        thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Arrête le worker après le lot en cours (les saisies restantes restent dans le spool)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, entry: Dict[str, Any]) -> str:
+        rec = {"ticket": uuid.uuid4().hex, "entry": entry, "enqueuedAt": time.time()}
+        with self._lock:
+            # Écriture spool et enregistrement sous le même verrou que la troncature
+            self._spool_write([rec])
+            self._pending[rec["ticket"]] = rec
+        self._queue.put(rec)
+        self.start()
+        return rec["ticket"]
+
+    def get(self, ticket: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if ticket in self._results:
+                return dict(self._results[ticket])
+            if ticket in self._pending:
+                return {"ticket": ticket, "status": "queued"}
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            oldest = min((r["enqueuedAt"] for r in self._pending.values()), default=None)
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "depth": len(self._pending),
+                "lagSeconds": round(now - oldest, 3) if oldest is not None else 0.0,
+                "batchSize": self.batch_size,
+                "maxWait": self.max_wait,
+                **self._counters,
+                "lastBatch": dict(self._last_batch),
+            }
+
+    # ---------- worker ----------
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch and not self._process(batch):
+                # Arrêt pendant un backoff: le reste du lot est remis en file pour un prochain start()
+                with self._lock:
+                    leftover = [rec for rec in batch if rec["ticket"] in self._pending]
+                for rec in leftover:
+                    self._queue.put(rec)
+
+    def _process(self, batch: List[Dict[str, Any]]) -> bool:
+        """Traite un lot jusqu'au succès ou au rejet définitif; False si l'arrêt a été demandé."""
+        t0 = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                results = self.ingest_fn([rec["entry"] for rec in batch])
+                break
+            except Exception as e:
+                if _is_permanent(e):
+                    if len(batch) == 1:
+                        self._dead_letter(batch[0], e)
+                        return True
+                    # Saisie invalide dans le lot: chaque saisie est rejouée seule
+                    print(f"[SalaryIngestion] Lot de {len(batch)} saisies rejeté ({e}): traitement unitaire")
+                    for rec in batch:
+                        if not self._process([rec]):
+                            return False
+                    return True
+                attempt += 1
+                delay = min(2 ** (attempt - 1), self.max_backoff)
+                print(f"[SalaryIngestion] Erreur lot ({len(batch)} saisies, essai {attempt}): {e}; "
+                      f"nouvel essai dans {delay:g}s")
+                with self._lock:
+                    self._counters["retries"] += 1
+                    self._last_batch = {"size": len(batch), "error": str(e), "attempt": attempt}
+                if self._stop.wait(delay):
+                    return False  # arrêt demandé: le lot reste dans le spool
+
+        now = time.time()
+        self._spool_write([{"ack": rec["ticket"]} for rec in batch])
+        with self._lock:
+            for k, rec in enumerate(batch):
+                res = {"ticket": rec["ticket"], "status": "done", **results[k]}
+                res["lagSeconds"] = round(now - rec["enqueuedAt"], 3)
+                self._finish(rec["ticket"], res)
+            self._counters["batches"] += 1
+            self._counters["processed"] += len(batch)
+            self._last_batch = {
+                "size": len(batch),
+                "seconds": round(time.perf_counter() - t0, 3),
+                "maxLagSeconds": round(now - min(rec["enqueuedAt"] for rec in batch), 3),
+                "attempts": attempt + 1,
+            }
+        return True
+
+    def _dead_letter(self, rec: Dict[str, Any], error: Exception) -> None:
+        """Archive une saisie invalide (dead-letter) puis l'acquitte dans le spool."""
+        print(f"[SalaryIngestion] Saisie {rec['ticket']} invalide, mise en dead-letter: {error}")
+        os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({**rec, "error": str(error), "failedAt": time.time()}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._spool_write([{"ack": rec["ticket"]}])
+        with self._lock:
+            self._finish(rec["ticket"], {
+                "ticket": rec["ticket"], "status": "error", "error": str(error),
+                "lagSeconds": round(time.time() - rec["enqueuedAt"], 3),
+            })
+            self._counters["deadLettered"] += 1
+
+    def _finish(self, ticket: str, result: Dict[str, Any]) -> None:
+        """Enregistre le résultat d'une saisie acquittée (appelé sous self._lock)."""
+        self._pending.pop(ticket, None)
+        self._results[ticket] = result
+        while len(self._results) > self.max_results:
+            self._results.pop(next(iter(self._results)))
+        if not self._pending:
+            # Plus rien en attente: le spool peut être tronqué
+            open(self.spool_path, "w").close()
+
+
+# Instance globale (démarrée au lancement de l'application ou au premier submit)
+salary_ingestion = SalaryIngestionQueue(supabase_salary_rag.ingest_batch)
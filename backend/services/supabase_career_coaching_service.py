@@ -1,5 +1,5 @@
 # services/supabase_career_coaching_service.py
-import os, re, json
+import os, re, json, time
 from dataclasses import dataclass
 from typing import List, Optional, Dict, Any
 from datetime import datetime
@@ -10,6 +10,10 @@ from sentence_transformers import SentenceTransformer
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+from services.supabase_pagination import iter_pages, iter_rows
+from services.embedding_codec import decode_embeddings
+from services.index_snapshots import IndexManager
+
 # Charger les variables d'environnement
 load_dotenv()
 
@@ -30,10 +34,11 @@ PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, ".."))
 # Modèle multilingue FR/EN (dim=768 par défaut)
 EMBED_MODEL = os.getenv("CAREER_EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
 
-# Chemins FAISS
-INDEX_PATH = os.getenv("CAREER_FAISS_INDEX", os.path.join(PROJECT_ROOT, "data", "supabase_career_index.faiss"))
-MAP_PATH   = os.getenv("CAREER_FAISS_MAP",   os.path.join(PROJECT_ROOT, "data", "supabase_career_index_map.json"))
-os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+# Snapshots FAISS versionnés
+SNAPSHOT_DIR = os.getenv("CAREER_SNAPSHOT_DIR", os.path.join(PROJECT_ROOT, "data", "snapshots", "career"))
+# Anciens fichiers plats, importés dans un premier snapshot s'il n'en existe aucun
+LEGACY_INDEX_PATH = os.getenv("CAREER_FAISS_INDEX", os.path.join(PROJECT_ROOT, "data", "supabase_career_index.faiss"))
+LEGACY_MAP_PATH = os.getenv("CAREER_FAISS_MAP", os.path.join(PROJECT_ROOT, "data", "supabase_career_index_map.json"))
 
 # ==================== HELPERS ====================
 def normalize_ws(s: str) -> str:
@@ -79,30 +84,6 @@ def chunk_by_sentences(text: str, max_chars: int = 1200, overlap_chars: int = 20
         chunks.append(buf)
     return chunks
 
-def parse_embedding(raw) -> Optional[np.ndarray]:
-    """Accepte list[float] OU str '[...]' renvoyée par PostgREST. Retourne np.float32 ou None."""
-    if raw is None:
-        return None
-    if isinstance(raw, list):
-        try:
-            return np.asarray(raw, dtype=np.float32)
-        except Exception:
-            return None
-    if isinstance(raw, str):
-        s = raw.strip()
-        try:
-            if s.startswith('[') and s.endswith(']'):
-                arr = json.loads(s)
-                return np.asarray(arr, dtype=np.float32)
-            # fallback split simple
-            s = s.replace('[', '').replace(']', '')
-            vals = [v for v in (x.strip() for x in s.split(',')) if v]
-            return np.asarray([float(v) for v in vals], dtype=np.float32)
-        except Exception:
-            return None
-    # types inattendus
-    return None
-
 # ==================== DATACLASSES ====================
 @dataclass
 class ProfileHit:
@@ -128,16 +109,31 @@ class SupabaseCareerCoachingService:
     def __init__(self):
         self.model = SentenceTransformer(EMBED_MODEL)
         self.dim = self.model.get_sentence_embedding_dimension()
-        self.index: Optional[faiss.Index] = None
-        self.chunk_map: Dict[int, Dict] = {}
-        self.profile_map: Dict[int, Dict] = {}
-        self.id_by_pos: List[int] = []  # mapping FAISS position -> chunk_id
+        # Bundle (index, id_by_pos: position FAISS -> chunk_id, {"chunks", "profiles"})
+        # remplacé d'un bloc à chaque build/chargement
+        self.indexes = IndexManager("career", SNAPSHOT_DIR)
+        self.indexes.publish(None, [], {"chunks": {}, "profiles": {}})
+
+    @property
+    def index(self) -> Optional[faiss.Index]:
+        return self.indexes.current().index
+
+    @property
+    def id_by_pos(self) -> List[int]:
+        return self.indexes.current().id_map
+
+    @property
+    def chunk_map(self) -> Dict[int, Dict]:
+        return self.indexes.current().data["chunks"]
+
+    @property
+    def profile_map(self) -> Dict[int, Dict]:
+        return self.indexes.current().data["profiles"]
 
     # ----------- Chargements depuis Supabase -----------
     def load_profiles_from_supabase(self) -> List[Dict]:
         try:
-            response = supabase.table("profileslinkedin").select("*").execute()
-            profiles = response.data or []
+            profiles = list(iter_rows(supabase, "profileslinkedin"))
             print(f"✅ {len(profiles)} profils LinkedIn chargés depuis Supabase")
             return profiles
         except Exception as e:
@@ -146,23 +142,26 @@ class SupabaseCareerCoachingService:
 
     def load_chunks_from_supabase(self) -> List[Dict]:
         try:
-            response = supabase.table("profile_chunks").select("*").execute()
-            chunks = response.data or []
-            # parser embeddings ici
+            # Lecture paginée; chaque page d'embeddings est décodée en une seule matrice
+            chunks = []
             ok, bad_dim, bad_none = 0, 0, 0
-            for c in chunks:
-                vec = parse_embedding(c.get("embedding"))
-                if vec is None:
-                    c["embedding"] = None
-                    bad_none += 1
-                    continue
-                if vec.shape[0] != self.dim:
-                    # dimension incompatible → ignore
-                    c["embedding"] = None
-                    bad_dim += 1
-                    continue
-                c["embedding"] = vec.astype(np.float32, copy=False)
-                ok += 1
+            for page in iter_pages(supabase, "profile_chunks"):
+                raw = [c.get("embedding") for c in page]
+                X, valid = decode_embeddings(raw, dim=self.dim)
+                pos = 0
+                for c, r, is_ok in zip(page, raw, valid):
+                    chunks.append(c)
+                    if is_ok:
+                        c["embedding"] = X[pos]
+                        pos += 1
+                        ok += 1
+                    else:
+                        # vide ou dimension incompatible → ignore
+                        c["embedding"] = None
+                        if r is None or (isinstance(r, (str, list)) and not r):
+                            bad_none += 1
+                        else:
+                            bad_dim += 1
             print(f"✅ {len(chunks)} chunks chargés (ok: {ok}, dim_mismatch: {bad_dim}, vides: {bad_none})")
             return chunks
         except Exception as e:
@@ -172,8 +171,7 @@ class SupabaseCareerCoachingService:
     # ----------- Création des chunks + embeddings -----------
     def process_and_chunk_profiles(self) -> bool:
         try:
-            profiles_response = supabase.table("profileslinkedin").select("*").execute()
-            profiles = profiles_response.data or []
+            profiles = list(iter_rows(supabase, "profileslinkedin"))
             if not profiles:
                 print("❌ Aucun profil LinkedIn trouvé")
                 return False
@@ -407,6 +405,11 @@ class SupabaseCareerCoachingService:
 
     # ----------- FAISS : build / load / search -----------
     def build_index_from_supabase(self):
+        with self.indexes.building():
+            return self._build_index_from_supabase()
+
+    def _build_index_from_supabase(self):
+        t0 = time.perf_counter()
         try:
             chunks = self.load_chunks_from_supabase()
             if not chunks:
@@ -421,8 +424,7 @@ class SupabaseCareerCoachingService:
             if not profiles:
                 raise ValueError("Aucun profil trouvé")
 
-            self.profile_map = {p["id"]: p for p in profiles}
-            self.chunk_map = {c["id"]: c for c in chunks}
+            maps = {"profiles": {p["id"]: p for p in profiles}, "chunks": {c["id"]: c for c in chunks}}
 
             embeddings: List[np.ndarray] = []
             chunk_ids: List[int] = []
@@ -452,17 +454,12 @@ class SupabaseCareerCoachingService:
 
             # Cosine via produit scalaire
             faiss.normalize_L2(X)
-            self.index = faiss.IndexFlatIP(self.dim)
-            self.index.add(X)
-            self.id_by_pos = chunk_ids[:]  # alignement position -> chunk_id
-
-            # Sauvegardes
-            faiss.write_index(self.index, INDEX_PATH)
-            with open(MAP_PATH, "w", encoding="utf-8") as f:
-                json.dump({
-                    "id_by_pos": self.id_by_pos,
-                    "created_at": datetime.now().isoformat()
-                }, f, ensure_ascii=False, indent=2)
+            index = faiss.IndexFlatIP(self.dim)
+            index.add(X)
+
+            # Snapshot (index + id_by_pos, alignement position -> chunk_id) puis bascule
+            self.indexes.publish(index, chunk_ids[:], maps, build_seconds=time.perf_counter() - t0,
+                                 persist=True, meta={"created_at": datetime.now().isoformat()})
 
             print(f"✅ Index FAISS créé avec {len(embeddings)} chunks")
             return True
@@ -472,23 +469,24 @@ class SupabaseCareerCoachingService:
             return False
 
     def load_index(self) -> bool:
+        t0 = time.perf_counter()
         try:
-            if not os.path.exists(INDEX_PATH) or not os.path.exists(MAP_PATH):
-                return False
-
-            self.index = faiss.read_index(INDEX_PATH)
-            with open(MAP_PATH, "r", encoding="utf-8") as f:
-                mapping_data = json.load(f)
-
-            self.id_by_pos = mapping_data.get("id_by_pos") or []
-
-            # Recharger les maps depuis Supabase (plus robuste que de les sérialiser)
-            profiles = self.load_profiles_from_supabase()
-            chunks = self.load_chunks_from_supabase()
-            self.profile_map = {p["id"]: p for p in profiles}
-            self.chunk_map = {c["id"]: c for c in chunks}
+            with self.indexes.building():
+                self.indexes.import_legacy(LEGACY_INDEX_PATH, LEGACY_MAP_PATH,
+                                           ids_from=lambda m: m.get("id_by_pos") or [])
+                loaded = self.indexes.load()
+                if loaded is None:
+                    return False
+                index, id_by_pos, _, path = loaded
+
+                # Recharger les maps depuis Supabase (plus robuste que de les sérialiser)
+                profiles = self.load_profiles_from_supabase()
+                chunks = self.load_chunks_from_supabase()
+                maps = {"profiles": {p["id"]: p for p in profiles}, "chunks": {c["id"]: c for c in chunks}}
+                self.indexes.publish(index, id_by_pos, maps, build_seconds=time.perf_counter() - t0,
+                                     version=os.path.basename(path))
 
-            print(f"✅ Index FAISS chargé avec {self.index.ntotal} vecteurs")
+            print(f"✅ Index FAISS chargé avec {index.ntotal} vecteurs")
             return True
 
         except Exception as e:
@@ -503,70 +501,74 @@ class SupabaseCareerCoachingService:
         return ids
 
     def search_similar_profiles(self, query: str, top_k: int = 10) -> List[ProfileHit]:
-        if not self.index or not self.chunk_map:
-            raise ValueError("Index non initialisé")
-
-        q = self.model.encode([query]).astype(np.float32)
-        faiss.normalize_L2(q)
-        scores, indices = self.index.search(q, top_k * 2)
-
-        profile_scores: Dict[int, List[float]] = {}
-        id_list = self._ids_from_indices(indices[0])
-
-        for score, chunk_id in zip(scores[0], id_list):
-            chunk = self.chunk_map.get(chunk_id)
-            if not chunk:
-                continue
-            pid = chunk.get("profile_id")
-            if pid is None:
-                continue
-            profile_scores.setdefault(pid, []).append(float(score))
-
-        results: List[ProfileHit] = []
-        for pid, s_list in profile_scores.items():
-            prof = self.profile_map.get(pid)
-            if not prof:
-                continue
-            avg = float(np.mean(s_list)) if s_list else 0.0
-            results.append(ProfileHit(
-                profile_id=pid,
-                score=avg,
-                nom=prof.get("nom", ""),
-                titre=prof.get("titre", ""),
-                formation=prof.get("formation", ""),
-                url=prof.get("url", "")
-            ))
-
-        results.sort(key=lambda x: x.score, reverse=True)
-        return results[:top_k]
+        # Un seul bundle pour toute la requête (rebuild concurrent sans effet)
+        with self.indexes.pinned():
+            if not self.index or not self.chunk_map:
+                raise ValueError("Index non initialisé")
+
+            q = self.model.encode([query]).astype(np.float32)
+            faiss.normalize_L2(q)
+            scores, indices = self.index.search(q, top_k * 2)
+
+            profile_scores: Dict[int, List[float]] = {}
+            id_list = self._ids_from_indices(indices[0])
+
+            for score, chunk_id in zip(scores[0], id_list):
+                chunk = self.chunk_map.get(chunk_id)
+                if not chunk:
+                    continue
+                pid = chunk.get("profile_id")
+                if pid is None:
+                    continue
+                profile_scores.setdefault(pid, []).append(float(score))
+
+            results: List[ProfileHit] = []
+            for pid, s_list in profile_scores.items():
+                prof = self.profile_map.get(pid)
+                if not prof:
+                    continue
+                avg = float(np.mean(s_list)) if s_list else 0.0
+                results.append(ProfileHit(
+                    profile_id=pid,
+                    score=avg,
+                    nom=prof.get("nom", ""),
+                    titre=prof.get("titre", ""),
+                    formation=prof.get("formation", ""),
+                    url=prof.get("url", "")
+                ))
+
+            results.sort(key=lambda x: x.score, reverse=True)
+            return results[:top_k]
 
     def search_relevant_chunks(self, query: str, top_k: int = 10) -> List[ChunkHit]:
-        if not self.index or not self.chunk_map:
-            raise ValueError("Index non initialisé")
-
-        q = self.model.encode([query]).astype(np.float32)
-        faiss.normalize_L2(q)
-        scores, indices = self.index.search(q, top_k)
-
-        results: List[ChunkHit] = []
-        id_list = self._ids_from_indices(indices[0])
-
-        for score, chunk_id in zip(scores[0], id_list):
-            chunk = self.chunk_map.get(chunk_id)
-            if not chunk:
-                continue
-            pid = chunk.get("profile_id")
-            prof = self.profile_map.get(pid, {})
-            results.append(ChunkHit(
-                chunk_id=chunk_id,
-                profile_id=pid,
-                score=float(score),
-                content=chunk.get("content", ""),
-                section=chunk.get("section", ""),
-                nom=prof.get("nom", ""),
-                titre=prof.get("titre", "")
-            ))
-        return results
+        # Un seul bundle pour toute la requête (rebuild concurrent sans effet)
+        with self.indexes.pinned():
+            if not self.index or not self.chunk_map:
+                raise ValueError("Index non initialisé")
+
+            q = self.model.encode([query]).astype(np.float32)
+            faiss.normalize_L2(q)
+            scores, indices = self.index.search(q, top_k)
+
+            results: List[ChunkHit] = []
+            id_list = self._ids_from_indices(indices[0])
+
+            for score, chunk_id in zip(scores[0], id_list):
+                chunk = self.chunk_map.get(chunk_id)
+                if not chunk:
+                    continue
+                pid = chunk.get("profile_id")
+                prof = self.profile_map.get(pid, {})
+                results.append(ChunkHit(
+                    chunk_id=chunk_id,
+                    profile_id=pid,
+                    score=float(score),
+                    content=chunk.get("content", ""),
+                    section=chunk.get("section", ""),
+                    nom=prof.get("nom", ""),
+                    titre=prof.get("titre", "")
+                ))
+            return results
 
     def get_rag_context(self, query: str, top_k: int = 5) -> str:
         try:
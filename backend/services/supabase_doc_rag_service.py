@@ -1,7 +1,9 @@
 # services/supabase_doc_rag_service.py
-import os, re, json
+import os, re, json, time, threading, weakref
+from collections import OrderedDict
+from itertools import islice
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
 
 import numpy as np
@@ -10,6 +12,10 @@ from sentence_transformers import SentenceTransformer
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+from services.supabase_pagination import iter_pages, iter_rows
+from services.embedding_codec import decode_embeddings
+from services.index_snapshots import IndexManager, append_delta, read_delta
+
 # Charger les variables d'environnement
 load_dotenv()
 
@@ -30,10 +36,25 @@ PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, ".."))
 # Modèle multilingue FR/EN (dim=768)
 EMBED_MODEL = os.getenv("DOC_EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
 
-# Chemins FAISS ABSOLUS pour Supabase
-INDEX_PATH = os.getenv("DOC_FAISS_INDEX", os.path.join(PROJECT_ROOT, "data", "supabase_doc_index.faiss"))
-MAP_PATH   = os.getenv("DOC_FAISS_MAP",   os.path.join(PROJECT_ROOT, "data", "supabase_doc_index_map.json"))
-os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+# Snapshots FAISS versionnés (chemin ABSOLU), un sous-répertoire par corpus
+SNAPSHOT_DIR = os.getenv("DOC_SNAPSHOT_DIR", os.path.join(PROJECT_ROOT, "data", "snapshots", "doc"))
+# Ancien index plat (tous les documents, utilisateurs compris): jamais importé dans le
+# corpus de référence, reconstruit depuis la base à la place
+LEGACY_INDEX_PATH = os.getenv("DOC_FAISS_INDEX", os.path.join(PROJECT_ROOT, "data", "supabase_doc_index.faiss"))
+# Corpus: textes de référence (CNSS, IR, SMIG...) d'un côté, documents utilisateurs
+# de l'autre, un index par user_id. L'indexation des uploads est désactivée par défaut:
+# aucune recherche ne cible encore les corpus utilisateurs (search(corpus=...)).
+REFERENCE_CORPUS = "reference"
+USER_DOC_TYPE = "user_document"
+INDEX_USER_UPLOADS = os.getenv("DOC_INDEX_USER_UPLOADS", "0") not in ("0", "false", "False")
+# Corpus utilisateurs gardés en mémoire (LRU); les autres sont rechargés depuis leur snapshot
+MAX_USER_CORPORA = int(os.getenv("DOC_MAX_USER_CORPORA", "16"))
+# Taille des lots in_("doc_id", ...) lors de la lecture des chunks d'un corpus
+DOC_ID_BATCH = int(os.getenv("DOC_ID_BATCH", "200"))
+# Snapshot réécrit (compactage du journal delta) après N vecteurs ajoutés par index_document
+DELTA_COMPACT_EVERY = int(os.getenv("DOC_DELTA_COMPACT_EVERY", "2048"))
+# Cache LRU des métadonnées de chunks (textes de référence CNSS/IR/SMIG servis sans réseau)
+META_CACHE_SIZE = int(os.getenv("DOC_META_CACHE_SIZE", "4096"))
 
 # ==================== HELPERS ====================
 def normalize_ws(s: str) -> str:
@@ -91,14 +112,89 @@ class ChunkHit:
     source: Optional[str]
     ord: int
 
+def user_corpus(user_id: int) -> str:
+    return f"user-{int(user_id)}"
+
+class DocCorpus:
+    """Corpus nommé: son propre index (snapshots dans SNAPSHOT_DIR/<nom>) et son filtre documents."""
+    def __init__(self, name: str, user_id: Optional[int] = None):
+        self.name = name
+        self.user_id = user_id
+        # Bundle (index, id_map: faiss row -> chunk_id, data: chunk_id -> position)
+        # remplacé d'un bloc à chaque build
+        self.indexes = IndexManager(name, os.path.join(SNAPSHOT_DIR, name))
+        self.delta_count = 0  # vecteurs présents uniquement dans le journal delta du snapshot
+
+    def where(self, q):
+        """Filtre PostgREST des documents du corpus."""
+        if self.user_id is None:
+            return q.or_(f"type.is.null,type.neq.{USER_DOC_TYPE}")
+        return q.eq("type", USER_DOC_TYPE).eq("user_id", self.user_id)
+
+    def stats(self) -> dict:
+        return {**self.indexes.stats(), "deltaVectors": self.delta_count}
+
 class SupabaseDocRAGService:
     def __init__(self):
         self.model = SentenceTransformer(EMBED_MODEL)
         self.dim = self.model.get_sentence_embedding_dimension()
         if self.dim != 768:
             print(f"[SupabaseDocRAG] Embedding dimension = {self.dim}")
-        self.index: Optional[faiss.Index] = None
-        self.id_map: List[str] = []  # map: faiss row -> chunk_id
+        # Corpus du moins au plus récemment utilisé (le corpus de référence n'est jamais évincé)
+        self.corpora: "OrderedDict[str, DocCorpus]" = OrderedDict({REFERENCE_CORPUS: DocCorpus(REFERENCE_CORPUS)})
+        # Tous les corpus encore référencés (y compris évincés mais utilisés par une requête en
+        # cours): un seul IndexManager par répertoire de snapshots
+        self._live_corpora: "weakref.WeakValueDictionary[str, DocCorpus]" = weakref.WeakValueDictionary(self.corpora)
+        self._corpora_lock = threading.Lock()
+        self.corpora_evictions = 0
+        self._meta_cache: "OrderedDict[str, dict]" = OrderedDict()  # chunk_id -> métadonnées
+        self._meta_lock = threading.Lock()
+        self.meta_stats = {"hits": 0, "misses": 0, "requests": 0}
+
+    def corpus(self, name: str = REFERENCE_CORPUS) -> DocCorpus:
+        """
+        Corpus `name` ("reference" ou "user-<id>"), créé à la première utilisation.
+        Création, reprise et éviction se font sous _corpora_lock: un corpus évincé
+        encore utilisé est repris tel quel au lieu d'ouvrir un second IndexManager
+        sur le même répertoire (journaux delta entrelacés).
+        """
+        with self._corpora_lock:
+            if name not in self.corpora:
+                if not name.startswith("user-"):
+                    raise ValueError(f"Corpus inconnu: {name}")
+                c = self._live_corpora.get(name)
+                if c is None:
+                    c = DocCorpus(name, user_id=int(name.split("-", 1)[1]))
+                    self._live_corpora[name] = c
+                self.corpora[name] = c
+                self._evict_corpora()
+            self.corpora.move_to_end(name)
+            return self.corpora[name]
+
+    def _evict_corpora(self) -> None:
+        """Au-delà de MAX_USER_CORPORA, libère les index utilisateurs les moins récents (sous _corpora_lock)."""
+        users = [n for n in self.corpora if n != REFERENCE_CORPUS]
+        for name in users[:max(0, len(users) - MAX_USER_CORPORA)]:
+            del self.corpora[name]
+            self.corpora_evictions += 1
+
+    def corpora_stats(self) -> Dict[str, dict]:
+        with self._corpora_lock:
+            corpora = list(self.corpora.values())
+        return {c.name: c.stats() for c in corpora}
+
+    # Vues sur le corpus de référence
+    @property
+    def indexes(self) -> IndexManager:
+        return self.corpora[REFERENCE_CORPUS].indexes
+
+    @property
+    def index(self) -> Optional[faiss.Index]:
+        return self.indexes.bundle.index
+
+    @property
+    def id_map(self) -> List[str]:
+        return self.indexes.bundle.id_map
 
     # ---------- UTIL: encode requête ----------
     def embed_text(self, text: str) -> np.ndarray:
@@ -151,18 +247,14 @@ class SupabaseDocRAGService:
         Si doc_id est fourni, ne traite que ce document
         """
         try:
-            # Construire la requête
-            query = supabase.table("documents").select("id, title, text, url, source")
-            
+            # Construire la requête (lecture paginée hors document unique)
+            columns = "id, title, text, url, source"
             if doc_id:
-                query = query.eq("id", doc_id)
+                docs = supabase.table("documents").select(columns).eq("id", doc_id).execute().data or []
             else:
-                query = query.order("created_at")
+                docs = iter_rows(supabase, "documents", columns)
                 if limit:
-                    query = query.limit(limit)
-            
-            result = query.execute()
-            docs = result.data
+                    docs = islice(docs, limit)
             
             inserted_total = 0
             for d in docs:
@@ -206,27 +298,28 @@ class SupabaseDocRAGService:
         Génère les embeddings pour les chunks qui n'en ont pas encore
         """
         try:
-            # Récupérer les chunks sans embedding
-            result = supabase.table("doc_chunks").select("id, content").is_("embedding", "null").order("created_at").execute()
-            rows = result.data
-            
+            # Récupérer les chunks sans embedding, page par page
+            pages = iter_pages(supabase, "doc_chunks", "id, content",
+                               where=lambda q: q.is_("embedding", "null"))
+
             total = 0
-            for i in range(0, len(rows), batch_size):
-                batch = rows[i:i+batch_size]
-                texts = [r["content"] for r in batch]
-                embs = self.model.encode(
-                    texts, convert_to_numpy=True, normalize_embeddings=True
-                ).astype("float32")
+            for rows in pages:
+                for i in range(0, len(rows), batch_size):
+                    batch = rows[i:i+batch_size]
+                    texts = [r["content"] for r in batch]
+                    embs = self.model.encode(
+                        texts, convert_to_numpy=True, normalize_embeddings=True
+                    ).astype("float32")
 
-                for r, v in zip(batch, embs):
-                    # Convertir l'embedding en liste pour Supabase
-                    embedding_list = v.tolist()
-                    
-                    supabase.table("doc_chunks").update({
-                        "embedding": embedding_list
-                    }).eq("id", r["id"]).execute()
-                    
-                total += len(batch)
+                    for r, v in zip(batch, embs):
+                        # Convertir l'embedding en liste pour Supabase
+                        embedding_list = v.tolist()
+
+                        supabase.table("doc_chunks").update({
+                            "embedding": embedding_list
+                        }).eq("id", r["id"]).execute()
+
+                    total += len(batch)
 
             print(f"[SupabaseDocRAG] embeddings générés pour {total} chunks")
             return {"embedded_chunks": total}
@@ -235,47 +328,205 @@ class SupabaseDocRAGService:
             print(f"[SupabaseDocRAG] Erreur lors de la génération d'embeddings: {e}")
             raise e
 
+    # ---------- 3bis) INDEXATION INCRÉMENTALE ----------
+    def index_document(self, doc_id: str, max_chars: int = 1200, overlap_chars: int = 200) -> dict:
+        """
+        Indexe UN document: chunking, un encode groupé, une insertion doc_chunks
+        (embeddings inclus) puis ajout de ses seuls vecteurs à l'index courant et
+        au journal delta. Le coût dépend de la taille du document, pas du corpus.
+        """
+        t0 = time.perf_counter()
+        docs = (
+            supabase.table("documents")
+            .select("id, title, text, url, source, type, user_id")
+            .eq("id", doc_id)
+            .execute()
+            .data or []
+        )
+        if not docs or not normalize_ws(docs[0].get("text")):
+            return {"doc_id": str(doc_id), "inserted_chunks": 0, "indexed": 0}
+        doc = docs[0]
+
+        existing = (
+            supabase.table("doc_chunks")
+            .select("id, content, doc_id, chunk_idx, embedding")
+            .eq("doc_id", doc["id"])
+            .execute()
+            .data or []
+        )
+        inserted = 0
+        if existing:
+            # Déjà chunké (ex. /doc-rag/chunk-specific): on réutilise les chunks, embeddings manquants calculés
+            chunks = existing
+            X, valid = decode_embeddings([c.get("embedding") for c in chunks], dim=self.dim)
+            if not valid.all():
+                todo = [c for c, ok in zip(chunks, valid) if not ok]
+                embs = self.model.encode(
+                    [c["content"] for c in todo], convert_to_numpy=True, normalize_embeddings=True
+                ).astype("float32")
+                for c, v in zip(todo, embs):
+                    supabase.table("doc_chunks").update({"embedding": v.tolist()}).eq("id", c["id"]).execute()
+                chunks = [c for c, ok in zip(chunks, valid) if ok] + todo
+                X = np.vstack([X, embs])
+        else:
+            parts = [
+                (ord_, normalize_ws(part))
+                for ord_, part in enumerate(chunk_by_sentences(doc["text"], max_chars=max_chars, overlap_chars=overlap_chars))
+            ]
+            parts = [(ord_, part) for ord_, part in parts if part]
+            if not parts:
+                return {"doc_id": str(doc["id"]), "inserted_chunks": 0, "indexed": 0}
+            X = self.model.encode(
+                [part for _, part in parts], convert_to_numpy=True, normalize_embeddings=True
+            ).astype("float32")
+            chunks = supabase.table("doc_chunks").insert([
+                {
+                    "doc_id": doc["id"],
+                    "chunk_idx": ord_,
+                    "content": part,
+                    "token_count": len(part.split()),
+                    "embedding": v.tolist(),
+                }
+                for (ord_, part), v in zip(parts, X)
+            ]).execute().data or []
+            if len(chunks) != len(parts):
+                raise RuntimeError("Insertion doc_chunks incomplète")
+            inserted = len(chunks)
+
+        if doc.get("type") == USER_DOC_TYPE:
+            if not INDEX_USER_UPLOADS:
+                # Chunks et embeddings stockés, mais aucun index utilisateur tenu
+                return {"doc_id": str(doc["id"]), "inserted_chunks": inserted, "indexed": 0, "corpus": None,
+                        "seconds": round(time.perf_counter() - t0, 3)}
+            corpus = user_corpus(doc.get("user_id") or 0)
+        else:
+            corpus = REFERENCE_CORPUS
+
+        # Les recherches qui suivent l'upload retombent sur ces chunks: cache pré-rempli
+        self._remember_meta([self._chunk_meta({**c, "documents": doc}) for c in chunks])
+        added = self.add_vectors([int(c["id"]) for c in chunks], X, corpus=corpus)
+        # Un corpus sans index est d'abord construit depuis la base: ses chunks y sont déjà
+        pos_by_id = self.corpus(corpus).indexes.bundle.data or {}
+        indexed = sum(str(c["id"]) in pos_by_id for c in chunks)
+        print(f"[SupabaseDocRAG] Document {doc['id']} indexé dans {corpus}: {indexed} vecteurs ({time.perf_counter() - t0:.2f}s)")
+        return {"doc_id": str(doc["id"]), "inserted_chunks": inserted, "indexed": indexed, "added": added,
+                "corpus": corpus, "seconds": round(time.perf_counter() - t0, 3)}
+
+    def add_vectors(self, chunk_ids: List[int], X: np.ndarray, corpus: str = REFERENCE_CORPUS,
+                    persist: bool = True) -> int:
+        """
+        Ajoute des vecteurs au corpus (un seul index.add) et à son journal delta; ids déjà
+        indexés ignorés. Le bundle servi est étendu en place sous `rw.write()` (cf. IndexBundle).
+        """
+        c = self.corpus(corpus)
+        with c.indexes.building():
+            if c.indexes.bundle.index is None and not self._build_or_load_faiss(c):
+                # Corpus vide: premier index
+                c.indexes.publish(faiss.IndexFlatIP(self.dim), [], {})
+            bundle = c.indexes.bundle
+            pos_by_id: Dict[str, int] = bundle.data
+
+            keep, seen = [], set()
+            for i, cid in enumerate(chunk_ids):
+                if str(cid) in pos_by_id or cid in seen:
+                    continue
+                keep.append(i)
+                seen.add(cid)
+            if not keep:
+                return 0
+            X = np.asarray(X, dtype="float32")[keep].copy()
+            faiss.normalize_L2(X)
+            ids = [int(chunk_ids[i]) for i in keep]
+
+            with c.indexes.rw.write():
+                bundle.index.add(X)
+                for cid in ids:
+                    bundle.id_map.append(str(cid))
+                    pos_by_id[str(cid)] = len(bundle.id_map) - 1
+
+            if persist:
+                path = c.indexes.snapshot_path
+                if path is None:
+                    self.compact(corpus)
+                else:
+                    append_delta(path, ids, X)
+                    c.delta_count += len(ids)
+                    if c.delta_count >= DELTA_COMPACT_EVERY:
+                        self.compact(corpus)
+            return len(ids)
+
+    def compact(self, corpus: str = REFERENCE_CORPUS) -> bool:
+        """Écrit un nouveau snapshot de l'index du corpus; le journal delta repart à vide."""
+        c = self.corpus(corpus)
+        with c.indexes.building():
+            try:
+                if c.indexes.snapshot() is None:
+                    return False
+                c.delta_count = 0
+                return True
+            except Exception as e:
+                print(f"[SupabaseDocRAG] Erreur compactage FAISS ({corpus}): {e}")
+                return False
+
     # ---------- 4) FAISS ----------
-    def build_or_load_faiss(self) -> bool:
-        # 1) Essayer depuis disque
+    def build_or_load_faiss(self, corpus: str = REFERENCE_CORPUS) -> bool:
+        c = self.corpus(corpus)
+        with c.indexes.building():
+            return self._build_or_load_faiss(c)
+
+    def _iter_corpus_chunk_pages(self, c: DocCorpus):
+        """Pages de chunks embeddés des documents du corpus (lots in_ de DOC_ID_BATCH doc_ids)."""
+        doc_ids = [d["id"] for d in iter_rows(supabase, "documents", "id", where=c.where)]
+        for start in range(0, len(doc_ids), DOC_ID_BATCH):
+            batch = doc_ids[start:start + DOC_ID_BATCH]
+            yield from iter_pages(supabase, "doc_chunks", "id, embedding",
+                                  where=lambda q, b=batch: q.in_("doc_id", b).not_.is_("embedding", "null"))
+
+    def _build_or_load_faiss(self, c: DocCorpus) -> bool:
+        # 1) Essayer depuis le snapshot courant
+        t0 = time.perf_counter()
         try:
-            if os.path.exists(INDEX_PATH) and os.path.exists(MAP_PATH):
-                self.index = faiss.read_index(INDEX_PATH)
-                with open(MAP_PATH, "r", encoding="utf-8") as f:
-                    self.id_map = json.load(f)
-                print("[SupabaseDocRAG] FAISS index chargé depuis disque")
+            loaded = c.indexes.load()
+            if loaded is not None:
+                index, id_map, _, path = loaded
+                # Vecteurs ajoutés par index_document depuis le snapshot
+                ids, vecs = read_delta(path, index.d)
+                known = set(id_map)
+                keep = np.zeros(ids.shape[0], dtype=bool)
+                for k, cid in enumerate(ids.tolist()):
+                    if str(cid) not in known:
+                        keep[k] = True
+                        known.add(str(cid))
+                if keep.any():
+                    index.add(np.ascontiguousarray(vecs[keep]))
+                    id_map.extend(str(cid) for cid in ids[keep].tolist())
+                c.indexes.publish(index, id_map, {cid: i for i, cid in enumerate(id_map)},
+                                  build_seconds=time.perf_counter() - t0, version=os.path.basename(path))
+                c.delta_count = int(ids.shape[0])
+                print(f"[SupabaseDocRAG] FAISS index {c.name} chargé depuis disque")
                 return True
         except Exception as e:
-            print("[SupabaseDocRAG] load FAISS error:", e)
+            print(f"[SupabaseDocRAG] load FAISS error ({c.name}):", e)
 
-        # 2) Lire depuis Supabase
-        try:
-            result = supabase.table("doc_chunks").select("id, embedding").not_.is_("embedding", "null").order("doc_id, chunk_idx").execute()
-            rows = result.data
-            
-            if not rows:
-                print("[SupabaseDocRAG] Aucun embedding trouvé en base")
-                return False
+        if c.name == REFERENCE_CORPUS and c.indexes.snapshot_path is None and os.path.exists(LEGACY_INDEX_PATH):
+            print(f"[SupabaseDocRAG] Ancien index {LEGACY_INDEX_PATH} ignoré: il mélange tous les documents, "
+                  f"corpus {c.name} reconstruit depuis la base")
 
+        # 2) Lire depuis Supabase (documents du corpus uniquement)
+        try:
             ids, mats = [], []
-            for row in rows:
-                chunk_id = str(row["id"])
-                embedding = row["embedding"]
-                
-                if embedding is None:
-                    continue
-                    
-                # Convertir l'embedding en numpy array
-                v = np.asarray(embedding, dtype="float32")
-                ids.append(chunk_id)
-                mats.append(v)
-
-            if not mats:
-                print("[SupabaseDocRAG] Tous les embeddings lus sont vides/invalides")
+            for rows in self._iter_corpus_chunk_pages(c):
+                # Décodage de la page en une matrice (dimension du modèle validée)
+                X_page, valid = decode_embeddings([r["embedding"] for r in rows], dim=self.dim)
+                ids.extend(str(r["id"]) for r, ok in zip(rows, valid) if ok)
+                mats.append(X_page)
+
+            if not ids:
+                print(f"[SupabaseDocRAG] Aucun embedding valide trouvé en base ({c.name})")
                 return False
 
         except Exception as e:
-            print(f"[SupabaseDocRAG] Erreur lors de la lecture des embeddings: {e}")
+            print(f"[SupabaseDocRAG] Erreur lors de la lecture des embeddings ({c.name}): {e}")
             return False
 
         # 3) Construire l'index FAISS
@@ -284,73 +535,122 @@ class SupabaseDocRAGService:
         index = faiss.IndexFlatIP(X.shape[1])
         index.add(X)
 
-        self.index = index
-        self.id_map = ids  # LISTE ordonnée (alignée avec add)
-        faiss.write_index(index, INDEX_PATH)
-        with open(MAP_PATH, "w", encoding="utf-8") as f:
-            json.dump(self.id_map, f)
+        # Snapshot écrit puis bundle publié: les recherches en cours gardent l'ancien index
+        # (ids = LISTE ordonnée, alignée avec add)
+        pos_by_id = {cid: i for i, cid in enumerate(ids)}
+        try:
+            c.indexes.publish(index, ids, pos_by_id, build_seconds=time.perf_counter() - t0, persist=True)
+            c.delta_count = 0
+        except Exception as e:
+            print(f"[SupabaseDocRAG] Erreur écriture snapshot FAISS ({c.name}): {e}")
+            c.indexes.publish(index, ids, pos_by_id, build_seconds=time.perf_counter() - t0)
 
-        print(f"[SupabaseDocRAG] FAISS construit: {X.shape[0]} vecteurs, dim={X.shape[1]}")
+        print(f"[SupabaseDocRAG] FAISS {c.name} construit: {X.shape[0]} vecteurs, dim={X.shape[1]}")
         return True
 
     # ---------- 5) SEARCH ----------
-    def _fetch_chunk_meta(self, chunk_id: str) -> dict:
+    @staticmethod
+    def _chunk_meta(r: dict) -> dict:
+        doc_info = r.get("documents") or {}
+        return {
+            "chunk_id": str(r["id"]),
+            "text": r["content"] or "",
+            "doc_id": str(r["doc_id"]),
+            "ord": int(r["chunk_idx"]),
+            "title": doc_info.get("title"),
+            "url": doc_info.get("url"),
+            "source": doc_info.get("source"),
+        }
+
+    def _fetch_chunks_meta(self, chunk_ids: List[str]) -> Dict[str, dict]:
         """
-        Récupère les métadonnées d'un chunk depuis Supabase
+        Métadonnées de plusieurs chunks: cache LRU d'abord, puis UN SEUL select
+        in_("id", ...) avec jointure documents pour les absents. Les ids
+        introuvables ou non entiers sont simplement absents du résultat.
         """
+        out: Dict[str, dict] = {}
+        missing: List[int] = []
+        with self._meta_lock:
+            for cid in chunk_ids:
+                meta = self._meta_cache.get(cid)
+                if meta is not None:
+                    self._meta_cache.move_to_end(cid)
+                    out[cid] = meta
+                    continue
+                try:
+                    missing.append(int(cid))
+                except (ValueError, TypeError):
+                    print(f"[SupabaseDocRAG] chunk_id {cid} n'est pas un entier valide")
+            self.meta_stats["hits"] += len(out)
+            self.meta_stats["misses"] += len(missing)
+
+        if not missing:
+            return out
         try:
-            # Convertir chunk_id en int si c'est une string numérique
-            try:
-                chunk_id_int = int(chunk_id)
-            except (ValueError, TypeError):
-                # Si ce n'est pas un entier, essayons de chercher par UUID dans une autre colonne
-                # ou retournons un dict vide
-                print(f"[SupabaseDocRAG] chunk_id {chunk_id} n'est pas un entier valide")
-                return {}
-
-            result = supabase.table("doc_chunks").select(
-                "id, content, doc_id, chunk_idx, documents(title, url, source)"
-            ).eq("id", chunk_id_int).execute()
-
-            if not result.data:
-                print(f"[SupabaseDocRAG] Aucun chunk trouvé avec l'ID {chunk_id_int}")
-                return {}
-
-            r = result.data[0]
-            doc_info = r.get("documents", {})
-
-            return {
-                "chunk_id": str(r["id"]),
-                "text": r["content"] or "",
-                "doc_id": str(r["doc_id"]),
-                "ord": int(r["chunk_idx"]),
-                "title": doc_info.get("title"),
-                "url": doc_info.get("url"),
-                "source": doc_info.get("source"),
-            }
-
+            rows = (
+                supabase.table("doc_chunks")
+                .select("id, content, doc_id, chunk_idx, documents(title, url, source)")
+                .in_("id", missing)
+                .execute()
+                .data or []
+            )
         except Exception as e:
-            print(f"[SupabaseDocRAG] Erreur lors de la récupération des métadonnées pour chunk {chunk_id}: {e}")
-            return {}
+            print(f"[SupabaseDocRAG] Erreur lors de la récupération des métadonnées ({len(missing)} chunks): {e}")
+            return out
+
+        metas = [self._chunk_meta(r) for r in rows]
+        with self._meta_lock:
+            self.meta_stats["requests"] += 1
+        self._remember_meta(metas)
+        out.update((m["chunk_id"], m) for m in metas)
+        return out
+
+    def _remember_meta(self, metas: List[dict]) -> None:
+        with self._meta_lock:
+            for meta in metas:
+                self._meta_cache[meta["chunk_id"]] = meta
+                self._meta_cache.move_to_end(meta["chunk_id"])
+            while len(self._meta_cache) > META_CACHE_SIZE:
+                self._meta_cache.popitem(last=False)
+
+    def meta_cache_info(self) -> dict:
+        with self._meta_lock:
+            return {**self.meta_stats, "size": len(self._meta_cache), "maxSize": META_CACHE_SIZE}
 
-    def search(self, query: str, top_k: int = 6) -> list[dict]:
+    def _fetch_chunk_meta(self, chunk_id: str) -> dict:
+        """
+        Récupère les métadonnées d'un chunk depuis Supabase
         """
-        Recherche dans l'index FAISS et retourne les chunks les plus pertinents
+        return self._fetch_chunks_meta([chunk_id]).get(chunk_id, {})
+
+    def search(self, query: str, top_k: int = 6, corpus: str = REFERENCE_CORPUS) -> list[dict]:
+        """
+        Recherche dans l'index FAISS du corpus (référence par défaut) et retourne
+        les chunks les plus pertinents
         """
-        if self.index is None or not self.id_map:
-            ok = self.build_or_load_faiss()
+        c = self.corpus(corpus)
+        if c.indexes.bundle.index is None or not c.indexes.bundle.id_map:
+            ok = self.build_or_load_faiss(corpus)
             if not ok:
                return []
 
+        # Un seul bundle pour toute la requête (index et id_map cohérents même pendant un rebuild)
+        bundle = c.indexes.bundle
         q = self.embed_text(query)[None, :]  # (1, dim)
-        D, I = self.index.search(q.astype("float32"), top_k)
+        with c.indexes.rw.read():
+            D, I = bundle.index.search(q.astype("float32"), top_k)
+
+        hits = [
+            (bundle.id_map[faiss_idx], score)
+            for faiss_idx, score in zip(I[0].tolist(), D[0].tolist())
+            if 0 <= faiss_idx < len(bundle.id_map)
+        ]
+        # Hydratation groupée (cache + une requête in_), ordre des rangs FAISS conservé
+        metas = self._fetch_chunks_meta([cid for cid, _ in hits])
 
         out: list[dict] = []
-        for faiss_idx, score in zip(I[0].tolist(), D[0].tolist()):
-            if faiss_idx < 0 or faiss_idx >= len(self.id_map):
-              continue
-            cid = self.id_map[faiss_idx]
-            m = self._fetch_chunk_meta(cid)
+        for cid, score in hits:
+            m = metas.get(cid)
             if not m:
                 continue
             out.append({
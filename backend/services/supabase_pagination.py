@@ -0,0 +1,44 @@
+# services/supabase_pagination.py
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Taille de page par défaut. PostgREST plafonne chaque réponse (max-rows, 1000 par
+# défaut): une requête non paginée est tronquée silencieusement au-delà.
+SUPABASE_PAGE_SIZE = int(os.getenv("SUPABASE_PAGE_SIZE", "1000"))
+
+
+def iter_pages(client, table: str, columns: str = "*", page_size: Optional[int] = None,
+               key: str = "id", where: Optional[Callable[[Any], Any]] = None) -> Iterator[List[Dict]]:
+    """
+    Parcourt `table` par pages ordonnées sur `key` (pagination keyset: `key > dernier`).
+
+    - `columns`: projection PostgREST; `key` y est ajoutée si absente.
+    - `where`: callable appliqué à la requête (filtres eq/is_/ilike...).
+    - `key` doit être unique et non nulle (typiquement la clé primaire).
+
+    L'arrêt se fait sur une page vide plutôt que sur une page incomplète: si le
+    serveur plafonne sous `page_size`, aucune ligne n'est perdue.
+    """
+    page_size = page_size or SUPABASE_PAGE_SIZE
+    if columns.strip() != "*" and key not in [c.strip() for c in columns.split(",")]:
+        columns = f"{key}, {columns}"
+
+    last = None
+    while True:
+        q = client.table(table).select(columns)
+        if where is not None:
+            q = where(q)
+        if last is not None:
+            q = q.gt(key, last)
+        page = q.order(key).limit(page_size).execute().data or []
+        if not page:
+            break
+        yield page
+        last = page[-1][key]
+
+
+def iter_rows(client, table: str, columns: str = "*", page_size: Optional[int] = None,
+              key: str = "id", where: Optional[Callable[[Any], Any]] = None) -> Iterator[Dict]:
+    """Comme iter_pages, ligne par ligne."""
+    for page in iter_pages(client, table, columns, page_size=page_size, key=key, where=where):
+        yield from page
@@ -1,14 +1,19 @@
 # services/supabase_salary_rag_service.py
-import os, re, json
-from dataclasses import dataclass
-from typing import Optional, List, Dict, Tuple, Any
+import os, re, json, time, bisect, shutil, unicodedata
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Tuple, Any, Set, Iterable
 
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 from supabase import create_client, Client
 from dotenv import load_dotenv
-import requests
+
+from services.gemini_client import gemini_client
+from services.location_resolver import CITIES_DATABASE, guess_city_country, location_resolver
+from services.supabase_pagination import iter_pages, iter_rows
+from services.embedding_codec import decode_embeddings
+from services.index_snapshots import IndexManager, append_delta, read_delta
 
 load_dotenv()
 
@@ -18,28 +23,40 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("❌ SUPABASE_URL / SUPABASE_KEY manquants dans .env")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_MODEL   = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-
-def call_gemini_api(prompt: str) -> str:
-    if not GEMINI_API_KEY:
-        raise RuntimeError("❌ GEMINI_API_KEY manquant dans .env")
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
-    r = requests.post(url, json=payload, timeout=90)
-    r.raise_for_status()
-    data = r.json()
-    txt = ""
-    for c in (data.get("candidates") or []):
-        for p in (c.get("content") or {}).get("parts") or []:
-            if "text" in p:
-                txt += p["text"]
-    return txt.strip()
+def call_gemini_api(prompt: str, timeout: Optional[float] = None) -> str:
+    """Appel Gemini bloquant via le client poolé (keep-alive, concurrence bornée)."""
+    return gemini_client.generate(prompt, timeout=timeout)
+
+async def acall_gemini_api(prompt: str, timeout: Optional[float] = None) -> str:
+    """Variante non bloquante de call_gemini_api pour les handlers async."""
+    return await gemini_client.agenerate(prompt, timeout=timeout)
+
+def _parse_llm_json(raw: str) -> Dict[str, Any]:
+    cleaned = raw.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.removeprefix("```json").removeprefix("```").strip()
+    if cleaned.endswith("```"):
+        cleaned = cleaned.removesuffix("```").strip()
+    return json.loads(cleaned)
 
 SALARY_EMBED_MODEL = os.getenv("SALARY_EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
-INDEX_PATH = os.getenv("SALARY_FAISS_INDEX", os.path.join(os.path.dirname(__file__), "..", "data", "supabase_salary_index.faiss"))
-MAP_PATH   = os.getenv("SALARY_FAISS_MAP",   os.path.join(os.path.dirname(__file__), "..", "data", "supabase_salary_index_map.json"))
-os.makedirs(os.path.abspath(os.path.join(os.path.dirname(INDEX_PATH))), exist_ok=True)
+# Snapshots versionnés (index.faiss, map.json, sidecar colonnes, journal delta)
+SNAPSHOT_DIR = os.getenv("SALARY_SNAPSHOT_DIR", os.path.join(os.path.dirname(__file__), "..", "data", "snapshots", "salary"))
+# Anciens fichiers plats, importés dans un premier snapshot s'il n'en existe aucun
+LEGACY_INDEX_PATH = os.getenv("SALARY_FAISS_INDEX", os.path.join(os.path.dirname(__file__), "..", "data", "supabase_salary_index.faiss"))
+LEGACY_MAP_PATH = os.getenv("SALARY_FAISS_MAP", os.path.join(os.path.dirname(__file__), "..", "data", "supabase_salary_index_map.json"))
+# Compactage du journal delta du snapshot courant après N vecteurs ajoutés
+DELTA_COMPACT_EVERY = int(os.getenv("SALARY_DELTA_COMPACT_EVERY", "256"))
+# Métadonnées colonnes (.npy + meta.json) du snapshot, chargées en mmap au démarrage
+SIDECAR_SUBDIR = "columns"
+# Vérification du watermark salary_dataset au chargement (0 = aucun appel réseau au démarrage)
+SIDECAR_VERIFY = os.getenv("SALARY_SIDECAR_VERIFY", "1") not in ("0", "false", "False")
+# Taille des lots in_() lors de la réhydratation des métadonnées depuis salary_dataset
+HYDRATE_BATCH_SIZE = int(os.getenv("SALARY_HYDRATE_BATCH", "500"))
+# Taille minimale d'une cohorte pour valider une saisie sans recherche ANN
+COHORT_MIN_COUNT = int(os.getenv("SALARY_COHORT_MIN", "10"))
+# Recherche restreinte aux sous-index (pays, expérience) au lieu d'un filtrage a posteriori
+PARTITIONED_SEARCH = os.getenv("SALARY_PARTITIONED_SEARCH", "1") not in ("0", "false", "False")
 
 def _clean(s: Optional[str]) -> str:
     return re.sub(r"\s+", " ", (s or "").strip())
@@ -51,77 +68,6 @@ def _level_from_years(y: Optional[int]) -> str:
     if y <= 10: return "senior"
     return "expert"
 
-# Base de données flexible des villes par pays
-CITIES_DATABASE = {
-    "Maroc": {
-        "casablanca", "rabat", "tanger", "tangier", "fes", "fès", "marrakech", "marrakesh", "agadir",
-        "meknes", "meknès", "kenitra", "kénitra", "tetouan", "tétouan", "safi", "el jadida", "oujda",
-        "nador", "salé", "sale", "temara", "témara", "mohammedia", "khouribga", "laayoune", "al hoceima",
-        "beni mellal", "berrechid", "berkan", "guelmim"
-    },
-    "France": {
-        "paris", "lyon", "marseille", "toulouse", "nice", "nantes", "montpellier", "strasbourg", 
-        "bordeaux", "lille", "rennes", "reims", "toulon", "saint-étienne", "le havre", "grenoble",
-        "dijon", "angers", "nîmes", "villeurbanne"
-    },
-    "United States": {
-        "new york", "los angeles", "chicago", "houston", "phoenix", "philadelphia", "san antonio",
-        "san diego", "dallas", "san jose", "austin", "jacksonville", "fort worth", "columbus",
-        "charlotte", "san francisco", "indianapolis", "seattle", "denver", "boston", "el paso",
-        "detroit", "nashville", "portland", "oklahoma city", "las vegas", "baltimore", "louisville",
-        "milwaukee", "albuquerque", "tucson", "fresno", "sacramento", "mesa", "kansas city",
-        "atlanta", "long beach", "colorado springs", "raleigh", "miami", "virginia beach", "omaha",
-        "oakland", "minneapolis", "tulsa", "arlington", "wichita", "new orleans", "cleveland"
-    },
-    "Canada": {
-        "toronto", "montreal", "vancouver", "calgary", "ottawa", "edmonton", "mississauga", "winnipeg",
-        "quebec", "québec", "halifax", "hamilton", "london", "kitchener", "st. catharines", "niagara",
-        "oshawa", "victoria", "windsor", "saskatoon", "regina", "sherbrooke", "kelowna", "barrie"
-    },
-    "Germany": {
-        "berlin", "hamburg", "munich", "münchen", "cologne", "köln", "frankfurt", "stuttgart",
-        "düsseldorf", "dortmund", "essen", "leipzig", "bremen", "dresden", "hanover", "hannover",
-        "nuremberg", "nürnberg", "duisburg", "bochum", "wuppertal", "bielefeld", "bonn", "münster"
-    },
-    "United Kingdom": {
-        "london", "birmingham", "liverpool", "leeds", "glasgow", "sheffield", "bradford", "edinburgh",
-        "leicester", "manchester", "bristol", "wakefield", "cardiff", "coventry", "nottingham",
-        "newcastle", "belfast", "brighton", "hull", "plymouth", "stoke", "wolverhampton", "derby",
-        "swansea", "southampton", "salford", "aberdeen", "westminster", "portsmouth", "york"
-    }
-}
-
-def guess_city_country(location: str) -> tuple[Optional[str], str]:
-    """Devine la ville et le pays à partir d'une localisation flexible"""
-    loc = _clean(location).lower()
-    if not loc:
-        return None, "Global"
-    
-    # Recherche directe dans la base de données des villes
-    for country, cities in CITIES_DATABASE.items():
-        for city in cities:
-            if city in loc:
-                # Retourner le nom propre de la ville
-                city_proper = city.title().replace("Fes","Fès").replace("Meknes","Meknès")
-                return city_proper, country
-    
-    # Recherche par mots-clés de pays
-    country_keywords = {
-        "Maroc": ["maroc", "morocco", "ma"],
-        "France": ["france", "french", "fr"],
-        "United States": ["usa", "united states", "etats-unis", "états-unis", "us", "u.s.", "america"],
-        "Canada": ["canada", "canadian", "ca"],
-        "Germany": ["germany", "deutschland", "german", "de"],
-        "United Kingdom": ["uk", "united kingdom", "britain", "england", "scotland", "wales", "gb"]
-    }
-    
-    for country, keywords in country_keywords.items():
-        if any(keyword in loc for keyword in keywords):
-            return None, country
-    
-    # Si rien trouvé, retourner la localisation comme ville générique
-    return (loc.split(",")[0].title(), "Global")
-
 def get_market_from_country(country: str) -> str:
     """Identifie le marché économique principal d'un pays"""
     market_mapping = {
@@ -135,6 +81,22 @@ def get_market_from_country(country: str) -> str:
     }
     return market_mapping.get(country, "Marché Global")
 
+# Expériences acceptées par search() (filtre large)
+SEARCH_COMPATIBLE_EXPERIENCE = {
+    "0-2 ans": ["0-2 ans"],
+    "3-5 ans": ["0-2 ans", "3-5 ans", "2-5 ans"],
+    "5-10 ans": ["3-5 ans", "5-10 ans", "5+ ans"],
+    "10+ ans": ["5-10 ans", "10+ ans", "5+ ans", "8+ ans"]
+}
+
+# Élargissement utilisé par search_with_experience_priority() quand l'expérience exacte est rare
+PRIORITY_COMPATIBLE_EXPERIENCE = {
+    "0-2 ans": ["0-2 ans", "2-5 ans"],
+    "3-5 ans": ["0-2 ans", "3-5 ans", "2-5 ans", "3-6 ans"],
+    "5-10 ans": ["3-5 ans", "5-10 ans", "5+ ans", "3-6 ans"],
+    "10+ ans": ["5-10 ans", "10+ ans", "5+ ans", "8+ ans"]
+}
+
 def years_str(y: Optional[int]) -> str:
     if y is None: return "3-5 ans"
     if y <= 2: return "0-2 ans"
@@ -143,22 +105,15 @@ def years_str(y: Optional[int]) -> str:
     return "10+ ans"
 
 # parse pgvector -> np.float32
-def _as_float32_vector(emb):
-    if emb is None:
-        return None
-    if isinstance(emb, np.ndarray):
-        return emb.astype("float32")
-    if isinstance(emb, list):
-        return np.asarray(emb, dtype="float32")
-    if isinstance(emb, str):
-        s = emb.strip()
-        if s.startswith("[") and s.endswith("]"):
-            return np.asarray(json.loads(s), dtype="float32")
-        s = s.strip("()[]{}")
-        parts = re.split(r"[,\s]+", s)
-        vals = [float(x) for x in parts if x]
-        return np.asarray(vals, dtype="float32")
-    raise TypeError(f"Unsupported embedding type: {type(emb)}")
+@dataclass
+class RetrievalQuery:
+    """Une requête du plan de recherche: texte à encoder + filtre expérience."""
+    key: str
+    text: str
+    experiences: List[str]
+    k: int       # profondeur FAISS (sur-échantillonnage avant filtre)
+    top_k: int   # nombre de résultats conservés après filtre
+    countries: Optional[List[str]] = None  # partitions pays à interroger (None = toutes)
 
 @dataclass
 class SalaryRow:
@@ -172,12 +127,448 @@ class SalaryRow:
     market: str
     raw: Dict
 
+def _chunk_content(ds: Dict) -> str:
+    """Contenu texte enrichi d'un chunk salary_chunks pour une ligne salary_dataset."""
+    location_str = ds.get("ville") or ds.get("pays") or "Global"
+    market = get_market_from_country(ds.get("pays") or "Global")
+    return _clean(
+        f"Poste: {ds.get('poste') or ''} | "
+        f"Localisation: {location_str} | "
+        f"Pays: {ds.get('pays') or 'Global'} | "
+        f"Marché: {market} | "
+        f"Experience: {ds.get('experience') or ''} | "
+        f"Salaire: {int(float(ds.get('salaire_moyen') or 0))} MAD/mois | "
+        f"Fourchette: {int(float(ds.get('salaire_min') or 0))}-{int(float(ds.get('salaire_max') or 0))} MAD"
+    )
+
+_TITLE_STOPWORDS = {
+    "senior", "junior", "sr", "jr", "lead", "principal", "confirme", "debutant", "stagiaire", "intern",
+    "de", "du", "des", "la", "le", "les", "en", "et", "of", "the", "h", "f",
+}
+
+def title_family(job_title: str) -> str:
+    """Famille de poste normalisée: sans accents, casse, séniorité ni mots vides."""
+    s = unicodedata.normalize("NFKD", _clean(job_title).lower())
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    tokens = [t for t in re.split(r"[^a-z0-9+#]+", s) if t and t not in _TITLE_STOPWORDS]
+    return " ".join(sorted(set(tokens))) or s
+
+def _row_from_dataset(ds: Dict, raw: Optional[Dict] = None) -> "SalaryRow":
+    """Construit un SalaryRow à partir d'une ligne salary_dataset."""
+    location_str = ds.get("ville") or ds.get("pays") or "Global"
+    country = ds.get("pays") or "Global"
+    return SalaryRow(
+        id=int(ds["id"]),
+        job_title=_clean(ds.get("poste") or ""),
+        location=_clean(location_str),
+        experience_level=ds.get("experience") or "3-5 ans",
+        salary=float(ds.get("salaire_moyen") or 0.0),
+        currency="MAD",
+        country=country,
+        market=get_market_from_country(country),
+        raw=raw or {},
+    )
+
+def _legacy_salary_ids(raw: Any) -> List[int]:
+    """id_map d'un ancien index plat: un id salary_dataset par vecteur, sans doublon."""
+    ids = [int(x) for x in raw]
+    if len(set(ids)) != len(ids):
+        raise ValueError("ids salary_dataset en double (un vecteur par chunk)")
+    return ids
+
+def _reserve(buf: np.ndarray, n: int) -> np.ndarray:
+    """Tampon d'au moins n + 1 cases, contenu [:n] conservé (capacité doublée, copie si lecture seule)."""
+    if n < buf.shape[0] and buf.flags.writeable:
+        return buf
+    grown = np.empty(max(16, 2 * buf.shape[0]), dtype=buf.dtype)
+    grown[:n] = buf[:n]
+    return grown
+
+@dataclass
+class SalaryColumns:
+    """
+    Colonnes alignées sur les positions FAISS: salaire en float64 et catégories
+    encodées en entiers, avec les effectifs par code pré-calculés au build.
+    Chaque colonne est une vue [:n] d'un tampon à capacité doublée: append est
+    en O(1) amorti au lieu de recopier la colonne (np.append).
+    """
+    salary: np.ndarray
+    experience: np.ndarray
+    country: np.ndarray
+    city: np.ndarray
+    market: np.ndarray
+    vocab: Dict[str, Dict[str, int]]
+    counts: Dict[str, np.ndarray]
+
+    COLUMNS = ("salary", "experience", "country", "city", "market")
+
+    def __post_init__(self):
+        self._n = int(self.salary.shape[0])
+        self._buffers = {f: getattr(self, f) for f in self.COLUMNS}
+
+    @staticmethod
+    def _categories(row: "SalaryRow") -> Tuple[Tuple[str, str], ...]:
+        return (("experience", row.experience_level), ("country", row.country),
+                ("city", row.location), ("market", row.market))
+
+    @classmethod
+    def from_rows(cls, rows: List["SalaryRow"]) -> "SalaryColumns":
+        values = {
+            "experience": [r.experience_level for r in rows],
+            "country": [r.country for r in rows],
+            "city": [r.location for r in rows],
+            "market": [r.market for r in rows],
+        }
+        vocab: Dict[str, Dict[str, int]] = {}
+        counts: Dict[str, np.ndarray] = {}
+        cols: Dict[str, np.ndarray] = {}
+        for field, labels in values.items():
+            codes_by_label: Dict[str, int] = {}
+            codes = np.fromiter(
+                (codes_by_label.setdefault(lbl, len(codes_by_label)) for lbl in labels),
+                dtype=np.int32, count=len(labels),
+            )
+            vocab[field] = codes_by_label
+            counts[field] = np.bincount(codes, minlength=len(codes_by_label)).astype(np.int64)
+            cols[field] = codes
+        salary = np.fromiter((r.salary for r in rows), dtype=np.float64, count=len(rows))
+        return cls(salary=salary, vocab=vocab, counts=counts, **cols)
+
+    @classmethod
+    def empty(cls) -> "SalaryColumns":
+        return cls.from_rows([])
+
+    def __len__(self) -> int:
+        return int(self.salary.shape[0])
+
+    def append(self, row: "SalaryRow") -> None:
+        """Ajoute une nouvelle ligne (position = taille actuelle) et met à jour les effectifs."""
+        n = self._n
+        values = {"salary": row.salary}
+        for field, label in self._categories(row):
+            code = self.vocab[field].get(label)
+            if code is None:
+                # Copie à l'écriture: les lecteurs itèrent le vocabulaire sans verrou
+                code = len(self.vocab[field])
+                self.vocab[field] = {**self.vocab[field], label: code}
+            values[field] = code
+            if code >= self.counts[field].shape[0]:
+                self.counts[field] = np.append(self.counts[field], np.int64(0))
+            self.counts[field][code] += 1
+        for field in self.COLUMNS:
+            buf = self._buffers[field] = _reserve(self._buffers[field], n)
+            buf[n] = values[field]
+        self._n = n + 1
+        for field in self.COLUMNS:
+            setattr(self, field, self._buffers[field][:n + 1])
+
+    def labels(self, field: str) -> List[str]:
+        """Libellés indexés par code."""
+        return list(self.vocab.get(field, {}))
+
+    def distribution(self, field: str, positions: Optional[np.ndarray] = None) -> Dict[str, int]:
+        """Effectifs par libellé, sur tout le jeu (pré-calculé) ou sur `positions` (bincount)."""
+        labels = self.labels(field)
+        if positions is None:
+            counts = self.counts[field]
+        else:
+            counts = np.bincount(getattr(self, field)[positions], minlength=len(labels))
+        return {labels[c]: int(n) for c, n in enumerate(counts.tolist()) if n}
+
+    def codes(self, field: str, labels) -> np.ndarray:
+        """Codes entiers des libellés connus (les libellés absents sont ignorés)."""
+        known = self.vocab.get(field, {})
+        return np.asarray([known[l] for l in labels if l in known], dtype=np.int32)
+
+    def mask(self, field: str, positions: np.ndarray, labels) -> np.ndarray:
+        """Masque booléen des positions dont la colonne `field` appartient à `labels`."""
+        col = getattr(self, field)
+        return np.isin(col[positions], self.codes(field, labels))
+
+class SalarySidecar:
+    """
+    Sidecar colonne persisté dans le snapshot de l'index: un .npy par colonne (ids,
+    salaire, codes titre/ville/expérience/pays/marché) + meta.json (version,
+    vocabulaires, watermark salary_dataset). Les colonnes sont chargées en mmap.
+    Les lignes indexées depuis le dernier compactage sont journalisées dans
+    delta.jsonl, pendant du journal binaire delta.bin du snapshot.
+    """
+    VERSION = 1
+    FIELDS = {"title": "job_title", "city": "location", "experience": "experience_level",
+              "country": "country", "market": "market"}
+    JOURNAL = "delta.jsonl"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _file(self, name: str, base: Optional[str] = None) -> str:
+        return os.path.join(base or self.path, name)
+
+    def write(self, id_map: List[int], rows: List["SalaryRow"], watermark: Optional[Dict[str, int]],
+              skipped: Iterable[int] = ()) -> None:
+        """Écrit le sidecar dans un répertoire temporaire puis le substitue à l'ancien."""
+        tmp, old = self.path + ".tmp", self.path + ".old"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(self._file("id.npy", tmp), np.asarray(id_map, dtype=np.int64))
+        np.save(self._file("salary.npy", tmp), np.fromiter((r.salary for r in rows), dtype=np.float64, count=len(rows)))
+        vocab: Dict[str, List[str]] = {}
+        for field, attr in self.FIELDS.items():
+            codes_by_label: Dict[str, int] = {}
+            codes = np.fromiter(
+                (codes_by_label.setdefault(getattr(r, attr), len(codes_by_label)) for r in rows),
+                dtype=np.int32, count=len(rows),
+            )
+            np.save(self._file(f"{field}.npy", tmp), codes)
+            vocab[field] = list(codes_by_label)
+        meta = {"version": self.VERSION, "rows": len(rows), "watermark": watermark,
+                "skipped": sorted(int(i) for i in skipped), "vocab": vocab, "createdAt": time.time()}
+        with open(self._file("meta.json", tmp), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.isdir(self.path):
+            os.replace(self.path, old)
+        os.replace(tmp, self.path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def load(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        """-> (meta, colonnes mmap). Lève une exception si absent, d'une autre version ou incohérent."""
+        with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != self.VERSION:
+            raise ValueError(f"version sidecar {meta.get('version')} != {self.VERSION}")
+        arrays = {name: np.load(self._file(f"{name}.npy"), mmap_mode="r")
+                  for name in ("id", "salary", *self.FIELDS)}
+        if any(a.shape[0] != meta["rows"] for a in arrays.values()):
+            raise ValueError("colonnes sidecar de longueurs différentes")
+        return meta, arrays
+
+    def append_journal(self, ds_list: List[Dict]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        keys = ("id", "poste", "ville", "pays", "experience", "salaire_moyen", "status")
+        with open(self._file(self.JOURNAL), "a", encoding="utf-8") as f:
+            for ds in ds_list:
+                f.write(json.dumps({k: ds.get(k) for k in keys}, ensure_ascii=False) + "\n")
+
+    def read_journal(self) -> Dict[int, Dict]:
+        out: Dict[int, Dict] = {}
+        if not os.path.exists(self._file(self.JOURNAL)):
+            return out
+        with open(self._file(self.JOURNAL), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    ds = json.loads(line)
+                except ValueError:
+                    continue  # ligne tronquée (crash)
+                out[int(ds["id"])] = ds
+        return out
+
+class CohortStats:
+    """
+    Tables de quantiles par cohorte (famille de poste, pays, expérience), maintenues
+    incrémentalement: chaque cohorte garde ses salaires triés et ses quantiles
+    pré-calculés, la validation d'une saisie est donc une simple lecture.
+    """
+    QUANTILES = (10, 25, 75, 90)
+
+    def __init__(self):
+        self.values: Dict[Tuple[str, str, str], List[float]] = {}
+        self.tables: Dict[Tuple[str, str, str], Dict[str, float]] = {}
+
+    @staticmethod
+    def key(job_title: str, country: str, experience: str) -> Tuple[str, str, str]:
+        return title_family(job_title), country or "Global", experience or ""
+
+    @classmethod
+    def from_rows(cls, rows: List["SalaryRow"]) -> "CohortStats":
+        stats = cls()
+        for r in rows:
+            stats.values.setdefault(cls.key(r.job_title, r.country, r.experience_level), []).append(r.salary)
+        for key, vals in stats.values.items():
+            vals.sort()
+            stats._refresh(key)
+        return stats
+
+    def _refresh(self, key: Tuple[str, str, str]) -> None:
+        vals = self.values[key]
+        qs = np.percentile(np.asarray(vals, dtype="float64"), self.QUANTILES)
+        self.tables[key] = {"count": len(vals), **{f"p{q}": float(v) for q, v in zip(self.QUANTILES, qs)}}
+
+    def add(self, job_title: str, country: str, experience: str, salary: float) -> None:
+        key = self.key(job_title, country, experience)
+        bisect.insort(self.values.setdefault(key, []), float(salary))
+        self._refresh(key)
+
+    def lookup(self, job_title: str, country: str, experience: str, min_count: int = COHORT_MIN_COUNT) -> Optional[Dict[str, float]]:
+        table = self.tables.get(self.key(job_title, country, experience))
+        if table is None or table["count"] < min_count:
+            return None
+        return table
+
+class SalaryPartitions:
+    """
+    Sous-index FAISS par (pays, expérience), clés = codes de SalaryColumns.
+    Chaque sous-index garde les positions globales de ses vecteurs: la restriction
+    se fait avant le calcul de similarité et non par filtrage des résultats.
+    `parts` est remplacé (copie à l'écriture) à chaque ajout: les lecteurs peuvent
+    l'itérer sans prendre `rw.read()` pendant qu'add_vectors écrit.
+    """
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.parts: Dict[Tuple[int, int], Tuple[faiss.Index, np.ndarray]] = {}
+        # Tampons à capacité doublée derrière les vues de positions de `parts`
+        self._pos_buffers: Dict[Tuple[int, int], np.ndarray] = {}
+
+    @classmethod
+    def build(cls, index: faiss.Index, columns: SalaryColumns) -> "SalaryPartitions":
+        parts = cls(index.d)
+        n = index.ntotal
+        if n == 0:
+            return parts
+        X = index.reconstruct_n(0, n)
+        keys = (columns.country.astype(np.int64) << 32) | columns.experience.astype(np.int64)
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        for g, key in enumerate(uniq.tolist()):
+            pos = np.flatnonzero(inverse == g).astype(np.int64)
+            sub = faiss.IndexFlatIP(parts.dim)
+            sub.add(np.ascontiguousarray(X[pos]))
+            parts.parts[(key >> 32, key & 0xFFFFFFFF)] = (sub, pos)
+        return parts
+
+    def add(self, position: int, X: np.ndarray, country_code: int, exp_code: int) -> None:
+        key = (int(country_code), int(exp_code))
+        sub, pos = self.parts.get(key) or (faiss.IndexFlatIP(self.dim), np.empty(0, dtype=np.int64))
+        n = pos.shape[0]
+        buf = self._pos_buffers[key] = _reserve(self._pos_buffers.get(key, pos), n)
+        buf[n] = position
+        sub.add(X)
+        self.parts = {**self.parts, key: (sub, buf[:n + 1])}
+
+    def keys(self, country_codes: Optional[np.ndarray], exp_codes: np.ndarray) -> List[Tuple[int, int]]:
+        return sorted(
+            k for k in self.parts
+            if (country_codes is None or k[0] in country_codes) and k[1] in exp_codes
+        )
+
+    def search(self, Q: np.ndarray, keys: List[Tuple[int, int]], top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k fusionné sur les partitions demandées -> (scores, positions globales)."""
+        cand_s, cand_p = [], []
+        for key in keys:
+            sub, pos = self.parts[key]
+            kk = min(top_k, sub.ntotal)
+            if kk <= 0:
+                continue
+            D, I = sub.search(Q, kk)
+            cand_s.append(D)
+            cand_p.append(pos[I])
+        if not cand_s:
+            return np.empty((Q.shape[0], 0), dtype="float32"), np.empty((Q.shape[0], 0), dtype=np.int64)
+        S, P = np.hstack(cand_s), np.hstack(cand_p)
+        order = np.argsort(-S, axis=1, kind="stable")[:, :top_k]
+        return np.take_along_axis(S, order, axis=1), np.take_along_axis(P, order, axis=1)
+
+    def sizes(self, columns: SalaryColumns) -> Dict[str, int]:
+        country_of = {v: k for k, v in columns.vocab.get("country", {}).items()}
+        exp_of = {v: k for k, v in columns.vocab.get("experience", {}).items()}
+        return {f"{country_of.get(c)} / {exp_of.get(e)}": int(sub.ntotal) for (c, e), (sub, _) in sorted(self.parts.items())}
+
+@dataclass
+class SalaryIndexData:
+    """Métadonnées d'un bundle d'index, alignées sur ses positions FAISS."""
+    rows: List[SalaryRow]
+    columns: SalaryColumns
+    pos_by_id: Dict[int, int]  # salary_dataset.id -> position FAISS
+    cohorts: CohortStats
+    partitions: Optional[SalaryPartitions] = None
+    # Lignes indexables (statut valide, chunk encodé) dont aucun embedding n'est lisible:
+    # absentes de l'index mais comptées par le watermark de salary_dataset
+    skipped: Set[int] = field(default_factory=set)
+
+    @classmethod
+    def from_rows(cls, index: Optional[faiss.Index], rows: List[SalaryRow],
+                  columns: Optional[SalaryColumns] = None, skipped: Optional[Set[int]] = None) -> "SalaryIndexData":
+        columns = columns if columns is not None else SalaryColumns.from_rows(rows)
+        partitions = None
+        if PARTITIONED_SEARCH and index is not None and index.ntotal == len(rows):
+            partitions = SalaryPartitions.build(index, columns)
+        return cls(rows=rows, columns=columns, pos_by_id={r.id: i for i, r in enumerate(rows)},
+                   cohorts=CohortStats.from_rows(rows), partitions=partitions, skipped=set(skipped or ()))
+
 class SupabaseSalaryRAGService:
     def __init__(self):
         self.model = SentenceTransformer(SALARY_EMBED_MODEL)
-        self.index: Optional[faiss.Index] = None
-        self.id_map: List[int] = []
-        self.rows: List[SalaryRow] = []
+        # Bundle (index, id_map, SalaryIndexData) remplacé d'un bloc à chaque rebuild/chargement
+        self.indexes = IndexManager("salary", SNAPSHOT_DIR)
+        self.indexes.publish(None, [], SalaryIndexData.from_rows(None, []))
+        self.load_stats: Dict[str, Any] = {}
+        self.delta_count = 0  # vecteurs présents uniquement dans le journal delta du snapshot
+
+    # Vues sur le bundle courant (ou figé pour la requête en cours, cf. IndexManager.pinned)
+    @property
+    def index(self) -> Optional[faiss.Index]:
+        return self.indexes.current().index
+
+    @property
+    def id_map(self) -> List[int]:
+        return self.indexes.current().id_map
+
+    @property
+    def rows(self) -> List[SalaryRow]:
+        return self.indexes.current().data.rows
+
+    @property
+    def columns(self) -> SalaryColumns:
+        return self.indexes.current().data.columns
+
+    @property
+    def pos_by_id(self) -> Dict[int, int]:
+        return self.indexes.current().data.pos_by_id
+
+    @property
+    def cohorts(self) -> CohortStats:
+        return self.indexes.current().data.cohorts
+
+    @property
+    def partitions(self) -> Optional[SalaryPartitions]:
+        return self.indexes.current().data.partitions
+
+    @staticmethod
+    def _sidecar(snapshot_dir: str) -> SalarySidecar:
+        return SalarySidecar(os.path.join(snapshot_dir, SIDECAR_SUBDIR))
+
+    def _publish(self, index: Optional[faiss.Index], id_map: List[int], data: SalaryIndexData,
+                 build_seconds: float, persist: bool = True) -> None:
+        """Rend courant un nouveau bundle, après écriture de son snapshot (index, map, sidecar) si `persist`."""
+        if persist and index is not None:
+            try:
+                watermark = self._dataset_watermark()
+                self.indexes.publish(index, id_map, data, build_seconds=build_seconds, persist=True,
+                                     meta={"rows": len(data.rows)},
+                                     extra=lambda d: self._sidecar(d).write(id_map, data.rows, watermark, data.skipped))
+                self.delta_count = 0
+                return
+            except Exception as e:
+                print(f"Erreur écriture snapshot FAISS: {str(e)}")
+        self.indexes.publish(index, id_map, data, build_seconds=build_seconds)
+
+    def _ensure_index(self, dim: int) -> None:
+        """Premiers vecteurs de la base: bundle vide à compléter par add_vectors."""
+        with self.indexes.building():
+            if self.indexes.bundle.index is None:
+                self.indexes.publish(faiss.IndexFlatIP(dim), [], SalaryIndexData.from_rows(None, []))
+
+    def _filter_hits(self, scores: np.ndarray, idxs: np.ndarray, experiences, top_k: int,
+                     countries: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+        """Filtre vectorisé des résultats FAISS par expérience et pays (aucun appel réseau)."""
+        valid = (idxs >= 0) & (idxs < len(self.rows))
+        idxs, scores = idxs[valid], scores[valid]
+        keep = self.columns.mask("experience", idxs, experiences)
+        if countries is not None:
+            # Même périmètre que la recherche partitionnée
+            keep &= self.columns.mask("country", idxs, countries)
+        idxs, scores = idxs[keep][:top_k], scores[keep][:top_k]
+        return [(int(i), float(s)) for i, s in zip(idxs.tolist(), scores.tolist())]
 
     # ---------- utils DB ----------
     def has_any_chunk(self) -> bool:
@@ -211,8 +602,8 @@ Estime une fourchette réaliste pour ce marché. Réponds UNIQUEMENT:
 {{"salaire_min": X, "salaire_max": Y}}
 """
             
-            response = call_gemini_api(prompt)
-            result = json.loads(response.strip().removeprefix("```json").removeprefix("```").removesuffix("```"))
+            response = call_gemini_api(prompt, timeout=30)
+            result = _parse_llm_json(response)
             return float(result.get("salaire_min", current_salary * 0.9)), float(result.get("salaire_max", current_salary * 1.1))
             
         except:
@@ -220,49 +611,37 @@ Estime une fourchette réaliste pour ce marché. Réponds UNIQUEMENT:
             return current_salary * 0.9, current_salary * 1.1
 
     # ---------- ingestion améliorée ----------
-    def store_user_entry(
+    def validate_entry(
         self, job_title: str, location: str, experience_years: int, current_salary: float, user_id: int = 1,
-    ) -> tuple[int, str]:
+    ) -> Dict[str, Any]:
+        """Valide une saisie (cohorte, sinon ANN, sinon LLM) et retourne la ligne salary_dataset à insérer."""
         city, country = guess_city_country(location)
         market = get_market_from_country(country)
         exp_label = years_str(experience_years)
 
-        # Recherche de données similaires pour estimation
-        min_guess, max_guess = None, None
-        try:
-            # Priorité: même ville puis même pays puis même marché
-            search_locations = [city, country, market] if city else [country, market]
-            matches = []
-            
-            for search_loc in search_locations:
-                if search_loc and search_loc != "Global":
-                    matches = self.search(job_title, search_loc, experience_years, top_k=100)
-                    if len(matches) >= 10:  # Assez de données
-                        break
-            
-        except Exception:
-            matches = []
+        if self.index is None:
+            self.build_or_load_faiss()
 
-        # Recherche de données similaires AVEC priorité expérience
         min_guess, max_guess, status = None, None, "valide"
-        target_exp = years_str(experience_years)
-        
-        try:
-            # Recherche stricte avec même niveau d'expérience d'abord
-            matches = self.search_with_experience_priority(job_title, location, experience_years, top_k=100)
-            
-        except Exception:
-            matches = []
+        with self.indexes.pinned():
+            quantiles: Optional[Dict[str, float]] = self.cohorts.lookup(job_title, country, exp_label)
+
+            if quantiles is None:
+                # Cohorte inconnue ou trop petite → recherche ANN avec priorité expérience
+                try:
+                    matches = self.search_with_experience_priority(job_title, location, experience_years, top_k=100)
+                except Exception:
+                    matches = []
+                if matches and len(matches) >= 2:  # Assez de données similaires
+                    arr = self.columns.salary[[i for i, _ in matches]]
+                    quantiles = dict(zip(("p10", "p25", "p75", "p90"), np.percentile(arr, CohortStats.QUANTILES).tolist()))
 
-        if matches and len(matches) >= 2:  # Assez de données similaires
-            arr = np.array([self.rows[i].salary for i, _ in matches], dtype="float64")
-            p25, p75 = np.percentile(arr, [25, 75])
-            min_guess = float(p25 * 0.9)
-            max_guess = float(p75 * 1.1)
+        if quantiles is not None:
+            min_guess = float(quantiles["p25"] * 0.9)
+            max_guess = float(quantiles["p75"] * 1.1)
             
             # Validation stricte basée sur les données réelles
-            q10, q90 = np.percentile(arr, [10, 90])
-            if not (q10 * 0.6 <= current_salary <= q90 * 1.4):
+            if not (quantiles["p10"] * 0.6 <= current_salary <= quantiles["p90"] * 1.4):
                 status = "non_valide"
                 
         else:
@@ -275,8 +654,7 @@ Estime une fourchette réaliste pour ce marché. Réponds UNIQUEMENT:
             # La validation se fera plus tard quand on aura plus de données
             status = "valide"
 
-        # Insertion dans salary_dataset
-        row = {
+        return {
             "user_id": user_id,
             "poste": _clean(job_title),
             "ville": city,
@@ -287,115 +665,222 @@ Estime une fourchette réaliste pour ce marché. Réponds UNIQUEMENT:
             "salaire_moyen": float(current_salary),
             "status": status,
         }
-        
-        try:
-            res = supabase.table("salary_dataset").insert(row).execute()
-            if not res.data:
-                raise RuntimeError("Insertion salary_dataset échouée")
-            return int(res.data[0]["id"]), status
-        except Exception as e:
-            raise RuntimeError(f"Erreur insertion salary_dataset: {str(e)}")
 
-    def chunk_row(self, salary_row_id: int) -> None:
-        """Crée un chunk optimisé pour une ligne de salary_dataset"""
-        try:
-            ds = supabase.table("salary_dataset").select("*").eq("id", salary_row_id).single().execute().data
-            if not ds:
-                return
-            
-            # Ne chunk QUE les entrées valides
-            if str(ds.get("status") or "").lower().startswith("non"):
-                return
-            
-            # Vérifier si chunk existe déjà
-            existing = supabase.table("salary_chunks").select("id").eq("salary_row_id", salary_row_id).limit(1).execute().data
-            if existing:
-                return
-            
-            # Contenu enrichi pour le RAG
-            location_str = ds.get("ville") or ds.get("pays") or "Global"
-            market = get_market_from_country(ds.get("pays") or "Global")
-            
-            content = _clean(
-                f"Poste: {ds.get('poste') or ''} | "
-                f"Localisation: {location_str} | "
-                f"Pays: {ds.get('pays') or 'Global'} | "
-                f"Marché: {market} | "
-                f"Experience: {ds.get('experience') or ''} | "
-                f"Salaire: {int(float(ds.get('salaire_moyen') or 0))} MAD/mois | "
-                f"Fourchette: {int(float(ds.get('salaire_min') or 0))}-{int(float(ds.get('salaire_max') or 0))} MAD"
+    # ---------- ingestion incrémentale ----------
+    def ingest_batch(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Ingestion groupée de saisies utilisateur (worker d'ingestion): validation,
+        une insertion salary_dataset, un encodage, une insertion salary_chunks et
+        une mise à jour de l'index pour tout le lot. Retourne, dans l'ordre des
+        entrées, {rowId, entryStatus, indexed}.
+        """
+        if self.index is None:
+            self.build_or_load_faiss()
+
+        rows = [
+            self.validate_entry(
+                job_title=e["jobTitle"], location=e["location"], experience_years=int(e["experienceYears"]),
+                current_salary=float(e["currentSalary"]), user_id=e.get("userId", 1),
             )
-            
-            supabase.table("salary_chunks").insert({
-                "salary_row_id": salary_row_id,
-                "chunk_idx": 0,
-                "content": content,
-                "token_count": len(content.split()),
-            }).execute()
-            
-        except Exception as e:
-            print(f"Erreur chunk_row {salary_row_id}: {str(e)}")
+            for e in entries
+        ]
+        inserted = supabase.table("salary_dataset").insert(rows).execute().data or []
+        if len(inserted) != len(rows):
+            raise RuntimeError("Insertion salary_dataset échouée")
+
+        # Les lignes sont insérées: un échec d'indexation ne doit plus faire rejouer le lot
+        valid = [ds for ds in inserted if not str(ds.get("status") or "").lower().startswith("non")]
+        indexed_ids = set()
+        if valid:
+            try:
+                contents = [_chunk_content(ds) for ds in valid]
+                X = self.model.encode(contents, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+                supabase.table("salary_chunks").insert([
+                    {
+                        "salary_row_id": ds["id"],
+                        "chunk_idx": 0,
+                        "content": content,
+                        "token_count": len(content.split()),
+                        "embedding": vec.tolist(),
+                    }
+                    for ds, content, vec in zip(valid, contents, X)
+                ]).execute()
+
+                self._ensure_index(X.shape[1])
+                self.add_vectors(valid, X)
+                indexed_ids = {int(ds["id"]) for ds in valid}
+            except Exception as e:
+                print(f"Erreur indexation lot ({len(valid)} lignes): {str(e)}")
+
+        return [
+            {"rowId": int(ds["id"]), "entryStatus": ds.get("status"), "indexed": int(ds["id"]) in indexed_ids}
+            for ds in inserted
+        ]
+
+    def add_vectors(self, ds_list: List[Dict], X: np.ndarray, persist: bool = True) -> int:
+        """
+        Ajoute un lot de vecteurs (un seul index.add) + métadonnées au bundle courant,
+        en place et sous `rw.write()` (cf. IndexBundle); ids déjà indexés ignorés.
+        Les recherches concurrentes (sous `rw.read()`) attendent la fin de l'ajout;
+        les positions qu'elles ont déjà obtenues restent valides.
+        """
+        with self.indexes.building():
+            bundle = self.indexes.bundle
+            data: SalaryIndexData = bundle.data
+            keep, seen = [], set()
+            for i, ds in enumerate(ds_list):
+                rid = int(ds["id"])
+                if rid in data.pos_by_id or rid in seen:
+                    continue
+                keep.append(i)
+                seen.add(rid)
+            if not keep:
+                return 0
+
+            X = np.asarray(X, dtype="float32")[keep].copy()
+            faiss.normalize_L2(X)
+            kept = [ds_list[i] for i in keep]
+
+            with self.indexes.rw.write():
+                bundle.index.add(X)
+                for j, ds in enumerate(kept):
+                    row = _row_from_dataset(ds)
+                    bundle.id_map.append(row.id)
+                    data.rows.append(row)
+                    data.columns.append(row)
+                    pos = len(data.rows) - 1
+                    data.pos_by_id[row.id] = pos
+                    data.cohorts.add(row.job_title, row.country, row.experience_level, row.salary)
+                    if data.partitions is not None:
+                        data.partitions.add(pos, X[j:j + 1], data.columns.country[pos], data.columns.experience[pos])
+                if data.partitions is None and PARTITIONED_SEARCH and bundle.index.ntotal == len(data.rows):
+                    data.partitions = SalaryPartitions.build(bundle.index, data.columns)
+
+            if persist:
+                self._append_delta(kept, X)
+            return len(kept)
+
+    def _append_delta(self, ds_list: List[Dict], X: np.ndarray) -> None:
+        path = self.indexes.snapshot_path
+        if path is None:
+            # Aucun snapshot encore: le premier compactage en crée un
+            self.compact()
+            return
+        # Métadonnées d'abord: un vecteur sans ligne journalisée est réhydraté depuis Supabase
+        self._sidecar(path).append_journal(ds_list)
+        append_delta(path, [int(ds["id"]) for ds in ds_list], X)
+        self.delta_count += len(ds_list)
+        if self.delta_count >= DELTA_COMPACT_EVERY:
+            self.compact()
+
+    @staticmethod
+    def _replay_delta(index: faiss.Index, id_map: List[int], snapshot_dir: str) -> int:
+        """Rejoue le journal delta du snapshot sur l'index chargé (ids déjà présents ignorés)."""
+        ids, vecs = read_delta(snapshot_dir, index.d)
+        known = set(id_map)
+        keep = np.zeros(ids.shape[0], dtype=bool)
+        for k, rid in enumerate(ids.tolist()):
+            if rid not in known:
+                keep[k] = True
+                known.add(rid)
+        if keep.any():
+            index.add(np.ascontiguousarray(vecs[keep]))
+            id_map.extend(int(x) for x in ids[keep])
+        return int(ids.shape[0])
+
+    def compact(self) -> bool:
+        """Écrit un nouveau snapshot (index, map, sidecar) de l'état courant; le journal delta repart à vide."""
+        with self.indexes.building():
+            bundle = self.indexes.bundle
+            if bundle.index is None:
+                return False
+            try:
+                watermark = self._dataset_watermark()
+                self.indexes.snapshot(
+                    meta={"rows": len(bundle.data.rows)},
+                    extra=lambda d: self._sidecar(d).write(bundle.id_map, bundle.data.rows, watermark,
+                                                          bundle.data.skipped),
+                )
+                self.delta_count = 0
+                return True
+            except Exception as e:
+                print(f"Erreur compactage FAISS: {str(e)}")
+                return False
 
     # ---------- backfill amélioré ----------
-    def backfill_chunks_from_salary_dataset(self, only_status: Optional[str] = "valide") -> dict:
+    def backfill_chunks_from_salary_dataset(self, only_status: Optional[str] = "valide",
+                                            page_size: int = 1000, insert_batch: int = 500) -> dict:
+        """
+        Backfill ensembliste: un scan paginé des lignes, un scan paginé des chunks
+        existants, différence en mémoire puis insertions par lots.
+        """
+        timings: Dict[str, float] = {}
         try:
-            q = supabase.table("salary_dataset").select("id, poste, ville, pays, experience, salaire_min, salaire_max, salaire_moyen, status")
-            if only_status:
-                q = q.ilike("status", f"{only_status}%")
-            rows = q.order("id").execute().data or []
-            
-            created = 0
+            t0 = time.perf_counter()
+            where = (lambda q: q.ilike("status", f"{only_status}%")) if only_status else None
+            rows = list(iter_rows(
+                supabase, "salary_dataset",
+                "id, poste, ville, pays, experience, salaire_min, salaire_max, salaire_moyen, status",
+                page_size=page_size, where=where,
+            ))
+            timings["scanDataset"] = time.perf_counter() - t0
+
+            t1 = time.perf_counter()
+            chunked = {
+                int(c["salary_row_id"])
+                for c in iter_rows(supabase, "salary_chunks", "id, salary_row_id", page_size=page_size)
+                if c.get("salary_row_id") is not None
+            }
+            timings["scanChunks"] = time.perf_counter() - t1
+
+            t2 = time.perf_counter()
+            payloads = []
             for ds in rows:
                 if str(ds.get("status") or "").lower().startswith("non"):
                     continue
-                    
-                # Vérifier si chunk existe
-                exists = supabase.table("salary_chunks").select("id").eq("salary_row_id", ds["id"]).limit(1).execute().data
-                if exists:
+                if int(ds["id"]) in chunked:
                     continue
-                
-                # Créer chunk enrichi
-                location_str = ds.get("ville") or ds.get("pays") or "Global"
-                market = get_market_from_country(ds.get("pays") or "Global")
-                
-                content = _clean(
-                    f"Poste: {ds.get('poste') or ''} | "
-                    f"Localisation: {location_str} | "
-                    f"Pays: {ds.get('pays') or 'Global'} | "
-                    f"Marché: {market} | "
-                    f"Experience: {ds.get('experience') or ''} | "
-                    f"Salaire: {int(float(ds.get('salaire_moyen') or 0))} MAD/mois | "
-                    f"Fourchette: {int(float(ds.get('salaire_min') or 0))}-{int(float(ds.get('salaire_max') or 0))} MAD"
-                )
-                
-                supabase.table("salary_chunks").insert({
+                content = _chunk_content(ds)
+                payloads.append({
                     "salary_row_id": ds["id"],
                     "chunk_idx": 0,
                     "content": content,
                     "token_count": len(content.split()),
-                }).execute()
-                created += 1
-                
-            return {"created": created, "scanned": len(rows)}
+                })
+            timings["build"] = time.perf_counter() - t2
+
+            t3 = time.perf_counter()
+            for start in range(0, len(payloads), insert_batch):
+                supabase.table("salary_chunks").insert(payloads[start:start + insert_batch]).execute()
+            timings["insert"] = time.perf_counter() - t3
+            timings["total"] = time.perf_counter() - t0
+
+            return {
+                "created": len(payloads),
+                "scanned": len(rows),
+                "alreadyChunked": len(chunked),
+                "timings": {k: round(v, 3) for k, v in timings.items()},
+            }
             
         except Exception as e:
-            return {"created": 0, "scanned": 0, "error": str(e)}
+            return {"created": 0, "scanned": 0, "error": str(e), "timings": {k: round(v, 3) for k, v in timings.items()}}
 
     # ---------- embeddings ----------
     def embed_new_chunks(self, batch_size: int = 64) -> int:
         try:
-            rows = supabase.table("salary_chunks").select("id, content").is_("embedding", "null").order("id").execute().data or []
             total = 0
-            
-            for i in range(0, len(rows), batch_size):
-                batch = rows[i:i+batch_size]
-                texts = [r["content"] for r in batch]
-                embs = self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
-                
-                for r, v in zip(batch, embs):
-                    supabase.table("salary_chunks").update({"embedding": v.tolist()}).eq("id", r["id"]).execute()
-                total += len(batch)
-                
+            pages = iter_pages(supabase, "salary_chunks", "id, content",
+                               where=lambda q: q.is_("embedding", "null"))
+            for rows in pages:
+                for i in range(0, len(rows), batch_size):
+                    batch = rows[i:i+batch_size]
+                    texts = [r["content"] for r in batch]
+                    embs = self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+
+                    for r, v in zip(batch, embs):
+                        supabase.table("salary_chunks").update({"embedding": v.tolist()}).eq("id", r["id"]).execute()
+                    total += len(batch)
+
             return total
         except Exception as e:
             print(f"Erreur embed_new_chunks: {str(e)}")
@@ -403,139 +888,306 @@ Estime une fourchette réaliste pour ce marché. Réponds UNIQUEMENT:
 
     # ---------- FAISS amélioré ----------
     def build_or_load_faiss(self) -> bool:
-        # Tentative de chargement depuis fichiers
-        try:
-            if os.path.exists(INDEX_PATH) and os.path.exists(MAP_PATH):
-                self.index = faiss.read_index(INDEX_PATH)
-                with open(MAP_PATH, "r", encoding="utf-8") as f:
-                    self.id_map = [int(x) for x in json.load(f)]
-                self._rebuild_rows_from_id_map()
+        """
+        Charge le snapshot courant (ou reconstruit depuis la DB) dans des variables
+        locales, puis publie le bundle d'un bloc: les requêtes en cours continuent
+        sur l'ancien bundle pendant toute la construction.
+        """
+        with self.indexes.building():
+            # Tentative de chargement depuis le snapshot courant
+            t0 = time.perf_counter()
+            try:
+                # Ancien index plat (sans sidecar): lignes réhydratées ci-dessous puis watermark vérifié
+                self.indexes.import_legacy(LEGACY_INDEX_PATH, LEGACY_MAP_PATH, ids_from=_legacy_salary_ids)
+                loaded = self.indexes.load()
+                if loaded is not None:
+                    index, id_map, _, path = loaded
+                    id_map = [int(x) for x in id_map]
+                    n_delta = self._replay_delta(index, id_map, path)
+                    data, rebuilt = self._load_rows_from_sidecar(index, id_map, path), None
+                    if data is not None:
+                        self.indexes.publish(index, id_map, data, build_seconds=time.perf_counter() - t0,
+                                             version=os.path.basename(path))
+                        self.delta_count = n_delta
+                    else:
+                        # Sidecar absent ou désaligné: lignes réhydratées depuis l'id_map, nouveau snapshot
+                        rebuilt = self._rebuild_rows_from_id_map(index, id_map)
+                        if rebuilt is not None:
+                            self._publish(index, rebuilt[0], rebuilt[1], time.perf_counter() - t0)
+                    if data is not None or rebuilt is not None:
+                        # Lignes ajoutées depuis le snapshot: rattrapage incrémental; un écart
+                        # persistant (suppressions, statuts) impose la reconstruction complète
+                        check = self._resync_with_dataset() if SIDECAR_VERIFY else "skipped"
+                        self.load_stats["watermark"] = check
+                        if check != "stale":
+                            return True
+            except Exception:
+                pass
+
+            # Construction depuis la DB
+            t0 = time.perf_counter()
+            try:
+                # Lecture paginée des chunks; chaque page est hydratée puis libérée
+                dim = self.model.get_sentence_embedding_dimension()
+                mats, id_map, rows = [], [], []
+                # Un vecteur par ligne salary_dataset (premier chunk lisible), comme add_vectors
+                indexed: Set[int] = set()
+                unreadable: Set[int] = set()
+                batches = 0
+                pages = iter_pages(supabase, "salary_chunks", "id,salary_row_id,content,embedding",
+                                   where=lambda q: q.not_.is_("embedding", "null"))
+                for chunks in pages:
+                    row_ids = sorted({int(c["salary_row_id"]) for c in chunks if c.get("salary_row_id") is not None})
+                    ds_by_id, n = self._fetch_dataset_rows(row_ids)
+                    batches += 1 + n
+
+                    # Décodage de la page en une matrice, dimensions validées au passage
+                    X_page, valid = decode_embeddings([ch.get("embedding") for ch in chunks], dim=dim)
+                    keep = np.zeros(len(chunks), dtype=bool)
+
+                    # Construction des métadonnées
+                    for i, ch in enumerate(chunks):
+                        if ch.get("salary_row_id") is None:
+                            continue
+                        ds = ds_by_id.get(int(ch["salary_row_id"]))
+                        if not ds:
+                            continue
+                        if (str(ds.get("status") or "")).lower().startswith("non"):
+                            continue
+                        if not valid[i]:
+                            unreadable.add(int(ds["id"]))
+                            continue
+                        if int(ds["id"]) in indexed:
+                            continue
+
+                        keep[i] = True
+                        indexed.add(int(ds["id"]))
+                        id_map.append(int(ds["id"]))
+                        rows.append(_row_from_dataset(ds, raw={"chunk_id": ch["id"], "content": ch.get("content", "")}))
+                    mats.append(X_page[keep[valid]])
+
+                if not rows:
+                    self.indexes.publish(None, [], SalaryIndexData.from_rows(None, []))
+                    return False
+
+                # Construction FAISS (une matrice par page)
+                X = np.vstack(mats).astype("float32")
+                faiss.normalize_L2(X)
+                index = faiss.IndexFlatIP(X.shape[1])
+                index.add(X)
+
+                data = SalaryIndexData.from_rows(index, rows, skipped=unreadable - indexed)
+                seconds = time.perf_counter() - t0
+                self._record_load_stats("supabase", len(rows), seconds, batches=batches)
+                if data.skipped:
+                    print(f"{len(data.skipped)} ligne(s) sans embedding lisible, hors index")
+
+                # Snapshot puis bascule (l'index reconstruit contient déjà tout le journal delta)
+                self._publish(index, id_map, data, seconds)
                 return True
-        except Exception:
-            pass
 
-        # Construction depuis la DB
-        try:
-            chunks = (
-                supabase.table("salary_chunks")
-                .select("id,salary_row_id,content,embedding")
-                .not_.is_("embedding", "null")
-                .order("id")
-                .execute()
-                .data or []
-            )
-            
-            if not chunks:
-                self.index, self.id_map, self.rows = None, [], []
+            except Exception as e:
+                # Le bundle en service (s'il existe) reste en place
+                print(f"Erreur build_or_load_faiss: {str(e)}")
                 return False
 
-            # Récupération des données salary_dataset
-            row_ids = sorted({int(c["salary_row_id"]) for c in chunks if c.get("salary_row_id") is not None})
-            ds_rows = (
+    def _fetch_dataset_rows(self, ids: List[int]) -> Tuple[Dict[int, Dict], int]:
+        """Lignes salary_dataset par lots in_() de HYDRATE_BATCH_SIZE ids -> ({id: ligne}, nb requêtes)."""
+        ds_by_id: Dict[int, Dict] = {}
+        batches = 0
+        for start in range(0, len(ids), HYDRATE_BATCH_SIZE):
+            data = (
                 supabase.table("salary_dataset")
                 .select("id,poste,ville,pays,experience,salaire_moyen,status")
-                .in_("id", row_ids)
+                .in_("id", ids[start:start + HYDRATE_BATCH_SIZE])
                 .execute()
                 .data or []
             )
-            ds_by_id = {int(r["id"]): r for r in ds_rows}
+            batches += 1
+            for ds in data:
+                ds_by_id[int(ds["id"])] = ds
+        return ds_by_id, batches
 
-            # Construction des vecteurs et métadonnées
-            mats, id_map, rows = [], [], []
-            for ch in chunks:
-                ds = ds_by_id.get(int(ch["salary_row_id"]))
-                if not ds:
-                    continue
-                if (str(ds.get("status") or "")).lower().startswith("non"):
-                    continue
-                    
-                emb_vec = _as_float32_vector(ch.get("embedding"))
-                if emb_vec is None:
-                    continue
-                    
-                mats.append(emb_vec)
-                id_map.append(int(ds["id"]))
-                
-                location_str = ds.get("ville") or ds.get("pays") or "Global"
-                country = ds.get("pays") or "Global"
-                market = get_market_from_country(country)
-                
-                rows.append(SalaryRow(
-                    id=int(ds["id"]),
-                    job_title=_clean(ds.get("poste") or ""),
-                    location=_clean(location_str),
-                    experience_level=_level_from_years(None),
-                    salary=float(ds.get("salaire_moyen") or 0.0),
-                    currency="MAD",
-                    country=country,
-                    market=market,
-                    raw={"chunk_id": ch["id"], "content": ch.get("content", "")}
-                ))
-
-            if not mats:
-                self.index, self.id_map, self.rows = None, [], []
-                return False
+    @staticmethod
+    def _indexable(q):
+        """
+        Filtre des lignes salary_dataset présentes dans l'index (cf. build_or_load_faiss):
+        non rejetées et dotées d'un chunk encodé. La projection doit embarquer
+        `salary_chunks!inner(...)`.
+        """
+        return q.or_("status.is.null,status.not.ilike.non*").not_.is_("salary_chunks.embedding", "null")
 
-            # Construction FAISS
-            X = np.vstack(mats).astype("float32")
-            faiss.normalize_L2(X)
-            index = faiss.IndexFlatIP(X.shape[1])
-            index.add(X)
-
-            self.index = index
-            self.id_map = id_map
-            self.rows = rows
-
-            # Sauvegarde
-            faiss.write_index(index, INDEX_PATH)
-            with open(MAP_PATH, "w", encoding="utf-8") as f:
-                json.dump([int(x) for x in id_map], f)
-            return True
-            
+    def _dataset_watermark(self) -> Optional[Dict[str, int]]:
+        """
+        Watermark (id max, nombre de lignes) des lignes indexables de salary_dataset,
+        en une requête; None si indisponible. Comparable à _index_watermark().
+        """
+        try:
+            res = (
+                self._indexable(supabase.table("salary_dataset").select("id, salary_chunks!inner(id)", count="exact"))
+                .order("id", desc=True)
+                .limit(1)
+                .execute()
+            )
+            data = res.data or []
+            return {"maxId": int(data[0]["id"]) if data else 0, "count": int(res.count or 0)}
         except Exception as e:
-            print(f"Erreur build_or_load_faiss: {str(e)}")
-            self.index, self.id_map, self.rows = None, [], []
-            return False
+            print(f"Avertissement watermark salary_dataset: {str(e)}")
+            return None
 
-    def _rebuild_rows_from_id_map(self):
-        """Reconstruit les métadonnées depuis l'id_map"""
-        if not self.id_map:
-            self.rows = []
-            return
-            
-        rows: List[SalaryRow] = []
+    def _load_rows_from_sidecar(self, index: faiss.Index, id_map: List[int],
+                                snapshot_dir: str) -> Optional[SalaryIndexData]:
+        """
+        Reconstruit rows/colonnes depuis le sidecar mmap du snapshot (sans réseau),
+        complétés par les lignes du journal pour les vecteurs rejoués depuis le delta.
+        Retourne None si le sidecar est absent ou désaligné; la fraîcheur vis-à-vis
+        de salary_dataset est vérifiée ensuite par _resync_with_dataset.
+        """
+        t0 = time.perf_counter()
+        sidecar = self._sidecar(snapshot_dir)
         try:
-            for rid in self.id_map:
-                ds = supabase.table("salary_dataset").select("*").eq("id", rid).single().execute().data
-                if not ds:
-                    continue
-                if (ds.get("status") or "").lower().startswith("non"):
-                    continue
-                    
-                location_str = ds.get("ville") or ds.get("pays") or "Global"
-                country = ds.get("pays") or "Global"
-                market = get_market_from_country(country)
-                # Récupérer l'expérience réelle depuis la DB
-                experience_from_db = ds.get("experience") or "3-5 ans"
-                
-                rows.append(SalaryRow(
-                    id=int(ds["id"]),
-                    job_title=_clean(ds.get("poste") or ""),
-                    location=_clean(location_str),
-                    experience_level=experience_from_db,  # Utiliser la vraie expérience
-                    salary=float(ds.get("salaire_moyen") or 0.0),
-                    currency="MAD",
-                    country=country,
-                    market=market,
-                    raw={}
-                ))
+            meta, arr = sidecar.load()
+        except Exception:
+            return None
+
+        n = int(meta["rows"])
+        if n > len(id_map) or not np.array_equal(arr["id"], np.asarray(id_map[:n], dtype=np.int64)):
+            return None
+        journal = sidecar.read_journal()
+        tail = id_map[n:]
+        if any(rid not in journal for rid in tail):
+            return None
+
+        vocab = meta["vocab"]
+        labels = {field: vocab[field] for field in SalarySidecar.FIELDS}
+        columns = SalaryColumns(
+            salary=arr["salary"],
+            experience=arr["experience"], country=arr["country"], city=arr["city"], market=arr["market"],
+            vocab={f: {lbl: i for i, lbl in enumerate(labels[f])} for f in ("experience", "country", "city", "market")},
+            counts={f: np.bincount(arr[f], minlength=len(labels[f])).astype(np.int64)
+                    for f in ("experience", "country", "city", "market")},
+        )
+        rows = [
+            SalaryRow(id=rid, job_title=labels["title"][t], location=labels["city"][c],
+                      experience_level=labels["experience"][e], salary=sal, currency="MAD",
+                      country=labels["country"][co], market=labels["market"][m], raw={})
+            for rid, sal, t, c, e, co, m in zip(
+                arr["id"].tolist(), arr["salary"].tolist(), arr["title"].tolist(), arr["city"].tolist(),
+                arr["experience"].tolist(), arr["country"].tolist(), arr["market"].tolist(),
+            )
+        ]
+        for rid in tail:
+            row = _row_from_dataset(journal[rid])
+            rows.append(row)
+            columns.append(row)
+
+        data = SalaryIndexData.from_rows(index, rows, columns, skipped=meta.get("skipped") or ())
+        self._record_load_stats("sidecar", len(rows), time.perf_counter() - t0, batches=0, journaled=len(tail))
+        return data
+
+    def _index_watermark(self) -> Dict[str, int]:
+        """Watermark des lignes connues de l'index: indexées (ids distincts) + illisibles."""
+        bundle = self.indexes.bundle
+        ids = set(bundle.id_map) | (bundle.data.skipped if bundle.data is not None else set())
+        return {"maxId": max(ids, default=0), "count": len(ids)}
+
+    def _resync_with_dataset(self) -> str:
+        """
+        Compare le watermark des lignes indexables à l'index servi. Si des lignes ont été
+        ajoutées depuis le snapshot, seules celles d'id > max(id_map) sont lues (pagination
+        keyset) et ajoutées via add_vectors. -> "fresh" | "caught-up" | "unavailable" |
+        "stale" (écart persistant: suppressions ou changements de statut, rebuild nécessaire).
+        """
+        current = self._dataset_watermark()
+        if current is None:
+            return "unavailable"  # Supabase injoignable: on sert le snapshot tel quel
+        expected = self._index_watermark()
+        if current == expected:
+            return "fresh"
+        added = self._index_rows_since(expected["maxId"]) if current["maxId"] > expected["maxId"] else 0
+        current = self._dataset_watermark()
+        if current is not None and current == self._index_watermark():
+            print(f"Snapshot rattrapé: {added} ligne(s) ajoutée(s) depuis salary_dataset")
+            return "caught-up"
+        print(f"Snapshot périmé (index {self._index_watermark()}, base {current}): reconstruction")
+        return "stale"
+
+    def _index_rows_since(self, since_id: int) -> int:
+        """Indexe les lignes indexables d'id > since_id (embeddings déjà en base), page par page."""
+        dim = self.model.get_sentence_embedding_dimension()
+        added = 0
+        pages = iter_pages(
+            supabase, "salary_dataset",
+            "id,poste,ville,pays,experience,salaire_moyen,status,salary_chunks!inner(embedding)",
+            where=lambda q: self._indexable(q).gt("id", since_id),
+        )
+        for page in pages:
+            # Tous les chunks de la page décodés d'un coup; premier chunk lisible par ligne (cf. build)
+            owners = [j for j, r in enumerate(page) for _ in (r.get("salary_chunks") or [])]
+            X, valid = decode_embeddings(
+                [(ch or {}).get("embedding") for r in page for ch in (r.get("salary_chunks") or [])], dim=dim,
+            )
+            first: Dict[int, int] = {}
+            for owner, pos in zip(np.asarray(owners)[valid], range(X.shape[0])):
+                first.setdefault(int(owner), pos)
+            picked = sorted(first)
+            if picked:
+                added += self.add_vectors([page[j] for j in picked], X[[first[j] for j in picked]])
+            unreadable = {int(r["id"]) for j, r in enumerate(page) if j not in first}
+            if unreadable:
+                with self.indexes.building():
+                    self.indexes.bundle.data.skipped.update(unreadable)
+        return added
+
+    def _rebuild_rows_from_id_map(self, index: faiss.Index,
+                                  loaded_ids: List[int]) -> Optional[Tuple[List[int], SalaryIndexData]]:
+        """
+        Reconstruit les métadonnées depuis l'id_map par lots in_() (une requête
+        par HYDRATE_BATCH_SIZE ids). Les positions dont la ligne a disparu ou est
+        devenue non valide sont retirées de l'index pour garder rows/id_map/index alignés.
+        Retourne (id_map, données) ou None si Supabase est indisponible.
+        """
+        if not loaded_ids:
+            return [], SalaryIndexData.from_rows(index, [])
+
+        t0 = time.perf_counter()
+        try:
+            ds_by_id, batches = self._fetch_dataset_rows(loaded_ids)
         except Exception as e:
             print(f"Erreur _rebuild_rows_from_id_map: {str(e)}")
-            
-        self.rows = rows
+            return None
+
+        rows: List[SalaryRow] = []
+        id_map: List[int] = []
+        dropped: List[int] = []
+        for pos, rid in enumerate(loaded_ids):
+            ds = ds_by_id.get(rid)
+            if not ds or (ds.get("status") or "").lower().startswith("non"):
+                dropped.append(pos)
+                continue
+            rows.append(_row_from_dataset(ds))
+            id_map.append(rid)
+
+        if dropped:
+            index.remove_ids(np.asarray(dropped, dtype="int64"))
+
+        self._record_load_stats("disk", len(rows), time.perf_counter() - t0, batches=batches, dropped=len(dropped))
+        return id_map, SalaryIndexData.from_rows(index, rows)
+
+    def _record_load_stats(self, source: str, n_rows: int, seconds: float, **extra) -> None:
+        self.load_stats = {
+            "source": source,
+            "rows": n_rows,
+            "seconds": round(seconds, 3),
+            "rowsPerSec": round(n_rows / seconds, 1) if seconds > 0 else None,
+            **extra,
+        }
 
     def ensure_faiss_ready(self) -> None:
         """S'assure que FAISS est prêt avec les dernières données"""
+        if self.index is not None and self.rows:
+            # Index en mémoire tenu à jour par ingest_batch()
+            return
         self.seed_if_needed()
         self.embed_new_chunks()
         ok = self.build_or_load_faiss()
@@ -543,142 +1195,231 @@ Estime une fourchette réaliste pour ce marché. Réponds UNIQUEMENT:
             self.build_or_load_faiss()
 
     # ---------- recherche améliorée avec filtrage expérience ----------
-    def search(self, job_title: str, location: str, experience_years: int, top_k: int = 200) -> List[Tuple[int, float]]:
-        if (self.index is None) or (not self.rows):
-            ok = self.build_or_load_faiss()
-            if not ok:
-                return []
-                
-        q_level = _level_from_years(experience_years)
+    def _search_text(self, job_title: str, location: str, experience_years: int) -> str:
         city, country = guess_city_country(location)
         market = get_market_from_country(country)
-        
-        # Requête enrichie avec contexte du marché
         location_context = city or country or location
-        q_text = f"{_clean(job_title)} | {_clean(location_context)} | {country} | {market} | {q_level}"
-        
-        q_emb = self.model.encode([q_text], convert_to_numpy=True, normalize_embeddings=True).astype("float32")
-        scores, idxs = self.index.search(q_emb, top_k * 3)  # Chercher plus pour filtrer
-        
-        # Filtrage par expérience compatible
-        experience_ranges = {
-            "0-2 ans": ["0-2 ans"],
-            "3-5 ans": ["0-2 ans", "3-5 ans", "2-5 ans"],
-            "5-10 ans": ["3-5 ans", "5-10 ans", "5+ ans"],
-            "10+ ans": ["5-10 ans", "10+ ans", "5+ ans", "8+ ans"]
-        }
-        
-        target_exp = years_str(experience_years)
-        compatible_exp = experience_ranges.get(target_exp, [target_exp])
-        
-        filtered_results = []
-        for i, s in zip(idxs[0].tolist(), scores[0].tolist()):
-            if 0 <= i < len(self.rows):
-                # Récupérer l'expérience réelle depuis la DB
-                row_id = self.id_map[i]
-                try:
-                    ds = supabase.table("salary_dataset").select("experience").eq("id", row_id).single().execute().data
-                    if ds and ds.get("experience") in compatible_exp:
-                        filtered_results.append((int(i), float(s)))
-                        if len(filtered_results) >= top_k:
-                            break
-                except:
-                    # Si erreur DB, inclure quand même
-                    filtered_results.append((int(i), float(s)))
-                    
-        return filtered_results[:top_k]
+        return f"{_clean(job_title)} | {_clean(location_context)} | {country} | {market} | {_level_from_years(experience_years)}"
 
-    def search_with_experience_priority(self, job_title: str, location: str, experience_years: int, top_k: int = 200) -> List[Tuple[int, float]]:
-        """Recherche avec priorité stricte sur l'expérience"""
+    def _criteria_text(self, job_title: str, location: str, experience: str) -> str:
         city, country = guess_city_country(location)
+        market = get_market_from_country(country)
+        location_context = city or country or location
+        return f"{_clean(job_title)} | {_clean(location_context)} | {country} | {market} | {experience}"
+
+    def _country_scope(self, location: str) -> Optional[List[str]]:
+        """Partitions pays couvertes par une localisation (None = toutes)."""
+        _, country = guess_city_country(location)
+        return None if country == "Global" else [country]
+
+    def _market_scope(self, market: str) -> Optional[List[str]]:
+        """Pays indexés appartenant à un marché (None = toutes les partitions)."""
+        if market == "Marché Global":
+            return None
+        return [c for c in self.columns.vocab.get("country", {}) if get_market_from_country(c) == market]
+
+    def _search_query(self, key: str, job_title: str, location: str, experience_years: int, top_k: int,
+                      countries: Optional[List[str]] = None) -> RetrievalQuery:
+        """Équivalent planifiable de search(): sur-échantillonne x3 puis filtre large."""
         target_exp = years_str(experience_years)
-        
-        # 1. Recherche exacte: même expérience + localisation
-        exact_matches = self._search_by_criteria(job_title, location, target_exp, top_k)
-        
-        if len(exact_matches) >= 10:
-            return exact_matches
-            
-        # 2. Élargir l'expérience mais garder la localisation
-        experience_ranges = {
-            "0-2 ans": ["0-2 ans", "2-5 ans"],
-            "3-5 ans": ["0-2 ans", "3-5 ans", "2-5 ans", "3-6 ans"],
-            "5-10 ans": ["3-5 ans", "5-10 ans", "5+ ans", "3-6 ans"],
-            "10+ ans": ["5-10 ans", "10+ ans", "5+ ans", "8+ ans"]
-        }
-        
-        compatible_exp = experience_ranges.get(target_exp, [target_exp])
-        broader_matches = []
-        
+        return RetrievalQuery(
+            key=key,
+            text=self._search_text(job_title, location, experience_years),
+            experiences=SEARCH_COMPATIBLE_EXPERIENCE.get(target_exp, [target_exp]),
+            k=top_k * 3,
+            top_k=top_k,
+            countries=countries,
+        )
+
+    def _priority_queries(self, key: str, job_title: str, location: str, experience_years: int, top_k: int,
+                          countries: Optional[List[str]] = None) -> List[RetrievalQuery]:
+        """Requêtes de search_with_experience_priority(): expérience exacte + expériences voisines."""
+        target_exp = years_str(experience_years)
+        queries = [RetrievalQuery(f"{key}:exact", self._criteria_text(job_title, location, target_exp),
+                                  [target_exp], top_k * 2, top_k, countries)]
+        compatible_exp = PRIORITY_COMPATIBLE_EXPERIENCE.get(target_exp, [target_exp])
+        per_exp = top_k // len(compatible_exp) + 10
         for exp in compatible_exp:
-            matches = self._search_by_criteria(job_title, location, exp, top_k // len(compatible_exp) + 10)
-            broader_matches.extend(matches)
-            
-        # Supprimer doublons et trier par score
-        unique_matches = {}
-        for idx, score in broader_matches:
-            if idx not in unique_matches or score > unique_matches[idx]:
-                unique_matches[idx] = score
-                
+            queries.append(RetrievalQuery(f"{key}:{exp}", self._criteria_text(job_title, location, exp),
+                                          [exp], per_exp * 2, per_exp, countries))
+        return queries
+
+    def _merge_priority(self, key: str, results: Dict[str, List[Tuple[int, float]]], top_k: int) -> List[Tuple[int, float]]:
+        """Cascade expérience: l'exact suffit s'il a >= 10 résultats, sinon union des voisines."""
+        exact = results.get(f"{key}:exact", [])
+        if len(exact) >= 10:
+            return exact
+        unique_matches: Dict[int, float] = {}
+        for qkey, hits in results.items():
+            if not qkey.startswith(f"{key}:") or qkey == f"{key}:exact":
+                continue
+            for idx, score in hits:
+                if idx not in unique_matches or score > unique_matches[idx]:
+                    unique_matches[idx] = score
         return sorted(unique_matches.items(), key=lambda x: x[1], reverse=True)[:top_k]
 
+    def run_queries(self, queries: List[RetrievalQuery]) -> Dict[str, List[Tuple[int, float]]]:
+        """
+        Exécute un plan de requêtes en un seul model.encode (textes dédupliqués)
+        et un seul index.search avec nq > 1, puis filtre chaque ligne en mémoire.
+        Les positions retournées se rapportent au bundle figé par `indexes.pinned()`.
+        Une requête avec `countries` ne renvoie que des lignes de ces pays, que la
+        recherche soit partitionnée (sous-index) ou non (masque après l'index global).
+        """
+        with self.indexes.pinned():
+            if (self.index is None) or (not self.rows) or not queries:
+                return {q.key: [] for q in queries}
+
+            texts = list(dict.fromkeys(q.text for q in queries))
+            row_of = {t: n for n, t in enumerate(texts)}
+            Q = self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+            out: Dict[str, List[Tuple[int, float]]] = {}
+
+            if self.partitions is not None:
+                # Regrouper les requêtes qui visent le même ensemble de partitions (nq > 1 par groupe)
+                groups: Dict[Tuple[Tuple[int, int], ...], List[RetrievalQuery]] = {}
+                for q in queries:
+                    country_codes = None if q.countries is None else self.columns.codes("country", q.countries)
+                    keys = self.partitions.keys(country_codes, self.columns.codes("experience", q.experiences))
+                    groups.setdefault(tuple(keys), []).append(q)
+                for keys, group in groups.items():
+                    g_rows = list(dict.fromkeys(row_of[q.text] for q in group))
+                    local = {r: n for n, r in enumerate(g_rows)}
+                    with self.indexes.rw.read():
+                        S, P = self.partitions.search(Q[g_rows], list(keys), max(q.top_k for q in group))
+                    for q in group:
+                        r = local[row_of[q.text]]
+                        out[q.key] = [(int(i), float(sc)) for i, sc in zip(P[r, :q.top_k].tolist(), S[r, :q.top_k].tolist())]
+                return out
+
+            # Sans partitions, les filtres s'appliquent après coup: la profondeur est
+            # élargie à proportion de la part des lignes (pays, expérience) visées
+            with self.indexes.rw.read():
+                # Colonnes lues sous le verrou: add_vectors les étend champ par champ
+                depth = {q.key: self._scoped_depth(q) for q in queries}
+                k_max = min(max(depth.values()), self.index.ntotal)
+                scores, idxs = self.index.search(Q, k_max)
+            for q in queries:
+                r, k = row_of[q.text], depth[q.key]
+                out[q.key] = self._filter_hits(scores[r, :k], idxs[r, :k], q.experiences, q.top_k, q.countries)
+            return out
+
+    def _scoped_depth(self, q: RetrievalQuery) -> int:
+        """Profondeur FAISS d'une requête filtrée pays sur l'index global (même rappel que les partitions)."""
+        if q.countries is None:
+            return q.k
+        cols = self.columns
+        n = len(self.rows)
+        keep = np.isin(cols.country[:n], cols.codes("country", q.countries))
+        keep &= np.isin(cols.experience[:n], cols.codes("experience", q.experiences))
+        scoped = int(np.count_nonzero(keep))
+        if not scoped:
+            return q.k
+        return min(n, int(np.ceil(q.k * n / scoped)))
+
+    def search(self, job_title: str, location: str, experience_years: int, top_k: int = 200) -> List[Tuple[int, float]]:
+        """
+        Voisins du profil limités au pays déduit de `location` (toutes les partitions
+        si la localisation est inconnue, pays "Global"), expérience compatible.
+        """
+        if (self.index is None) or (not self.rows):
+            ok = self.build_or_load_faiss()
+            if not ok:
+                return []
+        q = self._search_query("search", job_title, location, experience_years, top_k, self._country_scope(location))
+        return self.run_queries([q])["search"]
+
+    def search_with_experience_priority(self, job_title: str, location: str, experience_years: int, top_k: int = 200) -> List[Tuple[int, float]]:
+        """Recherche avec priorité stricte sur l'expérience (toutes les variantes en un lot)"""
+        queries = self._priority_queries("loc", job_title, location, experience_years, top_k, self._country_scope(location))
+        return self._merge_priority("loc", self.run_queries(queries), top_k)
+
     def _search_by_criteria(self, job_title: str, location: str, experience: str, top_k: int) -> List[Tuple[int, float]]:
         """Recherche par critères spécifiques"""
-        if (self.index is None) or (not self.rows):
-            return []
-            
+        q = RetrievalQuery("criteria", self._criteria_text(job_title, location, experience), [experience],
+                           top_k * 2, top_k, self._country_scope(location))
+        return self.run_queries([q])["criteria"]
+
+    def retrieve_for_analysis(self, job_title: str, location: str, experience_years: int,
+                              top_k: int = 100, neighbors_k: int = 8) -> Dict[str, Any]:
+        """
+        Planifie toute la cascade ville -> pays -> marché + les voisins en une seule
+        passe d'encodage/recherche, puis applique la cascade en mémoire.
+        Les niveaux ville/pays et les voisins sont restreints au pays de `location`,
+        le niveau marché aux pays indexés de ce marché.
+        """
         city, country = guess_city_country(location)
         market = get_market_from_country(country)
-        location_context = city or country or location
-        
-        q_text = f"{_clean(job_title)} | {_clean(location_context)} | {country} | {market} | {experience}"
-        q_emb = self.model.encode([q_text], convert_to_numpy=True, normalize_embeddings=True).astype("float32")
-        scores, idxs = self.index.search(q_emb, top_k * 2)
-        
-        # Filtrer par expérience exacte depuis la DB
-        results = []
-        for i, s in zip(idxs[0].tolist(), scores[0].tolist()):
-            if 0 <= i < len(self.rows):
-                row_id = self.id_map[i]
-                try:
-                    ds = supabase.table("salary_dataset").select("experience").eq("id", row_id).single().execute().data
-                    if ds and ds.get("experience") == experience:
-                        results.append((int(i), float(s)))
-                        if len(results) >= top_k:
-                            break
-                except:
-                    continue
-                    
-        return results
+        target_experience = years_str(experience_years)
+
+        # Partitions pays interrogées à chaque niveau de la cascade
+        scope = None if country == "Global" else [country]
+        queries: List[RetrievalQuery] = []
+        if city:
+            queries += self._priority_queries("city", job_title, city, experience_years, top_k, scope)
+        if country != "Global":
+            queries += self._priority_queries("country", job_title, country, experience_years, top_k, scope)
+        queries.append(self._search_query("market", job_title, market, experience_years, 50, self._market_scope(market)))
+        queries.append(self._search_query("neighbors", job_title, location, experience_years, neighbors_k, scope))
+        results = self.run_queries(queries)
+
+        matches: List[Tuple[int, float]] = []
+        search_contexts: List[str] = []
+
+        # 1. Recherche prioritaire avec expérience exacte
+        if city:
+            matches = self._merge_priority("city", results, top_k)
+            search_contexts.append(f"ville: {city}, exp: {target_experience}")
+
+        # 2. Si pas assez, élargir au pays avec expérience prioritaire
+        if len(matches) < 10 and country != "Global":
+            existing_ids = {idx for idx, _ in matches}
+            for idx, score in self._merge_priority("country", results, top_k):
+                if idx not in existing_ids:
+                    matches.append((idx, score))
+            search_contexts.append(f"pays: {country}, exp: {target_experience}")
+
+        # 3. En dernier recours, recherche par marché avec expérience élargie
+        if len(matches) < 15:
+            existing_ids = {idx for idx, _ in matches}
+            for idx, score in results["market"]:
+                if idx not in existing_ids:
+                    matches.append((idx, score))
+            search_contexts.append(f"marché: {market}")
+
+        return {
+            "matches": sorted(matches, key=lambda x: x[1], reverse=True)[:top_k],
+            "neighbors": results["neighbors"],
+            "search_contexts": search_contexts,
+            "queries": len(queries),
+        }
 
     def aggregate_matches(self, matches: List[Tuple[int, float]]) -> Dict[str, Any]:
         if not matches:
             return {"count": 0}
             
-        arr = np.array([self.rows[i].salary for i, _ in matches], dtype="float64")
-        markets = [self.rows[i].market for i, _ in matches]
-        countries = [self.rows[i].country for i, _ in matches]
+        pos = np.fromiter((i for i, _ in matches), dtype=np.int64, count=len(matches))
+        arr = self.columns.salary[pos]
+        minv, p25, median, p75, maxv = np.percentile(arr, [0, 25, 50, 75, 100])
         
         # Statistiques du marché dominant
-        from collections import Counter
-        market_counts = Counter(markets)
-        dominant_market = market_counts.most_common(1)[0][0] if market_counts else "Marché Global"
+        market_counts = np.bincount(self.columns.market[pos], minlength=len(self.columns.vocab["market"]))
+        dominant_market = self.columns.labels("market")[int(np.argmax(market_counts))]
         
         return {
             "count": int(len(matches)),
-            "min": float(np.min(arr)),
-            "max": float(np.max(arr)),
-            "mean": float(np.mean(arr)),
-            "median": float(np.median(arr)),
-            "p25": float(np.percentile(arr, 25)),
-            "p75": float(np.percentile(arr, 75)),
+            "min": float(minv),
+            "max": float(maxv),
+            "mean": float(arr.mean()),
+            "median": float(median),
+            "p25": float(p25),
+            "p75": float(p75),
             "dominant_market": dominant_market,
-            "market_distribution": dict(market_counts),
-            "country_distribution": dict(Counter(countries))
+            "market_distribution": self.columns.distribution("market", pos),
+            "country_distribution": self.columns.distribution("country", pos),
         }
 
-    def nearest_neighbors(self, job_title: str, location: str, experience_years: int, top_k: int = 8) -> List[Dict[str, Any]]:
-        matches = self.search(job_title, location, experience_years, top_k=top_k)
+    def _neighbors_from_matches(self, matches: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
         out = []
         for i, score in matches:
             r = self.rows[i]
@@ -693,6 +1434,12 @@ Estime une fourchette réaliste pour ce marché. Réponds UNIQUEMENT:
             })
         return out
 
+    def nearest_neighbors(self, job_title: str, location: str, experience_years: int, top_k: int = 8) -> List[Dict[str, Any]]:
+        if (self.index is None) or (not self.rows):
+            self.build_or_load_faiss()
+        with self.indexes.pinned():
+            return self._neighbors_from_matches(self.search(job_title, location, experience_years, top_k=top_k))
+
     # ---------- analyse Gemini améliorée ----------
     def _build_prompt(self, job_title: str, location: str, experience_years: int, current_salary: int,
                       stats: Dict[str, Any], percentile: int, neighbors: List[Dict[str, Any]]) -> str:
@@ -758,99 +1505,171 @@ Rends exactement ce JSON:
 }}
 """.strip()
 
-    def analyze_with_gemini(self, job_title: str, location: str, experience_years: int, current_salary: int) -> Dict[str, Any]:
-        self.ensure_faiss_ready()
-        
-        # Recherche progressive pour maximiser les résultats
-        city, country = guess_city_country(location)
-        market = get_market_from_country(country)
-        
-        matches = []
-        search_contexts = []
-        
-        # 1. Recherche par ville si disponible
-        if city:
-            matches = self.search(job_title, city, experience_years, top_k=200)
-            search_contexts.append(f"ville: {city}")
-            
-        # 2. Si pas assez, recherche par pays
-        if len(matches) < 20 and country != "Global":
-            country_matches = self.search(job_title, country, experience_years, top_k=200)
-            matches.extend(country_matches)
-            search_contexts.append(f"pays: {country}")
-            
-        # 3. Si encore insuffisant, recherche par marché
-        if len(matches) < 30:
-            market_matches = self.search(job_title, market, experience_years, top_k=200)
-            matches.extend(market_matches)
-            search_contexts.append(f"marché: {market}")
-            
-        # Supprimer les doublons tout en gardant les scores
-        unique_matches = {}
-        for idx, score in matches:
-            if idx not in unique_matches or score > unique_matches[idx]:
-                unique_matches[idx] = score
-        matches = [(idx, score) for idx, score in unique_matches.items()]
-        
-        stats = self.aggregate_matches(matches)
-        
-    def analyze_with_gemini(self, job_title: str, location: str, experience_years: int, current_salary: int) -> Dict[str, Any]:
+    def compute_market_stats(self, job_title: str, location: str, experience_years: int, current_salary: int) -> Dict[str, Any]:
+        """Partie numérique de l'analyse (retrieval + stats), sans appel LLM."""
         self.ensure_faiss_ready()
         
         city, country = guess_city_country(location)
         market = get_market_from_country(country)
-        target_experience = years_str(experience_years)
-        
-        # Recherche progressive AVEC filtrage par expérience
-        matches = []
-        search_contexts = []
-        
-        # 1. Recherche prioritaire avec expérience exacte
-        if city:
-            matches = self.search_with_experience_priority(job_title, city, experience_years, top_k=100)
-            search_contexts.append(f"ville: {city}, exp: {target_experience}")
-            
-        # 2. Si pas assez, élargir au pays avec expérience prioritaire  
-        if len(matches) < 10 and country != "Global":
-            country_matches = self.search_with_experience_priority(job_title, country, experience_years, top_k=100)
-            # Ajouter uniquement les nouveaux
-            existing_ids = {idx for idx, _ in matches}
-            for idx, score in country_matches:
-                if idx not in existing_ids:
-                    matches.append((idx, score))
-            search_contexts.append(f"pays: {country}, exp: {target_experience}")
-            
-        # 3. En dernier recours, recherche par marché avec expérience élargie
-        if len(matches) < 15:
-            market_matches = self.search(job_title, market, experience_years, top_k=50)
-            existing_ids = {idx for idx, _ in matches}
-            for idx, score in market_matches:
-                if idx not in existing_ids:
-                    matches.append((idx, score))
-            search_contexts.append(f"marché: {market}")
-            
-        # Trier par score décroissant et limiter
-        matches = sorted(matches, key=lambda x: x[1], reverse=True)[:100]
         
-        stats = self.aggregate_matches(matches)
+        # Cascade ville -> pays -> marché + voisins: un seul encode et un seul index.search
+        with self.indexes.pinned():
+            retrieval = self.retrieve_for_analysis(job_title, location, experience_years, top_k=100, neighbors_k=8)
+            matches = retrieval["matches"]
+            search_contexts = retrieval["search_contexts"]
+
+            stats = self.aggregate_matches(matches)
+            neighbors = self._neighbors_from_matches(retrieval["neighbors"])
         
         # Log pour debugging
         print(f"DEBUG: {job_title}, {location}, {experience_years} ans → {len(matches)} matches trouvés")
         print(f"DEBUG: Contextes de recherche: {search_contexts}")
         
-        if stats.get("count", 0) >= 5:
+        analysis = {
+            "stats": stats,
+            "market": market,
+            "search_contexts": search_contexts,
+            "neighbors": neighbors,
+            "sufficient": stats.get("count", 0) >= 5,
+        }
+        if analysis["sufficient"]:
             # Assez de données réelles pour une analyse fiable
             rng = max(1.0, stats["max"] - stats["min"])
-            percentile = int(np.clip((current_salary - stats["min"]) / rng * 100, 0, 100))
-            market_used = stats.get("dominant_market", market)
+            analysis["percentile"] = int(np.clip((current_salary - stats["min"]) / rng * 100, 0, 100))
+            analysis["market_used"] = stats.get("dominant_market", market)
+        return analysis
+
+    def _stats_result(self, current_salary: int, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Résultat complet dérivé uniquement des stats du dataset (narratif par défaut)."""
+        stats, percentile = analysis["stats"], analysis["percentile"]
+        market_used, search_contexts = analysis["market_used"], analysis["search_contexts"]
+        return {
+            "moyenne": int(stats["median"]),
+            "ecart": int(stats["median"] - current_salary),
+            "ecart_pourcent": round(((stats["median"] - max(1, current_salary)) / max(1, current_salary) * 100), 1),
+            "minimum": int(stats["p25"]), 
+            "maximum": int(stats["p75"]),
+            "percentile": percentile, 
+            "recommandations": [
+                {
+                    "title": f"Analyse {market_used}",
+                    "description": f"Positionnement estimé au {percentile}e percentile sur le {market_used}.",
+                    "priority": "medium"
+                }
+            ], 
+            "tendances": [
+                {
+                    "title": f"Tendance {market_used}",
+                    "detail": f"Médiane estimée: {stats['median']} MAD/mois sur le {market_used}."
+                }
+            ], 
+            "etapes": [
+                {"numero": 1, "contenu": f"Analyser le contexte du {market_used}."},
+                {"numero": 2, "contenu": "Comparer avec les médianes du marché."},
+                {"numero": 3, "contenu": "Préparer une négociation basée sur les données."}
+            ],
+            "dataQuality": {
+                "source": "supabase", 
+                "unit": "MAD/mois", 
+                "sampleSize": int(stats.get("count", 0)),
+                "marketAnalyzed": market_used,
+                "searchContexts": search_contexts
+            },
+            "marketUsed": market_used,
+        }
+
+    def fast_analysis(self, job_title: str, location: str, experience_years: int, current_salary: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Phase 1 de l'analyse en deux temps: chiffres issus du dataset uniquement
+        (moyenne, min/max, percentile, dataQuality). Retourne aussi le contexte
+        `analysis` à passer à complete_analysis() pour la phase narrative.
+        """
+        analysis = self.compute_market_stats(job_title, location, experience_years, current_salary)
+        if analysis["sufficient"]:
+            result = self._stats_result(current_salary, analysis)
         else:
-            # PAS assez de données → Demander au LLM de faire l'analyse complète
-            return self._analyze_with_llm_only(job_title, location, experience_years, current_salary, market)
+            # Pas assez de données: estimation provisoire, le LLM complétera en phase 2
+            market = analysis["market"]
+            result = {
+                "moyenne": current_salary,
+                "ecart": 0,
+                "ecart_pourcent": 0.0,
+                "minimum": int(current_salary * 0.8),
+                "maximum": int(current_salary * 1.2),
+                "percentile": 50,
+                "dataQuality": {"source": "fallback", "unit": "MAD/mois", "sampleSize": int(analysis["stats"].get("count", 0)),
+                                "marketAnalyzed": market, "searchContexts": analysis["search_contexts"], "provisional": True},
+                "marketUsed": market,
+            }
+        for key in ("recommandations", "tendances", "etapes"):
+            result.pop(key, None)
+        return result, analysis
+
+    def _finalize_narrative(self, raw: Optional[str], current_salary: int, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse la réponse Gemini de la phase 2, ou renvoie le résultat de secours."""
+        if not analysis["sufficient"]:
+            try:
+                if raw is None:
+                    raise RuntimeError("réponse LLM absente")
+                return _parse_llm_json(raw)
+            except Exception as e:
+                print(f"Erreur analyse LLM pure: {e}")
+                return self._llm_only_fallback(current_salary, analysis["market"])
+
+        market_used = analysis["market_used"]
+        try:
+            if raw is None:
+                raise RuntimeError("réponse LLM absente")
+            result = _parse_llm_json(raw)
             
-    def _analyze_with_llm_only(self, job_title: str, location: str, experience_years: int, current_salary: int, market: str) -> Dict[str, Any]:
-        """Analyse complète par LLM quand pas assez de données dans le dataset"""
+            # S'assurer que marketUsed est défini
+            if "marketUsed" not in result:
+                result["marketUsed"] = market_used
+            if "dataQuality" in result and "marketAnalyzed" not in result["dataQuality"]:
+                result["dataQuality"]["marketAnalyzed"] = market_used
+                
+            return result
+            
+        except Exception as e:
+            print(f"Erreur Gemini: {str(e)}")
+            return self._stats_result(current_salary, analysis)
+
+    def _narrative_prompt(self, job_title: str, location: str, experience_years: int, current_salary: int,
+                          analysis: Dict[str, Any]) -> str:
+        if not analysis["sufficient"]:
+            # PAS assez de données → Demander au LLM de faire l'analyse complète
+            return self._llm_only_prompt(job_title, location, experience_years, current_salary, analysis["market"])
+        return self._build_prompt(job_title, location, experience_years, current_salary,
+                                  analysis["stats"], analysis["percentile"], analysis["neighbors"])
+
+    def complete_analysis(self, job_title: str, location: str, experience_years: int, current_salary: int,
+                          analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Phase 2: narratif Gemini (recommandations, tendances, étapes) à partir des stats déjà calculées."""
+        prompt = self._narrative_prompt(job_title, location, experience_years, current_salary, analysis)
         try:
-            prompt = f"""
+            raw = call_gemini_api(prompt)
+        except Exception as e:
+            print(f"Erreur appel Gemini: {str(e)}")
+            raw = None
+        return self._finalize_narrative(raw, current_salary, analysis)
+
+    async def acomplete_analysis(self, job_title: str, location: str, experience_years: int, current_salary: int,
+                                 analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Variante async de complete_analysis: l'attente Gemini ne bloque pas la boucle d'événements."""
+        prompt = self._narrative_prompt(job_title, location, experience_years, current_salary, analysis)
+        try:
+            raw = await acall_gemini_api(prompt)
+        except Exception as e:
+            print(f"Erreur appel Gemini: {str(e)}")
+            raw = None
+        return self._finalize_narrative(raw, current_salary, analysis)
+
+    def analyze_with_gemini(self, job_title: str, location: str, experience_years: int, current_salary: int) -> Dict[str, Any]:
+        analysis = self.compute_market_stats(job_title, location, experience_years, current_salary)
+        return self.complete_analysis(job_title, location, experience_years, current_salary, analysis)
+            
+    def _llm_only_prompt(self, job_title: str, location: str, experience_years: int, current_salary: int, market: str) -> str:
+        return f"""
 Tu es un expert RH international. Analyse ce profil salarial en te basant sur tes connaissances du marché.
 
 PROFIL:
@@ -898,152 +1717,82 @@ Réponds exactement en JSON:
   "marketUsed": "{market}"
 }}
 """
-            
-            response = call_gemini_api(prompt)
-            cleaned = response.strip()
-            if cleaned.startswith("```"):
-                cleaned = cleaned.removeprefix("```json").removeprefix("```").strip()
-            if cleaned.endswith("```"):
-                cleaned = cleaned.removesuffix("```").strip()
-                
-            return json.loads(cleaned)
-            
-        except Exception as e:
-            print(f"Erreur analyse LLM pure: {e}")
-            # Fallback minimal
-            return {
-                "moyenne": current_salary,
-                "ecart": 0,
-                "ecart_pourcent": 0.0,
-                "minimum": int(current_salary * 0.8),
-                "maximum": int(current_salary * 1.2), 
-                "percentile": 50,
-                "recommandations": [{"title": "Données insuffisantes", "description": "Pas assez de données pour une analyse précise", "priority": "low"}],
-                "tendances": [{"title": "Analyse limitée", "detail": "Données insuffisantes dans le dataset"}],
-                "etapes": [{"numero": 1, "contenu": "Collecter plus de données de marché"}],
-                "dataQuality": {"source": "fallback", "unit": "MAD/mois", "sampleSize": 0, "marketAnalyzed": market},
-                "marketUsed": market
-            }
 
-        neighbors = self.nearest_neighbors(job_title, location, experience_years, top_k=8)
-        prompt = self._build_prompt(job_title, location, experience_years, current_salary, stats, percentile, neighbors)
-        
-        try:
-            raw = call_gemini_api(prompt)
-            cleaned = raw.strip()
-            if cleaned.startswith("```"): 
-                cleaned = cleaned.removeprefix("```json").removeprefix("```").strip()
-            if cleaned.endswith("```"):   
-                cleaned = cleaned.removesuffix("```").strip()
-                
-            result = json.loads(cleaned)
-            
-            # S'assurer que marketUsed est défini
-            if "marketUsed" not in result:
-                result["marketUsed"] = market_used
-            if "dataQuality" in result and "marketAnalyzed" not in result["dataQuality"]:
-                result["dataQuality"]["marketAnalyzed"] = market_used
-                
-            return result
-            
-        except Exception as e:
-            print(f"Erreur Gemini: {str(e)}")
-            return {
-                "moyenne": int(stats["median"]),
-                "ecart": int(stats["median"] - current_salary),
-                "ecart_pourcent": round(((stats["median"] - max(1, current_salary)) / max(1, current_salary) * 100), 1),
-                "minimum": int(stats["p25"]), 
-                "maximum": int(stats["p75"]),
-                "percentile": percentile, 
-                "recommandations": [
-                    {
-                        "title": f"Analyse {market_used}",
-                        "description": f"Positionnement estimé au {percentile}e percentile sur le {market_used}.",
-                        "priority": "medium"
-                    }
-                ], 
-                "tendances": [
-                    {
-                        "title": f"Tendance {market_used}",
-                        "detail": f"Médiane estimée: {stats['median']} MAD/mois sur le {market_used}."
-                    }
-                ], 
-                "etapes": [
-                    {"numero": 1, "contenu": f"Analyser le contexte du {market_used}."},
-                    {"numero": 2, "contenu": "Comparer avec les médianes du marché."},
-                    {"numero": 3, "contenu": "Préparer une négociation basée sur les données."}
-                ],
-                "dataQuality": {
-                    "source": "supabase", 
-                    "unit": "MAD/mois", 
-                    "sampleSize": int(stats.get("count", 0)),
-                    "marketAnalyzed": market_used,
-                    "searchContexts": search_contexts
-                },
-                "marketUsed": market_used,
-            }
+    def _llm_only_fallback(self, current_salary: int, market: str) -> Dict[str, Any]:
+        # Fallback minimal
+        return {
+            "moyenne": current_salary,
+            "ecart": 0,
+            "ecart_pourcent": 0.0,
+            "minimum": int(current_salary * 0.8),
+            "maximum": int(current_salary * 1.2), 
+            "percentile": 50,
+            "recommandations": [{"title": "Données insuffisantes", "description": "Pas assez de données pour une analyse précise", "priority": "low"}],
+            "tendances": [{"title": "Analyse limitée", "detail": "Données insuffisantes dans le dataset"}],
+            "etapes": [{"numero": 1, "contenu": "Collecter plus de données de marché"}],
+            "dataQuality": {"source": "fallback", "unit": "MAD/mois", "sampleSize": 0, "marketAnalyzed": market},
+            "marketUsed": market
+        }
 
     def debug_search_process(self, job_title: str, location: str, experience_years: int) -> Dict[str, Any]:
         """Fonction debug pour tracer le processus de recherche"""
-        target_exp = years_str(experience_years)
-        city, country = guess_city_country(location)
-        
-        # Compter les profils par expérience dans le dataset
-        experience_counts = {}
-        location_counts = {}
+        with self.indexes.pinned():
+            target_exp = years_str(experience_years)
+            city, country = guess_city_country(location)
         
-        for row in self.rows:
-            exp = row.experience_level
-            loc = row.location
-            experience_counts[exp] = experience_counts.get(exp, 0) + 1
-            location_counts[loc] = location_counts.get(loc, 0) + 1
+            # Distributions du dataset (pré-calculées au build)
+            experience_counts = self.columns.distribution("experience")
+            location_counts = self.columns.distribution("city")
             
-        # Test des différentes recherches
-        exact_matches = self._search_by_criteria(job_title, location, target_exp, 50)
-        broad_matches = self.search_with_experience_priority(job_title, location, experience_years, 50)
+            # Test des différentes recherches
+            exact_matches = self._search_by_criteria(job_title, location, target_exp, 50)
+            broad_matches = self.search_with_experience_priority(job_title, location, experience_years, 50)
         
-        return {
-            "query": {
-                "job_title": job_title,
-                "location": location, 
-                "experience_years": experience_years,
-                "target_experience": target_exp,
-                "deduced_city": city,
-                "deduced_country": country
-            },
-            "dataset_stats": {
-                "total_rows": len(self.rows),
-                "experience_distribution": experience_counts,
-                "location_distribution": location_counts
-            },
-            "search_results": {
-                "exact_experience_matches": len(exact_matches),
-                "priority_experience_matches": len(broad_matches),
-                "exact_match_ids": [self.id_map[i] for i, _ in exact_matches[:5]],
-                "broad_match_ids": [self.id_map[i] for i, _ in broad_matches[:5]]
+            return {
+                "query": {
+                    "job_title": job_title,
+                    "location": location, 
+                    "experience_years": experience_years,
+                    "target_experience": target_exp,
+                    "deduced_city": city,
+                    "deduced_country": country
+                },
+                "dataset_stats": {
+                    "total_rows": len(self.rows),
+                    "experience_distribution": experience_counts,
+                    "location_distribution": location_counts
+                },
+                "search_results": {
+                    "exact_experience_matches": len(exact_matches),
+                    "priority_experience_matches": len(broad_matches),
+                    "exact_match_ids": [self.id_map[i] for i, _ in exact_matches[:5]],
+                    "broad_match_ids": [self.id_map[i] for i, _ in broad_matches[:5]]
+                }
             }
-        }
 
     def status(self) -> dict:
         market_stats = {}
         if self.rows:
-            from collections import Counter
-            markets = [r.market for r in self.rows]
-            countries = [r.country for r in self.rows]
+            markets = self.columns.distribution("market")
             market_stats = {
-                "markets": dict(Counter(markets)),
-                "countries": dict(Counter(countries)),
-                "total_markets": len(set(markets))
+                "markets": markets,
+                "countries": self.columns.distribution("country"),
+                "total_markets": len(markets)
             }
             
         return {
             "faissLoaded": self.index is not None and len(self.rows) > 0,
             "rows": len(self.rows), 
             "idMapSize": len(self.id_map),
-            "indexPath": os.path.abspath(INDEX_PATH), 
-            "mapPath": os.path.abspath(MAP_PATH),
+            "index": self.indexes.stats(),
+            "deltaVectors": self.delta_count,
             "model": SALARY_EMBED_MODEL,
             "supportedMarkets": list(CITIES_DATABASE.keys()),
+            "metadataLoad": self.load_stats,
+            "cohorts": len(self.cohorts.tables),
+            "partitionedSearch": self.partitions is not None,
+            "partitions": self.partitions.sizes(self.columns) if self.partitions is not None else {},
+            "locationCache": location_resolver.cache_info()._asdict(),
             **market_stats
         }
 
@@ -0,0 +1,97 @@
+# services/work_queue.py
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Callable, Dict
+
+# Uploads traités simultanément (étapes CPU) et uploads admis en attente au-delà
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "0")) or min(4, os.cpu_count() or 2)
+UPLOAD_MAX_PENDING = int(os.getenv("UPLOAD_MAX_PENDING", "8"))
+
+
+class Overloaded(Exception):
+    """File pleine: la requête doit être retentée après `retry_after` secondes."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"file pleine, réessayer dans {retry_after}s")
+        self.retry_after = retry_after
+
+
+class BoundedWorkQueue:
+    """
+    Exécuteur borné avec contrôle d'admission pour les requêtes lourdes.
+
+    - admit(): une requête occupe un jeton de son entrée à sa sortie; au-delà de
+      `workers + max_pending` jetons, Overloaded est levée immédiatement (429)
+      avec une estimation du délai d'attente tirée de la durée moyenne observée.
+    - run(fn, ...): exécute une étape CPU (encodage, FAISS, extraction) dans le
+      pool de `workers` threads sans bloquer la boucle d'événements.
+    """
+
+    def __init__(self, name: str, workers: int = UPLOAD_WORKERS, max_pending: int = UPLOAD_MAX_PENDING):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._avg_seconds = 0.0   # moyenne glissante de la durée d'une requête admise
+        self._stats = {"admitted": 0, "rejected": 0, "completed": 0}
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_pending
+
+    def retry_after(self) -> int:
+        with self._lock:
+            waiting = max(1, self._inflight - self.workers + 1)
+            avg = self._avg_seconds or 1.0
+        return int(min(60, max(1, math.ceil(avg * waiting / self.workers))))
+
+    @asynccontextmanager
+    async def admit(self):
+        with self._lock:
+            full = self._inflight >= self.capacity
+            if full:
+                self._stats["rejected"] += 1
+            else:
+                self._inflight += 1
+                self._stats["admitted"] += 1
+        if full:
+            raise Overloaded(self.retry_after())
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                self._inflight -= 1
+                self._stats["completed"] += 1
+                self._avg_seconds = elapsed if not self._avg_seconds else 0.8 * self._avg_seconds + 0.2 * elapsed
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                **self._stats,
+                "inflight": self._inflight,
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "avgSeconds": round(self._avg_seconds, 3),
+            }
+
+
+# Instance globale (uploads de documents)
+upload_queue = BoundedWorkQueue("upload")
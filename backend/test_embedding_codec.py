@@ -0,0 +1,45 @@
+# test_embedding_codec.py
+"""
+Tests du décodage par page des embeddings (services/embedding_codec.py).
+
+    python test_embedding_codec.py
+    python -m pytest test_embedding_codec.py
+"""
+
+import numpy as np
+
+from services.embedding_codec import decode_embeddings
+
+
+def _pg(v):
+    return "[" + ",".join(f"{x:.6f}" for x in v) + "]"
+
+
+def test_text_and_list_payloads():
+    rows = np.arange(12, dtype=np.float32).reshape(4, 3) / 10
+    payloads = [_pg(rows[0]), rows[1].tolist(), None, _pg(rows[3])]
+    X, valid = decode_embeddings(payloads, dim=3)
+    assert valid.tolist() == [True, True, False, True]
+    np.testing.assert_allclose(X, rows[[0, 1, 3]], rtol=1e-5)
+
+
+def test_malformed_row_is_skipped_not_fatal():
+    rows = np.arange(9, dtype=np.float32).reshape(3, 3) / 10
+    payloads = [_pg(rows[0]), "[0.1,abc,0.3]", _pg(rows[2])]
+    X, valid = decode_embeddings(payloads, dim=3)
+    assert valid.tolist() == [True, False, True]
+    np.testing.assert_allclose(X, rows[[0, 2]], rtol=1e-5)
+
+
+def test_wrong_dimension_is_skipped():
+    payloads = ["[1,2,3]", "[1,2]", "[4,5,6]"]
+    X, valid = decode_embeddings(payloads)
+    assert valid.tolist() == [True, False, True]
+    assert X.shape == (2, 3)
+
+
+if __name__ == "__main__":
+    test_text_and_list_payloads()
+    test_malformed_row_is_skipped_not_fatal()
+    test_wrong_dimension_is_skipped()
+    print("✅ Tests OK")
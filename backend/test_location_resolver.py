@@ -0,0 +1,134 @@
+# test_location_resolver.py
+"""
+Tests de précision et micro-benchmark du résolveur de localisation compilé
+(services/location_resolver.py) face à l'ancien parcours linéaire.
+
+    python test_location_resolver.py        # tests + benchmark
+    python -m pytest test_location_resolver.py
+"""
+
+import time
+
+from services.location_resolver import (
+    CITIES_DATABASE, COUNTRY_KEYWORDS, LocationResolver, guess_city_country, _clean,
+)
+
+# (saisie, ville attendue, pays attendu)
+CASES = [
+    ("Casablanca", "Casablanca", "Maroc"),
+    ("casablanca, maroc", "Casablanca", "Maroc"),
+    ("Fès", "Fès", "Maroc"),
+    ("fes", "Fès", "Maroc"),
+    ("Meknes, Morocco", "Meknès", "Maroc"),
+    ("El Jadida", "El Jadida", "Maroc"),
+    ("Rabat, MA", "Rabat", "Maroc"),
+    ("Paris", "Paris", "France"),
+    ("Saint-Etienne", "Saint-Étienne", "France"),
+    ("New York, NY", "New York", "United States"),
+    ("San Francisco Bay Area", "San Francisco", "United States"),
+    ("Montréal", "Montreal", "Canada"),
+    ("St. Catharines, Ontario", "St. Catharines", "Canada"),
+    ("München", "München", "Germany"),
+    ("Munich, Germany", "Munich", "Germany"),
+    ("London, UK", "London", "United Kingdom"),
+    ("London, England", "London", "United Kingdom"),
+    ("London, Ontario, Canada", "London", "Canada"),
+    ("York", "York", "United Kingdom"),
+    # Mots-clés de pays seuls
+    ("Maroc", None, "Maroc"),
+    ("MA", None, "Maroc"),
+    ("Remote - USA", None, "United States"),
+    ("U.S.", None, "United States"),
+    ("états-unis", None, "United States"),
+    ("Deutschland", None, "Germany"),
+    ("fr", None, "France"),
+    # Faux positifs de l'ancienne recherche par sous-chaîne
+    ("Marché Global", "Marché Global", "Global"),
+    ("Remote", "Remote", "Global"),
+    ("Rue de la Paix", "Rue De La Paix", "Global"),
+    ("Aucune idée", "Aucune Idée", "Global"),
+    ("Messina", "Messina", "Global"),
+    ("Essen", "Essen", "Germany"),
+    ("", None, "Global"),
+]
+
+
+def _legacy_guess(location: str):
+    """Ancienne implémentation (double boucle + sous-chaîne), référence du benchmark."""
+    loc = _clean(location).lower()
+    if not loc:
+        return None, "Global"
+    for country, cities in CITIES_DATABASE.items():
+        for city in cities:
+            if city in loc:
+                return city.title().replace("Fes", "Fès").replace("Meknes", "Meknès"), country
+    for country, keywords in COUNTRY_KEYWORDS.items():
+        if any(keyword in loc for keyword in keywords):
+            return None, country
+    return (loc.split(",")[0].title(), "Global")
+
+
+def test_accuracy():
+    failures = []
+    for location, city, country in CASES:
+        got = guess_city_country(location)
+        if got != (city, country):
+            failures.append((location, got, (city, country)))
+    for f in failures:
+        print(f"❌ {f[0]!r}: obtenu {f[1]}, attendu {f[2]}")
+    assert not failures
+
+
+def test_every_city_resolves_to_its_country():
+    resolver = LocationResolver()
+    for country, cities in CITIES_DATABASE.items():
+        for city in cities:
+            _, got = resolver.resolve(f"{city}, {country}")
+            assert got == country, (city, country, got)
+
+
+def test_cache_hits_on_normalized_input():
+    resolver = LocationResolver()
+    resolver.resolve("Casablanca")
+    resolver.resolve("  casablanca ")
+    info = resolver.cache_info()
+    assert info.misses == 1 and info.hits == 1
+
+
+def benchmark(rounds: int = 2000):
+    inputs = [c[0] for c in CASES]
+    n = rounds * len(inputs)
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for loc in inputs:
+            _legacy_guess(loc)
+    legacy = time.perf_counter() - t0
+
+    cold = LocationResolver(cache_size=0)
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for loc in inputs:
+            cold.resolve(loc)
+    compiled = time.perf_counter() - t0
+
+    warm = LocationResolver()
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for loc in inputs:
+            warm.resolve(loc)
+    cached = time.perf_counter() - t0
+
+    print(f"⏱ {n} résolutions")
+    print(f"   - linéaire (ancien) : {legacy / n * 1e6:8.2f} µs/appel")
+    print(f"   - trie sans cache   : {compiled / n * 1e6:8.2f} µs/appel")
+    print(f"   - trie + LRU        : {cached / n * 1e6:8.2f} µs/appel")
+
+
+if __name__ == "__main__":
+    print("🔍 Tests de précision...")
+    test_accuracy()
+    test_every_city_resolves_to_its_country()
+    test_cache_hits_on_normalized_input()
+    print("✅ Tests OK")
+    benchmark()
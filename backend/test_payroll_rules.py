@@ -0,0 +1,72 @@
+# test_payroll_rules.py
+"""
+Tests du recalcul des retenues de bulletins marocains (services/payroll_rules.py)
+sur des bulletins calculés à la main.
+
+    python test_payroll_rules.py
+    python -m pytest test_payroll_rules.py
+"""
+
+import numpy as np
+
+from services.payroll_rules import PayrollRulesEngine, DEFAULT_RULES
+
+engine = PayrollRulesEngine(DEFAULT_RULES)
+
+# Bulletins 2024, célibataire sans charge de famille.
+# Brut 10 000: CNSS 6 000 × 4,48% = 268,80; AMO 226,00; frais pro 25% = 2 500,00
+# net imposable 7 005,20 -> IR 34% − 1 433,33 = 948,44; net 8 556,76
+# Brut 6 000: CNSS 268,80; AMO 135,60; frais pro 35% = 2 100,00
+# net imposable 3 495,60 -> IR 10% − 250 = 99,56; net 5 496,04
+PAYSLIPS_2024 = [
+    {"salaireBrut": 10000.0, "cnss": 268.80, "amo": 226.00, "frais_pro": 2500.00,
+     "net_imposable": 7005.20, "ir": 948.44, "salaireNet": 8556.76},
+    {"salaireBrut": 6000.0, "cnss": 268.80, "amo": 135.60, "frais_pro": 2100.00,
+     "net_imposable": 3495.60, "ir": 99.56, "salaireNet": 5496.04},
+]
+
+
+def test_compute_2024_known_payslips():
+    batch = engine.compute([p["salaireBrut"] for p in PAYSLIPS_2024], year=2024)
+    for j, p in enumerate(PAYSLIPS_2024):
+        row = batch.row(j)
+        for key in ("cnss", "amo", "frais_pro", "net_imposable", "ir"):
+            assert abs(row[key] - p[key]) <= 0.02, (p["salaireBrut"], key, row[key], p[key])
+        assert abs(row["net"] - p["salaireNet"]) <= 0.02
+
+
+def test_frais_pro_rate_and_cap_same_in_2024_and_2025():
+    brut = np.array([5000.0, 6500.0, 6500.01, 11000.0, 20000.0])
+    expected = [1750.0, 2275.0, 1625.0, 2750.0, 35000.0 / 12]
+    for year in (2024, 2025):
+        np.testing.assert_allclose(engine.compute(brut, year=year).frais_pro, expected, atol=0.01)
+
+
+def test_verify_2024_payslip_consistent():
+    p = {k: PAYSLIPS_2024[0][k] for k in ("salaireBrut", "cnss", "amo", "ir", "salaireNet")}
+    report = engine.verify({**p, "dependents": 0}, year=2024)
+    assert report["year"] == 2024
+    assert report["consistent"], report["anomalies"]
+
+
+def test_verify_2024_flags_wrong_ir():
+    p = {k: PAYSLIPS_2024[0][k] for k in ("salaireBrut", "cnss", "amo", "salaireNet")}
+    report = engine.verify({**p, "ir": 600.0, "dependents": 0}, year=2024)
+    assert not report["checks"]["ir"]["ok"]
+
+
+def test_verify_2024_missing_ir_not_checked():
+    # IR absent du bulletin (ligne non extraite): montant non contrôlé, pas d'anomalie
+    p = {k: PAYSLIPS_2024[0][k] for k in ("salaireBrut", "cnss", "amo", "salaireNet")}
+    report = engine.verify(p, year=2024)
+    assert "ir" not in report["checks"]
+    assert report["consistent"], report["anomalies"]
+
+
+if __name__ == "__main__":
+    test_compute_2024_known_payslips()
+    test_frais_pro_rate_and_cap_same_in_2024_and_2025()
+    test_verify_2024_payslip_consistent()
+    test_verify_2024_flags_wrong_ir()
+    test_verify_2024_missing_ir_not_checked()
+    print("✅ Tests OK")
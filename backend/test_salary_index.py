@@ -0,0 +1,314 @@
+# test_salary_index.py
+"""
+Tests de l'index salarial (services/supabase_salary_rag_service.py) contre une
+base PostgREST simulée en mémoire: construction, snapshot et watermark.
+
+    python test_salary_index.py
+    python -m pytest test_salary_index.py
+"""
+
+import json
+import os
+import tempfile
+import threading
+import zlib
+
+import faiss
+import numpy as np
+
+import services.supabase_salary_rag_service as salary_service
+from services.index_snapshots import IndexManager
+from services.supabase_salary_rag_service import SalaryIndexData, SupabaseSalaryRAGService
+
+DIM = 4
+
+
+class _Result:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _Query:
+    """Sous-ensemble du query builder postgrest-py utilisé par le service."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.embed = False
+        self.count = None
+        self.filters = []
+        self.chunk_filters = []
+        self.order_desc = False
+        self.n = None
+        self._negate = False
+
+    def select(self, columns, count=None):
+        self.embed = "salary_chunks!inner(" in columns
+        self.count = count
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def is_(self, col, value):
+        negate, self._negate = self._negate, False
+        test = (lambda v: v is not None) if negate else (lambda v: v is None)
+        if col.startswith("salary_chunks."):
+            field = col.split(".", 1)[1]
+            self.chunk_filters.append(lambda c: test(c.get(field)))
+        else:
+            self.filters.append(lambda r: test(r.get(col)))
+        return self
+
+    def or_(self, expr):
+        # "status.is.null,status.not.ilike.non*"
+        def match(r, cond):
+            col, op = cond.split(".", 1)
+            v = r.get(col)
+            if op == "is.null":
+                return v is None
+            if op.startswith("not.ilike."):
+                return v is None or not str(v).lower().startswith(op[len("not.ilike."):].rstrip("*"))
+            raise NotImplementedError(cond)
+        self.filters.append(lambda r: any(match(r, c) for c in expr.split(",")))
+        return self
+
+    def gt(self, col, value):
+        self.filters.append(lambda r: r[col] > value)
+        return self
+
+    def in_(self, col, values):
+        values = set(values)
+        self.filters.append(lambda r: r[col] in values)
+        return self
+
+    def order(self, col, desc=False):
+        self.order_desc = desc
+        return self
+
+    def limit(self, n):
+        self.n = n
+        return self
+
+    def execute(self):
+        rows = []
+        for r in self.db[self.table]:
+            r = dict(r)
+            if self.embed:
+                chunks = [dict(c) for c in self.db["salary_chunks"] if c["salary_row_id"] == r["id"]]
+                chunks = [c for c in chunks if all(f(c) for f in self.chunk_filters)]
+                if not chunks:
+                    continue
+                r["salary_chunks"] = chunks
+            if all(f(r) for f in self.filters):
+                rows.append(r)
+        rows.sort(key=lambda r: r["id"], reverse=self.order_desc)
+        count = len(rows) if self.count else None
+        return _Result(rows[:self.n] if self.n is not None else rows, count)
+
+
+class _FakeSupabase:
+    def __init__(self):
+        self.tables = {"salary_dataset": [], "salary_chunks": []}
+
+    def table(self, name):
+        return _Query(self.tables, name)
+
+    def add_row(self, rid, status="valide", embeddings=()):
+        self.tables["salary_dataset"].append({
+            "id": rid, "poste": f"Poste {rid}", "ville": "Casablanca", "pays": "Maroc",
+            "experience": "Junior", "salaire_moyen": 8000 + rid, "status": status,
+        })
+        for emb in embeddings:
+            cid = len(self.tables["salary_chunks"]) + 1
+            self.tables["salary_chunks"].append(
+                {"id": cid, "salary_row_id": rid, "content": f"chunk {cid}", "embedding": emb})
+
+
+class _Model:
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True):
+        X = np.vstack([_vec(zlib.crc32(t.encode())) for t in texts]).astype("float32")
+        return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+
+def _vec(seed):
+    return np.random.default_rng(seed).random(DIM).tolist()
+
+
+def _service(snapshot_dir):
+    """Service isolé sur `snapshot_dir` (le singleton du module n'est pas touché)."""
+    svc = SupabaseSalaryRAGService.__new__(SupabaseSalaryRAGService)
+    svc.model = _Model()
+    svc.indexes = IndexManager("salary", snapshot_dir)
+    svc.indexes.publish(None, [], SalaryIndexData.from_rows(None, []))
+    svc.load_stats = {}
+    svc.delta_count = 0
+    return svc
+
+
+def _with_db(db, fn):
+    saved = salary_service.supabase
+    salary_service.supabase = db
+    try:
+        return fn()
+    finally:
+        salary_service.supabase = saved
+
+
+def test_watermark_fresh_with_several_chunks_per_row():
+    db = _FakeSupabase()
+    db.add_row(1, embeddings=[_vec(1), _vec(2)])
+    db.add_row(2, embeddings=[_vec(3), _vec(4), _vec(5)])
+    db.add_row(3, status="non_valide", embeddings=[_vec(6)])
+    db.add_row(4, embeddings=[_vec(7), None])
+    db.add_row(5, embeddings=["[1,2]", "[]"])          # aucun embedding lisible
+    db.add_row(6, embeddings=["[0.1,oops]", _vec(8)])  # premier chunk illisible, second indexé
+
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            svc = _service(tmp)
+            assert svc.build_or_load_faiss()
+            assert svc.id_map == [1, 2, 4, 6]
+            assert svc.indexes.bundle.data.skipped == {5}
+            assert svc._resync_with_dataset() == "fresh"
+
+            # Redémarrage: snapshot + sidecar rechargés sans reconstruction
+            svc = _service(tmp)
+            assert svc.build_or_load_faiss()
+            assert svc.load_stats["source"] == "sidecar"
+            assert svc.load_stats["watermark"] == "fresh"
+            assert svc.indexes.bundle.data.skipped == {5}
+
+            # Lignes ajoutées depuis le snapshot: rattrapage incrémental, un vecteur par ligne
+            db.add_row(7, embeddings=["[1,2]", _vec(9)])
+            db.add_row(8, embeddings=[None, "[3]"])
+            svc = _service(tmp)
+            assert svc.build_or_load_faiss()
+            assert svc.load_stats["watermark"] == "caught-up"
+            assert svc.id_map == [1, 2, 4, 6, 7]
+            assert svc.indexes.bundle.data.skipped == {5, 8}
+            assert svc._resync_with_dataset() == "fresh"
+
+    _with_db(db, run)
+
+
+def _write_legacy(tmp, ids):
+    index = faiss.IndexFlatIP(DIM)
+    X = np.vstack([_vec(rid) for rid in ids]).astype("float32")
+    faiss.normalize_L2(X)
+    index.add(X)
+    paths = os.path.join(tmp, "supabase_salary_index.faiss"), os.path.join(tmp, "supabase_salary_index_map.json")
+    faiss.write_index(index, paths[0])
+    with open(paths[1], "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    return paths
+
+
+def test_legacy_flat_index_imported_into_first_snapshot():
+    db = _FakeSupabase()
+    for rid in range(1, 6):
+        db.add_row(rid, embeddings=[_vec(rid)])
+    saved = salary_service.LEGACY_INDEX_PATH, salary_service.LEGACY_MAP_PATH
+
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            salary_service.LEGACY_INDEX_PATH, salary_service.LEGACY_MAP_PATH = _write_legacy(tmp, [1, 2, 3, 4, 5])
+            svc = _service(os.path.join(tmp, "snapshots"))
+            assert svc.build_or_load_faiss()
+            assert svc.load_stats["source"] == "disk"
+            assert svc.load_stats["watermark"] == "fresh"
+            assert svc.id_map == [1, 2, 3, 4, 5] and svc.index.ntotal == 5
+
+            # Snapshot écrit: les redémarrages suivants ne relisent plus les fichiers plats
+            svc = _service(os.path.join(tmp, "snapshots"))
+            assert svc.build_or_load_faiss()
+            assert svc.load_stats["source"] == "sidecar"
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # Un vecteur par chunk (ids en double): ancien index ignoré, reconstruction depuis la base
+            salary_service.LEGACY_INDEX_PATH, salary_service.LEGACY_MAP_PATH = _write_legacy(tmp, [1, 1, 2, 3, 4, 5])
+            svc = _service(os.path.join(tmp, "snapshots"))
+            assert svc.build_or_load_faiss()
+            assert svc.load_stats["source"] == "supabase"
+            assert svc.id_map == [1, 2, 3, 4, 5]
+
+    try:
+        _with_db(db, run)
+    finally:
+        salary_service.LEGACY_INDEX_PATH, salary_service.LEGACY_MAP_PATH = saved
+
+
+def _concurrent_search_during_add_vectors(partitioned):
+    db = _FakeSupabase()
+    for rid in range(1, 201):
+        db.add_row(rid, embeddings=[_vec(rid)])
+    for ds in db.tables["salary_dataset"]:
+        ds["experience"] = ("0-2 ans", "3-5 ans", "6-10 ans")[ds["id"] % 3]
+        ds["pays"] = ("Maroc", "France")[ds["id"] % 2]
+
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            svc = _service(tmp)
+            assert svc.build_or_load_faiss()
+            assert (svc.partitions is not None) == partitioned
+            errors, done = [], threading.Event()
+
+            def writer():
+                try:
+                    for start in range(201, 601, 5):
+                        batch = [{"id": rid, "poste": f"Poste {rid}", "ville": "Rabat", "pays": "Maroc",
+                                  "experience": ("0-2 ans", "3-5 ans", "Nouveau niveau")[rid % 3],
+                                  "salaire_moyen": 9000 + rid, "status": "valide"}
+                                 for rid in range(start, start + 5)]
+                        svc.add_vectors(batch, np.vstack([_vec(ds["id"]) for ds in batch]), persist=False)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    done.set()
+
+            def reader():
+                try:
+                    while not done.is_set():
+                        with svc.indexes.pinned():
+                            hits = svc.search_with_experience_priority("Poste", "Casablanca, Maroc", 4, top_k=20)
+                            rows, id_map = svc.rows, svc.id_map
+                            for pos, _ in hits:
+                                assert rows[pos].id == id_map[pos]
+                                assert rows[pos].country == "Maroc"
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert not errors, errors
+            assert svc.index.ntotal == len(svc.id_map) == len(svc.rows) == len(svc.columns) == 600
+            assert svc.search("Poste", "Rabat, Maroc", 4, top_k=5)
+
+    saved = salary_service.PARTITIONED_SEARCH
+    salary_service.PARTITIONED_SEARCH = partitioned
+    try:
+        _with_db(db, run)
+    finally:
+        salary_service.PARTITIONED_SEARCH = saved
+
+
+def test_concurrent_search_during_add_vectors():
+    # Ajouts en place sous rw.write(), recherches sous rw.read(): positions toujours résolues
+    _concurrent_search_during_add_vectors(partitioned=True)
+    _concurrent_search_during_add_vectors(partitioned=False)
+
+
+if __name__ == "__main__":
+    test_watermark_fresh_with_several_chunks_per_row()
+    test_concurrent_search_during_add_vectors()
+    test_legacy_flat_index_imported_into_first_snapshot()
+    print("✅ Tests OK")